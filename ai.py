@@ -0,0 +1,626 @@
+"""  Placement evaluator and automatic player  """
+
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+import heapq
+from time import perf_counter_ns
+from typing import NamedTuple
+from engine import NB_ROWS, NB_COLUMNS, CELL_SIZE, Command, TetrominoShape, rotationsTable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Weights of the features of the board after a placement
+HEIGHT_WEIGHT = -0.510066
+LINES_WEIGHT = 0.760666
+HOLES_WEIGHT = -0.35663
+BUMPINESS_WEIGHT = -0.184483
+# Score of a placement which ends the game
+GAME_OVER_SCORE = -1e9
+# Beam search : pieces searched, boards kept per piece, placements followed
+# per unknown piece deeper than the first one and expansions cached
+BEAM_DEPTH = 3
+BEAM_WIDTH = 8
+EXPAND_WIDTH = 3
+CACHE_SIZE = 2048
+# Each of the 7 shapes is equally likely after the bag
+UNIFORM_SHAPES = tuple((shape,1/7) for shape in range(1,8))
+
+
+class Placement(NamedTuple):
+    '''where a tetromino lands when dropped in rotation rot from column ix'''
+    score: float
+    rot: int
+    ix: int
+    iy: int
+    nbLines: int
+
+
+def buildCandidates(shape: int, nbColumns: int)->list[tuple]:
+    '''the (rot, ix) of the distinct placements of a shape, every column of every rotation'''
+    candidates = []
+    seen = set()
+    for rot,state in enumerate(rotationsTable[shape]):
+        # The square has the same cells in its 4 rotations
+        if state.v in seen:
+            continue
+        seen.add(state.v)
+        for ix in range(-state.minX,nbColumns-state.maxX):
+            candidates.append((rot,ix))
+    return candidates
+
+
+def rowMasks(shape: int, rot: int, ix: int)->tuple:
+    '''the (dy, mask) of the 4 rows from minY of a placement, rows above the blocks have a 0 mask'''
+    state = rotationsTable[shape][rot]
+    masks = dict(state.rowMasks)
+    shift = ix + state.minX
+    return tuple((dy,masks.get(dy,0)<<shift) for dy in range(state.minY,state.minY+4))
+
+
+def scoreRows(rows: list[int], nbColumns: int)->tuple:
+    '''score of bitmask rows, returns (score, aggregate height, holes, bumpiness)
+
+    below[y] is the OR of the rows y and above, its bit x is set while y
+    is under the top of column x. Summing the bits of below gives the
+    aggregate height, the bits which differ from the next column the
+    bumpiness, and the empty ones the holes.
+    '''
+    neighbours = (1<<(nbColumns-1)) - 1
+    below = 0
+    aggregate = 0
+    nbFilled = 0
+    bumpiness = 0
+    for row in reversed(rows):
+        below |= row
+        aggregate += below.bit_count()
+        nbFilled += row.bit_count()
+        bumpiness += ((below ^ (below>>1)) & neighbours).bit_count()
+    nbHoles = aggregate - nbFilled
+    return HEIGHT_WEIGHT*aggregate + HOLES_WEIGHT*nbHoles + BUMPINESS_WEIGHT*bumpiness,aggregate,nbHoles,bumpiness
+
+
+def popcount(a):
+    '''number of bits set in each element of an unsigned integers array'''
+    if hasattr(np,'bitwise_count'):
+        return np.bitwise_count(a)
+    return POPCOUNT_TABLE[a.view(np.uint8)].reshape(a.shape+(a.itemsize,)).sum(axis=-1,dtype=np.uint8)
+
+POPCOUNT_TABLE = None if np is None else np.array([bin(i).count('1') for i in range(256)],dtype=np.uint8)
+
+
+class PlacementEvaluator:
+    '''Scores every placement of a tetromino dropped straight down
+
+    A placement is scored on the board left after it, from its aggregate
+    height, holes, bumpiness and completed lines. The board is handled as
+    the bitmask rows of the BitBoard. With NumPy a batch of boards is a
+    (rows, boards) array and all the placements of all the boards are
+    scored together, row by row, otherwise the rows are scanned in Python.
+    '''
+
+    def __init__(self, nbColumns: int = NB_COLUMNS, nbRows: int = NB_ROWS, fNumpy: bool = True):
+        self.nbColumns = nbColumns
+        self.nbRows = nbRows
+        self.fullRow = (1<<nbColumns) - 1
+        # The rows of the wider boards do not fit in a NumPy integer
+        self.fNumpy = fNumpy and np is not None and nbColumns<=64
+        self.candidates = [buildCandidates(shape,nbColumns) for shape in range(len(rotationsTable))]
+        self.masks = [[rowMasks(shape,rot,ix) for rot,ix in candidates]
+                      for shape,candidates in enumerate(self.candidates)]
+        if self.fNumpy:
+            # Smallest unsigned type holding a row, the arrays are memory bound
+            self.dtype = np.uint16 if nbColumns<=16 else np.uint32 if nbColumns<=32 else np.uint64
+            # Columns and row offsets of the 4 blocks of each candidate, to find where it lands
+            self.cellsX = []
+            self.cellsDy = []
+            # Row offsets and masks of the 4 rows of each candidate, to place it
+            self.rowsDy = []
+            self.rowsMask = []
+            for shape,candidates in enumerate(self.candidates):
+                v = [rotationsTable[shape][rot].v for rot,_ in candidates]
+                self.cellsX.append(np.array([[ix+vx for vx,_ in cells] for cells,(_,ix) in zip(v,candidates)],
+                                            dtype=np.intp).reshape(-1,4))
+                self.cellsDy.append(np.array([[vy for _,vy in cells] for cells in v],dtype=np.intp).reshape(-1,4))
+                self.rowsDy.append(np.array([[dy for dy,_ in m] for m in self.masks[shape]],dtype=np.intp).reshape(-1,4))
+                self.rowsMask.append(np.array([[mask for _,mask in m] for m in self.masks[shape]],
+                                              dtype=self.dtype).reshape(-1,4))
+            self.columnBits = np.array([1<<x for x in range(nbColumns)],dtype=self.dtype)
+            self.rowIds = np.arange(1,nbRows+1,dtype=np.intp)
+
+    def stackRows(self, boards: list)->'np.ndarray':
+        '''the rows of BitBoards as a (rows, boards) array'''
+        return np.array([board.rows for board in boards],dtype=self.dtype).T.copy()
+
+    def evaluateBatch(self, rows: 'np.ndarray', shape: int, fAfter: bool = False)->tuple:
+        '''score all the placements of shape on the (rows, n) batch of boards
+
+        Returns the (n, placements) scores, landing rows and completed lines
+        and, if fAfter, the (rows, n*placements) batch of the boards left
+        after each placement, otherwise None.
+        '''
+        nbRows = self.nbRows
+        dtype = self.dtype
+        n = rows.shape[1]
+        p = len(self.candidates[shape])
+        size = n*p
+        # Height of each column, the blocks land on the highest one under them
+        fBlocks = (rows[:,:,None] & self.columnBits) != 0
+        heights = (fBlocks*self.rowIds[:,None,None]).max(axis=0)
+        iy = (heights[:,self.cellsX[shape]] - self.cellsDy[shape]).max(axis=2)
+        # 4 spare rows on top for the blocks above the board
+        boards = np.zeros((nbRows+4,n,p),dtype=dtype)
+        boards[:nbRows] = rows[:,:,None]
+        boards = boards.reshape(nbRows+4,size)
+        ys = (iy[:,:,None] + self.rowsDy[shape]).reshape(size,4)
+        # The 4 rows of a placement are distinct, the flat indices too
+        indices = ys*size + np.arange(size)[:,None]
+        boards.reshape(-1)[indices] |= np.tile(self.rowsMask[shape],(n,1))
+        fOver = boards[nbRows-1:].any(axis=0)
+        top = max(int(ys.max()),int(heights.max())-1)
+        if fAfter:
+            erased = np.zeros((top+1,size),dtype=bool)
+
+        # From the top row down, below is the OR of the kept rows above
+        nbLines = np.zeros(size,dtype=np.int32)
+        aggregate = np.zeros(size,dtype=np.int32)
+        nbFilled = np.zeros(size,dtype=np.int32)
+        bumpiness = np.zeros(size,dtype=np.int32)
+        below = np.zeros(size,dtype=dtype)
+        fullRow = dtype(self.fullRow)
+        neighbours = dtype((1<<(self.nbColumns-1)) - 1)
+        one = dtype(1)
+        for y in range(top,-1,-1):
+            row = boards[y]
+            full = row == fullRow
+            if full.any():
+                nbLines += full
+                if fAfter:
+                    erased[y] = full
+                kept = ~full
+                row[full] = 0
+                below |= row
+                aggregate += popcount(below)*kept
+                bumpiness += popcount((below ^ (below>>one)) & neighbours)*kept
+            else:
+                below |= row
+                aggregate += popcount(below)
+                bumpiness += popcount((below ^ (below>>one)) & neighbours)
+            nbFilled += popcount(row)
+        nbHoles = aggregate - nbFilled
+        scores = HEIGHT_WEIGHT*aggregate + HOLES_WEIGHT*nbHoles + BUMPINESS_WEIGHT*bumpiness + LINES_WEIGHT*nbLines
+        scores[fOver] = GAME_OVER_SCORE
+        scores = scores.reshape(n,p)
+        nbLines = nbLines.reshape(n,p)
+        if not fAfter:
+            return scores,iy,nbLines,None
+
+        # Move down the kept rows, the erased ones are now 0
+        after = np.zeros((nbRows+4,size),dtype=dtype)
+        dst = np.arange(size)
+        flat = after.reshape(-1)
+        for y in range(0,top+1):
+            flat[dst] = boards[y]
+            dst += (~erased[y])*size
+        return scores,iy,nbLines,after[:nbRows]
+
+    def evaluateRows(self, rows: list[int], shape: int, heights: list[int] = None)->list[tuple]:
+        '''pure Python scoring of the placements of shape on bitmask rows
+
+        The column heights are computed from the rows when not given.
+        Returns the (score, iy, completed lines, rows after) of each candidate.
+        '''
+        nbRows = self.nbRows
+        nbColumns = self.nbColumns
+        fullRow = self.fullRow
+        if heights is None:
+            heights = [0]*nbColumns
+            below = 0
+            for y in range(nbRows-1,-1,-1):
+                new = rows[y] & ~below
+                below |= rows[y]
+                while new:
+                    bit = new & -new
+                    heights[bit.bit_length()-1] = y+1
+                    new ^= bit
+        results = []
+        for (rot,ix),masks in zip(self.candidates[shape],self.masks[shape]):
+            v = rotationsTable[shape][rot].v
+            iy = max(heights[ix+vx] - vy for vx,vy in v)
+            after = list(rows) + [0,0,0,0]
+            for dy,mask in masks:
+                after[iy+dy] |= mask
+            fOver = any(after[nbRows-1:])
+            after = [row for row in after if row != fullRow]
+            nbLines = nbRows+4 - len(after)
+            after = after[:nbRows] + [0]*(nbRows-len(after))
+            if fOver:
+                score = GAME_OVER_SCORE
+            else:
+                score = scoreRows(after,nbColumns)[0] + LINES_WEIGHT*nbLines
+            results.append((score,iy,nbLines,after))
+        return results
+
+    def placements(self, board, shape: int)->list[Placement]:
+        '''all the placements of shape on the board, in candidates order'''
+        if self.fNumpy:
+            scores,iy,nbLines,_ = self.evaluateBatch(self.stackRows((board,)),shape)
+            return [Placement(float(scores[0,i]),rot,ix,int(iy[0,i]),int(nbLines[0,i]))
+                    for i,(rot,ix) in enumerate(self.candidates[shape])]
+        return [Placement(score,rot,ix,iy,nbLines)
+                for (rot,ix),(score,iy,nbLines,_) in zip(self.candidates[shape],self.evaluateRows(board.rows,shape,board.heights))]
+
+    def best(self, board, shape: int, nextShape: int = TetrominoShape.NoShape)->Placement:
+        '''best placement of shape, looking one piece ahead when nextShape is given
+
+        With a look ahead a placement scores the completed lines it makes
+        plus the best score of the next piece on the board it leaves.
+        '''
+        candidates = self.candidates[shape]
+        if nextShape == TetrominoShape.NoShape:
+            placements = self.placements(board,shape)
+            return max(placements,key=lambda p: p.score)
+        if self.fNumpy:
+            scores,iy,nbLines,after = self.evaluateBatch(self.stackRows((board,)),shape,True)
+            nextScores,_,_,_ = self.evaluateBatch(after,nextShape)
+            totals = LINES_WEIGHT*nbLines[0] + nextScores.max(axis=1)
+            totals[scores[0] == GAME_OVER_SCORE] = GAME_OVER_SCORE
+            i = int(totals.argmax())
+            return Placement(float(totals[i]),candidates[i][0],candidates[i][1],int(iy[0,i]),int(nbLines[0,i]))
+        bestPlacement = None
+        for (rot,ix),(score,iy,nbLines,after) in zip(candidates,self.evaluateRows(board.rows,shape,board.heights)):
+            if score != GAME_OVER_SCORE:
+                score = LINES_WEIGHT*nbLines + max(r[0] for r in self.evaluateRows(after,nextShape))
+            if bestPlacement is None or score>bestPlacement.score:
+                bestPlacement = Placement(score,rot,ix,iy,nbLines)
+        return bestPlacement
+
+
+class AutoPlayer:
+    '''Plays the best placement of each tetromino through the Command inputs
+
+    commands(engine) returns the commands to queue before the next step,
+    the key is held until the tetromino slides into the target column,
+    so it works whatever the number of ticks between two calls.
+    '''
+
+    def __init__(self, evaluator: PlacementEvaluator = None, fLookAhead: bool = True):
+        self.evaluator = evaluator if evaluator is not None else PlacementEvaluator()
+        self.fLookAhead = fLookAhead
+        self.reset()
+        self.rotate = (Command.Rotate,)
+        self.left = (Command.MoveLeft,)
+        self.right = (Command.MoveRight,)
+        self.stop = (Command.StopMove,)
+        self.drop = (Command.HardDrop,)
+        self.none = ()
+
+    def reset(self):
+        '''forget the current tetromino, to call when the keys were released'''
+        self.nbPieces = -1
+        self.placement = None
+        self.nbRotations = 0
+        self.hVelocity = 0
+        self.lastX = 0
+        self.nbStalls = 0
+
+    def close(self):
+        '''nothing to release, the placements are chosen in the caller'''
+        pass
+
+    def choose(self, engine)->Placement:
+        board = engine.board
+        if board.nbColumns != self.evaluator.nbColumns or board.nbRows != self.evaluator.nbRows:
+            self.evaluator = PlacementEvaluator(board.nbColumns,board.nbRows,self.evaluator.fNumpy)
+        nextShape = engine.nextTetromino.pieceShape if self.fLookAhead else TetrominoShape.NoShape
+        return self.evaluator.best(board,engine.curTetromino.pieceShape,nextShape)
+
+    def hint(self, engine)->Placement:
+        '''placement of the current tetromino, chosen once per tetromino
+
+        None while the completed lines are erased, the board is not final yet.
+        '''
+        if engine.nbCompletedLines>0:
+            return None
+        if engine.nbPieces != self.nbPieces:
+            self.nbPieces = engine.nbPieces
+            self.setPlacement(engine,self.choose(engine))
+        return self.placement
+
+    def setPlacement(self, engine, placement: Placement):
+        self.placement = placement
+        # The legacy Tetromino does not keep its rotation, it spawns unrotated
+        self.nbRotations = (placement.rot - getattr(engine.curTetromino,'rot',0)) % 4
+        self.lastX = engine.curTetromino.x
+        self.nbStalls = 0
+
+    def commands(self, engine)->tuple:
+        tetro = engine.curTetromino
+        if self.hint(engine) is None:
+            return self.none
+        if self.nbRotations>0:
+            self.nbRotations -= 1
+            return self.rotate
+        target = self.placement.ix
+        if tetro.x % CELL_SIZE != 0:
+            # Release the key while sliding into the target column
+            if self.hVelocity == 1 and tetro.x//CELL_SIZE + 1 == target:
+                self.hVelocity = 0
+                return self.stop
+            if self.hVelocity == -1 and tetro.x//CELL_SIZE == target:
+                self.hVelocity = 0
+                return self.stop
+            return self.none
+        ix = tetro.x//CELL_SIZE
+        if tetro.x != self.lastX:
+            self.lastX = tetro.x
+            self.nbStalls = 0
+        else:
+            self.nbStalls += 1
+            if self.nbStalls>10:
+                # Blocked by the frozen cells, drop it here
+                self.placement = self.placement._replace(ix=ix)
+                target = ix
+        if ix<target and self.hVelocity != 1:
+            self.hVelocity = 1
+            return self.right
+        if ix>target and self.hVelocity != -1:
+            self.hVelocity = -1
+            return self.left
+        if ix == target and self.hVelocity != 0:
+            self.hVelocity = 0
+            return self.stop
+        if ix != target:
+            return self.none
+        return self.drop
+
+
+class Child(NamedTuple):
+    '''a placement of a tetromino on a board and the rows it leaves, packed in bytes'''
+    score: float
+    rot: int
+    ix: int
+    iy: int
+    nbLines: int
+    rows: bytes
+
+
+class BeamSearch:
+    '''Looks several pieces ahead, the best boards of each piece are kept
+
+    The current and the next tetrominos are known : all their placements
+    are tried on the beamWidth best boards of the previous piece, a board
+    is rated by the lines completed on the way plus its score. The pieces
+    after them are drawn from the bag, the leaves score the expected
+    best placement of the shapes left in it, weighted by their count.
+    Deeper unknown pieces follow the expandWidth best placements of each
+    shape and take the 7 shapes as equally likely.
+
+    The placements of a shape on a board are kept in a transposition
+    table keyed by the rows of the board packed in bytes, the least
+    recently used are dropped beyond cacheSize. The boards reached by
+    other move orders, and the boards of the previous move, are not
+    scored again.
+    '''
+
+    def __init__(self, nbColumns: int = NB_COLUMNS, nbRows: int = NB_ROWS, depth: int = BEAM_DEPTH,
+                 beamWidth: int = BEAM_WIDTH, expandWidth: int = EXPAND_WIDTH, cacheSize: int = CACHE_SIZE):
+        # The pure Python scoring returns the rows left, the board keys
+        self.evaluator = PlacementEvaluator(nbColumns,nbRows,fNumpy=False)
+        self.depth = max(1,depth)
+        self.beamWidth = beamWidth
+        self.expandWidth = expandWidth
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+        # Type of the packed rows, the smallest one holding a row
+        self.rowCode = 'H' if nbColumns<=16 else 'L' if nbColumns<=32 else 'Q'
+        # The rows of the wider boards do not fit, the tuples are kept
+        self.fPacked = nbColumns<=64
+        self.nbNodes = 0
+        self.nbHits = 0
+        self.nbLookups = 0
+
+    def pack(self, rows: list[int]):
+        return array(self.rowCode,rows).tobytes() if self.fPacked else tuple(rows)
+
+    def unpack(self, rows)->list[int]:
+        return array(self.rowCode,rows).tolist() if self.fPacked else list(rows)
+
+    def expand(self, rows: bytes, shape: int)->list[Child]:
+        '''the placements of shape on the packed rows, looked up in the transposition table first'''
+        key = (rows,shape)
+        self.nbLookups += 1
+        children = self.cache.get(key)
+        if children is not None:
+            self.nbHits += 1
+            self.cache.move_to_end(key)
+            return children
+        children = [Child(score,rot,ix,iy,nbLines,self.pack(after))
+                    for (rot,ix),(score,iy,nbLines,after) in zip(self.evaluator.candidates[shape],
+                                                                 self.evaluator.evaluateRows(self.unpack(rows),shape))]
+        self.nbNodes += len(children)
+        self.cache[key] = children
+        if len(self.cache)>self.cacheSize:
+            self.cache.popitem(last=False)
+        return children
+
+    def expectedScore(self, rows: bytes, depth: int, shapes: tuple)->float:
+        '''expected best score of the next depth pieces, drawn with the (shape, weight) of shapes'''
+        total = 0.0
+        for shape,weight in shapes:
+            children = self.expand(rows,shape)
+            if depth == 1:
+                best = max(child.score for child in children)
+            else:
+                best = GAME_OVER_SCORE
+                for child in heapq.nlargest(self.expandWidth,children,key=lambda child: child.score):
+                    if child.score != GAME_OVER_SCORE:
+                        best = max(best,LINES_WEIGHT*child.nbLines + self.expectedScore(child.rows,depth-1,UNIFORM_SHAPES))
+            total += weight*best
+        return total
+
+    def search(self, rows: tuple, shape: int, nextShape: int, bagShapes: tuple = UNIFORM_SHAPES)->tuple:
+        '''best placement of shape, returns it and the statistics of the search
+
+        bagShapes are the (shape, weight) of the piece after nextShape.
+        '''
+        t0 = perf_counter_ns()
+        nbNodes,nbHits,nbLookups = self.nbNodes,self.nbHits,self.nbLookups
+        # (rating, lines score, rows, first placement) of the boards kept
+        beam = [(0.0,0.0,self.pack(rows),None)]
+        known = (shape,nextShape)[:min(self.depth,2)]
+        for level,pieceShape in enumerate(known):
+            best = {}
+            for _,linesScore,boardRows,first in beam:
+                for child in self.expand(boardRows,pieceShape):
+                    if child.score == GAME_OVER_SCORE:
+                        continue
+                    rating = linesScore + child.score
+                    old = best.get(child.rows)
+                    # The same board reached by another move order is kept once
+                    if old is None or rating>old[0]:
+                        best[child.rows] = (rating,linesScore + LINES_WEIGHT*child.nbLines,child.rows,
+                                            first if first is not None else
+                                            Placement(child.score,child.rot,child.ix,child.iy,child.nbLines))
+            if len(best) == 0:
+                break
+            beam = heapq.nlargest(self.beamWidth,best.values(),key=lambda node: node[0])
+        if beam[0][3] is None:
+            # Every placement ends the game
+            placement = self.evaluator.best(_RowsBoard(rows),shape)
+        else:
+            if self.depth>len(known):
+                beam = [(linesScore + self.expectedScore(boardRows,self.depth-len(known),bagShapes),
+                         linesScore,boardRows,first) for _,linesScore,boardRows,first in beam]
+            rating,_,_,first = max(beam,key=lambda node: node[0])
+            placement = first._replace(score=rating)
+        nbLookups = self.nbLookups - nbLookups
+        stats = {
+            'nodes': self.nbNodes - nbNodes,
+            'lookups': nbLookups,
+            'hits': self.nbHits - nbHits,
+            'hit_rate': (self.nbHits - nbHits)/max(1,nbLookups),
+            'cache_size': len(self.cache),
+            'search_ms': (perf_counter_ns() - t0)/1e6,
+        }
+        return placement,stats
+
+
+class _RowsBoard(NamedTuple):
+    '''the rows of a board as read by PlacementEvaluator.best'''
+    rows: tuple
+    heights: list = None
+
+
+def bagShapes(engine)->tuple:
+    '''(shape, weight) of the piece after the next one, from the shapes left in the bag
+
+    The bag holds each shape twice, a player counting the pieces dealt
+    knows which are left but not their order.
+    '''
+    left = engine.tetroBag[engine.idTetroBag:]
+    if len(left) == 0:
+        return UNIFORM_SHAPES
+    return tuple((shape,left.count(shape)/len(left)) for shape in sorted(set(left)))
+
+
+_workerSearch = None
+
+def _initWorker(nbColumns: int, nbRows: int, depth: int, beamWidth: int, expandWidth: int, cacheSize: int):
+    global _workerSearch
+    _workerSearch = BeamSearch(nbColumns,nbRows,depth,beamWidth,expandWidth,cacheSize)
+
+def _searchInWorker(rows: tuple, shape: int, nextShape: int, shapes: tuple)->tuple:
+    return _workerSearch.search(rows,shape,nextShape,shapes)
+
+
+class BeamPlayer(AutoPlayer):
+    '''AutoPlayer choosing its placements with a BeamSearch
+
+    worker is 'process', 'thread' or None to search in the caller. With
+    a worker the search of a tetromino starts when it spawns and the
+    commands wait for its result, the frames are never blocked. The
+    process keeps its own transposition table from move to move and
+    does not hold the GIL of the frames, a thread shares it.
+    stats holds the statistics of the last search.
+    '''
+
+    def __init__(self, depth: int = BEAM_DEPTH, beamWidth: int = BEAM_WIDTH, worker: str = 'process',
+                 expandWidth: int = EXPAND_WIDTH, cacheSize: int = CACHE_SIZE):
+        self.params = (depth,beamWidth,expandWidth,cacheSize)
+        self.worker = worker
+        self.searcher = None
+        self.executor = None
+        self.boardSize = None
+        self.future = None
+        self.stats = {}
+        self.nbMoves = 0
+        self.nbNodes = 0
+        self.nbHits = 0
+        self.nbLookups = 0
+        super().__init__()
+
+    def reset(self):
+        super().reset()
+        # The result of a search still running is ignored
+        self.future = None
+
+    def start(self, nbColumns: int, nbRows: int):
+        '''create the search and its worker for the board size'''
+        self.close()
+        self.boardSize = (nbColumns,nbRows)
+        if self.worker == 'process':
+            self.executor = ProcessPoolExecutor(1,initializer=_initWorker,initargs=self.boardSize+self.params)
+        else:
+            self.searcher = BeamSearch(nbColumns,nbRows,*self.params)
+            if self.worker == 'thread':
+                self.executor = ThreadPoolExecutor(1)
+
+    def close(self):
+        '''stop the worker, the next search starts another one'''
+        if self.executor is not None:
+            self.executor.shutdown(wait=False,cancel_futures=True)
+            self.executor = None
+        self.searcher = None
+        self.boardSize = None
+
+    def submit(self, engine)->Future:
+        board = engine.board
+        if (board.nbColumns,board.nbRows) != self.boardSize:
+            self.start(board.nbColumns,board.nbRows)
+        args = (tuple(board.rows),engine.curTetromino.pieceShape,engine.nextTetromino.pieceShape,bagShapes(engine))
+        if self.executor is None:
+            future = Future()
+            future.set_result(self.searcher.search(*args))
+            return future
+        if self.worker == 'process':
+            return self.executor.submit(_searchInWorker,*args)
+        return self.executor.submit(self.searcher.search,*args)
+
+    def hint(self, engine)->Placement:
+        if engine.nbCompletedLines>0:
+            return None
+        if engine.nbPieces != self.nbPieces:
+            self.nbPieces = engine.nbPieces
+            self.placement = None
+            self.future = self.submit(engine)
+        if self.placement is None and self.future is not None and self.future.done():
+            placement,self.stats = self.future.result()
+            self.future = None
+            self.nbMoves += 1
+            self.nbNodes += self.stats['nodes']
+            self.nbHits += self.stats['hits']
+            self.nbLookups += self.stats['lookups']
+            self.setPlacement(engine,placement)
+        return self.placement
+
+    def summary(self)->dict:
+        '''node counts and cache hits per move since the start'''
+        return {
+            'moves': self.nbMoves,
+            'nodes_per_move': self.nbNodes/max(1,self.nbMoves),
+            'hit_rate': self.nbHits/max(1,self.nbLookups),
+        }
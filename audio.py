@@ -0,0 +1,89 @@
+"""  Music and sound effects loaded in the background  """
+
+import threading
+import pyglet
+from pyglet import clock
+
+
+class Audio:
+    '''Music player and sound effects
+
+    The music is decoded on a background thread and queued on the main
+    thread once ready, the sound effects are loaded on their first use.
+    Any failure of the audio backend or of a decoder switches to silent
+    mode instead of stopping the game.
+    '''
+
+    def __init__(self, musicVolume: int):
+        self.musicVolume = musicVolume
+        self.fSilent = False
+        self.fMusicPaused = False
+        self.player = None
+        self.sounds = {}
+        self.musicSource = None
+        self.musicThread = None
+
+    def silence(self, reason: Exception):
+        if not self.fSilent:
+            print('Audio disabled : {}'.format(reason))
+        self.fSilent = True
+
+    def startMusic(self, filename: str):
+        '''decode the music on a background thread, it plays as soon as it is ready'''
+        if self.fSilent or self.musicThread is not None:
+            return
+        self.musicThread = threading.Thread(target=self.loadMusic,args=(filename,),daemon=True)
+        self.musicThread.start()
+        clock.schedule_interval(self.on_music_loaded,0.1)
+
+    def loadMusic(self, filename: str):
+        try:
+            self.musicSource = pyglet.media.load(filename, streaming=False)
+        except Exception as e:
+            self.musicSource = e
+
+    def on_music_loaded(self, dt):
+        if self.musicThread.is_alive():
+            return
+        clock.unschedule(self.on_music_loaded)
+        source = self.musicSource
+        if isinstance(source,Exception):
+            # Only the music is lost, the sound effects may still play
+            print('Music disabled : {}'.format(source))
+            return
+        try:
+            self.player = pyglet.media.Player()
+            self.player.loop = True
+            self.player.volume = self.musicVolume/10.0
+            self.player.queue(source)
+            if not self.fMusicPaused:
+                self.player.play()
+        except Exception as e:
+            self.player = None
+            self.silence(e)
+
+    def toggleMusic(self):
+        self.fMusicPaused = not self.fMusicPaused
+        if self.player is not None:
+            if self.fMusicPaused:
+                self.player.pause()
+            else:
+                self.player.play()
+
+    def changeVolume(self, delta: int):
+        self.musicVolume = min(10, max(0, self.musicVolume + delta))
+        if self.player is not None:
+            self.player.volume = self.musicVolume/10
+
+    def play(self, name: str, volume: float):
+        '''play a sound effect resource, loaded on first use'''
+        if self.fSilent:
+            return
+        try:
+            sound = self.sounds.get(name)
+            if sound is None:
+                sound = pyglet.resource.media(name, streaming=False)
+                self.sounds[name] = sound
+            sound.play().volume = volume
+        except Exception as e:
+            self.silence(e)
@@ -0,0 +1,1010 @@
+"""     Benchmarks of the Tetris game   """
+
+import argparse
+import json
+import random
+from time import perf_counter_ns
+from profiler import percentile
+
+
+def time_stats(times_ns: list[int]) -> dict:
+    '''summary of durations in milliseconds'''
+    times = sorted(times_ns)
+    return {
+        'samples': len(times),
+        'mean_ms': sum(times)/max(1,len(times))/1e6,
+        'p50_ms': percentile(times,0.50)/1e6,
+        'p99_ms': percentile(times,0.99)/1e6,
+    }
+
+
+class RandomPolicy:
+    '''Scripted player : for each new tetromino choose a random rotation and
+    column, tap the keys to move there then drop it'''
+
+    def __init__(self, rng: random.Random, nbColumns: int = 10):
+        from engine import Command
+        self.rng = rng
+        self.nbColumns = nbColumns
+        self.nbPieces = -1
+        self.nbRotations = 0
+        self.column = 0
+        self.fMoving = False
+        self.lastX = 0
+        self.nbStalls = 0
+        self.rotate = (Command.Rotate,)
+        self.left = (Command.MoveLeft,)
+        self.right = (Command.MoveRight,)
+        self.stop = (Command.StopMove,)
+        self.drop = (Command.Drop,)
+        self.none = ()
+
+    def commands(self, engine) -> tuple:
+        from engine import CELL_SIZE
+        if engine.nbPieces != self.nbPieces:
+            self.nbPieces = engine.nbPieces
+            self.nbRotations = self.rng.randint(0,3)
+            self.column = self.rng.randint(0,self.nbColumns-1)
+        if self.nbRotations>0:
+            self.nbRotations -= 1
+            return self.rotate
+        if self.fMoving:
+            # Release the key, the tetromino slides to the next cell
+            self.fMoving = False
+            return self.stop
+        tetro = engine.curTetromino
+        if tetro.x % CELL_SIZE != 0:
+            return self.none
+        ix = tetro.x//CELL_SIZE
+        if tetro.x != self.lastX:
+            self.lastX = tetro.x
+            self.nbStalls = 0
+        else:
+            self.nbStalls += 1
+            if self.nbStalls>10:
+                # Blocked by the frozen cells
+                self.column = ix
+        if ix<self.column and ix+tetro.maxX()<self.nbColumns-1:
+            self.fMoving = True
+            return self.right
+        if ix>self.column and ix+tetro.minX()>0:
+            self.fMoving = True
+            return self.left
+        if engine.fDropTetromino:
+            return self.none
+        return self.drop
+
+
+def play_games(seeds: list[int], fAnimateErase: bool, maxTicks: int, policyName: str = 'random') -> tuple:
+    '''play one game per seed with the random or auto policy, returns the
+    (seed, score, ticks, pieces) of each game and the duration of every tick'''
+    from array import array
+    from engine import Engine
+    engine = Engine(seeds[0], fAnimateErase=fAnimateErase)
+    games = []
+    tickTimes = array('q')
+    pending = engine.pendingCommands
+    for seed in seeds:
+        engine.newGame(seed)
+        if policyName == 'auto':
+            from ai import AutoPlayer
+            policy = AutoPlayer()
+        else:
+            policy = RandomPolicy(random.Random(seed))
+        nbPieces = engine.nbPieces
+        while not engine.fEnded and engine.nbTicks<maxTicks:
+            pending.extend(policy.commands(engine))
+            t0 = perf_counter_ns()
+            engine.tick()
+            tickTimes.append(perf_counter_ns()-t0)
+        games.append((seed,engine.score,engine.nbTicks,engine.nbPieces-nbPieces))
+    return games,tickTimes
+
+
+def bench_selfplay(args) -> dict:
+    '''headless games played in parallel by a process pool'''
+    import hashlib
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    workers = args.workers or os.cpu_count()
+    seeds = [args.seed + i for i in range(args.games)]
+    # A few chunks per worker to balance the games of different lengths
+    nbChunks = min(len(seeds), workers*4)
+    chunks = [seeds[i::nbChunks] for i in range(nbChunks)]
+    games = []
+    tickTimes = []
+    t0 = perf_counter_ns()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(play_games,chunk,args.animate,args.max_ticks,args.policy) for chunk in chunks]
+        for future in futures:
+            g,times = future.result()
+            games.extend(g)
+            tickTimes.extend(times)
+    duration = (perf_counter_ns()-t0)/1e9
+    games.sort()
+    nbTicks = sum(g[2] for g in games)
+    nbPieces = sum(g[3] for g in games)
+    tickTimes.sort()
+    # Same seeds and same rules give the same games, whatever the number of workers
+    digest = hashlib.sha1(repr(games).encode()).hexdigest()
+    return {
+        'policy': args.policy,
+        'workers': workers,
+        'games': len(games),
+        'duration_s': duration,
+        'games_per_s': len(games)/duration,
+        'ticks_per_s': nbTicks/duration,
+        'pieces_per_s': nbPieces/duration,
+        'tick_p50_us': percentile(tickTimes,0.50)/1e3,
+        'tick_p99_us': percentile(tickTimes,0.99)/1e3,
+        'mean_score': sum(g[1] for g in games)/max(1,len(games)),
+        'digest': digest,
+    }
+
+
+def bench_phases(args) -> dict:
+    '''engine phases timed by the profiler of the game over headless games'''
+    from engine import Engine
+    from profiler import Profiler
+    engine = Engine(args.seed)
+    profiler = Profiler()
+    profiler.watchEngine(engine)
+    profiler.setEnabled(True)
+    pending = engine.pendingCommands
+    for seed in range(args.seed, args.seed+args.games):
+        engine.newGame(seed)
+        policy = RandomPolicy(random.Random(seed))
+        while not engine.fEnded:
+            pending.extend(policy.commands(engine))
+            engine.tick()
+    if args.output:
+        profiler.dump(args.output)
+    return {name: {k: v for k,v in stats.items() if k != 'buckets'}
+            for name,stats in profiler.summary()['timings_ns'].items()}
+
+
+def bench_evaluator(args) -> dict:
+    '''placements scored per millisecond by the NumPy and the pure Python evaluators'''
+    from ai import PlacementEvaluator, np
+    from board import BitBoard
+    from engine import NB_ROWS, NB_COLUMNS, TetrominoShape
+    rnd = random.Random(args.seed)
+    boards = []
+    for _ in range(args.boards):
+        board = BitBoard(NB_COLUMNS,NB_ROWS)
+        for i in range(rnd.randint(0,NB_ROWS//2)*NB_COLUMNS):
+            if rnd.random()<0.8:
+                board[i] = rnd.randint(1,7)
+        boards.append(board)
+    shape = TetrominoShape.TShape
+    results = {'boards': args.boards}
+    python = PlacementEvaluator(fNumpy=False)
+    nbPlacements = len(python.candidates[shape])*len(boards)
+    t0 = perf_counter_ns()
+    for board in boards:
+        python.evaluateRows(board.rows,shape)
+    results['python_placements_per_ms'] = nbPlacements/((perf_counter_ns()-t0)/1e6)
+    if np is not None:
+        evaluator = PlacementEvaluator()
+        rows = evaluator.stackRows(boards)
+        evaluator.evaluateBatch(rows,shape) # warm up
+        t0 = perf_counter_ns()
+        evaluator.evaluateBatch(rows,shape)
+        results['numpy_placements_per_ms'] = nbPlacements/((perf_counter_ns()-t0)/1e6)
+        # Look ahead of one board : every placement of the next piece after every placement
+        times = []
+        for board in boards[:100]:
+            t0 = perf_counter_ns()
+            evaluator.best(board,shape,TetrominoShape.LShape)
+            times.append(perf_counter_ns()-t0)
+        results['lookahead'] = time_stats(times)
+    return results
+
+
+def play_to_game_start(engine, policy: RandomPolicy, frames: int, maxTransient: int = None) -> int:
+    '''play at least frames frames and until the end of a game then start
+    the next one, returns the highest memory allocated during a frame if
+    maxTransient is given'''
+    import tracemalloc
+    i = 0
+    while True:
+        commands = policy.commands(engine)
+        if maxTransient is not None:
+            current,_ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        engine.step(0.01, commands)
+        if maxTransient is not None:
+            _,peak = tracemalloc.get_traced_memory()
+            maxTransient = max(maxTransient, peak-current)
+        i += 1
+        if engine.fEnded:
+            # Past the cached small ints, the counters are one int object each
+            if i>=frames and engine.nbPieces>256:
+                break
+            engine.newGame()
+    engine.newGame()
+    return maxTransient
+
+# Bytes a frame may allocate and free before it ends. Not zero : the tick
+# counter, the pixel positions and the board versions above 256 are new int
+# objects at each change and CPython has no free list for them. A spawn
+# writes 4 cells and looks up the landing row, about 300 bytes of them.
+MAX_TRANSIENT_BYTES = 512
+
+def retained_allocations(seed: int, frames: int) -> dict:
+    '''memory of engine.py and board.py retained by frames frames of play
+
+    The tracemalloc snapshots are taken at the start of a game, after a
+    game over : the board was full, all its rows were reset, so the
+    number of live int objects above 256 (positions, counters, row
+    versions) is the same at both snapshots. The free lists of the
+    interpreter are emptied by gc.collect() before each snapshot.
+    '''
+    import gc
+    import tracemalloc
+    from engine import Engine
+    engine = Engine(seed)
+    tracemalloc.start()
+    play_to_game_start(engine, RandomPolicy(random.Random(seed)), frames)
+    gc.collect()
+    before = tracemalloc.take_snapshot()
+    maxTransient = play_to_game_start(engine, RandomPolicy(random.Random(seed+1)), frames, 0)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    filters = [tracemalloc.Filter(True,'*engine.py'),tracemalloc.Filter(True,'*board.py')]
+    diff = after.filter_traces(filters).compare_to(before.filter_traces(filters),'lineno')
+    return {
+        'frames': frames,
+        'retained_bytes': sum(stat.size_diff for stat in diff),
+        'retained_blocks': sum(stat.count_diff for stat in diff),
+        'max_transient_bytes_per_frame': maxTransient,
+        'pieces': engine.nbPieces,
+        'top': [str(stat) for stat in diff if stat.size_diff!=0 or stat.count_diff!=0][:5],
+    }
+
+def bench_alloc(args) -> dict:
+    '''memory retained by the engine in steady state play, measured with tracemalloc'''
+    results = retained_allocations(args.seed, args.frames)
+    if (results['retained_blocks']>0 or results['retained_bytes']>0
+            or results['max_transient_bytes_per_frame']>MAX_TRANSIENT_BYTES):
+        raise SystemExit(json.dumps(results, indent=2))
+    return results
+
+
+def bench_snapshot(args) -> dict:
+    '''duration of the engine snapshots and restores along random games, as
+    taken each tick by the network rollback'''
+    from engine import Engine, SnapshotRing
+    engine = Engine(args.seed)
+    policy = RandomPolicy(random.Random(args.seed))
+    ring = SnapshotRing(args.depth)
+    snapshotTimes = []
+    restoreTimes = []
+    sizes = []
+    for _ in range(args.ticks):
+        if engine.fEnded:
+            engine.newGame()
+            ring.clear()
+        engine.pendingCommands.extend(policy.commands(engine))
+        engine.tick()
+        t0 = perf_counter_ns()
+        state = engine.snapshot()
+        t1 = perf_counter_ns()
+        ring.push(engine.nbTicks,state)
+        # Restore the oldest tick kept then come back, the game goes on unchanged
+        engine.restore(ring.get(engine.nbTicks-len(ring)+1))
+        t2 = perf_counter_ns()
+        engine.restore(state)
+        snapshotTimes.append(t1-t0)
+        restoreTimes.append(t2-t1)
+        sizes.append(len(state[0]))
+    return {
+        'ticks': args.ticks,
+        'depth': args.depth,
+        'snapshot_mean_us': sum(snapshotTimes)/len(snapshotTimes)/1e3,
+        'restore_mean_us': sum(restoreTimes)/len(restoreTimes)/1e3,
+        'snapshot': time_stats(snapshotTimes),
+        'restore': time_stats(restoreTimes),
+        'mean_bytes': sum(sizes)/len(sizes),
+        'max_bytes': max(sizes),
+    }
+
+
+def bench_latency(args) -> dict:
+    '''time from the key presses to the first frame showing their move and
+    from the key events to the ticks applying them, for the keys read once
+    a frame and for the timestamped InputQueue, with the classic slides and
+    with the guideline handling. The frames and keys run on a virtual clock.'''
+    from engine import Engine, Command, Handling, TICK_DT
+    from inputs import InputQueue, LatencyProbe
+    from profiler import Histogram
+
+    # Key events : a press of left, right or rotate in turn then the release of the moves
+    rng = random.Random(args.seed)
+    keys = []
+    t = 0.5
+    for i in range(args.presses):
+        command = (Command.MoveLeft,Command.MoveRight,Command.Rotate)[i%3]
+        keys.append((t,command))
+        if command != Command.Rotate:
+            keys.append((t+args.hold/1000,Command.StopMove))
+        t += rng.uniform(0.15,0.35)
+    keys.sort(key=lambda key: key[0])
+
+    class TickRecorder:
+        '''time from each key event to the end of the tick applying its command'''
+        def __init__(self):
+            self.tGame = 0.0
+            self.sent = []
+            self.delays = []
+
+        def record(self, tick, command):
+            self.delays.append(round((self.tGame + (tick+1)*TICK_DT - self.sent.pop(0))*1e9))
+
+    results = {}
+    for name,handling in (('classic',None),('handling',Handling())):
+        for fQueue in (False,True):
+            engine = Engine(args.seed,fAnimateErase=False,handling=handling)
+            recorder = engine.recorder = TickRecorder()
+            queue = InputQueue()
+            inputs = []
+            hist = Histogram(args.presses)
+            probe = LatencyProbe(hist)
+            frameRng = random.Random(args.seed)
+            tFrame = 0.0
+            iKey = 0
+            while iKey<len(keys):
+                dt = max(0.001,1/args.fps + frameRng.uniform(-args.jitter,args.jitter)/1000)
+                tFrame += dt
+                # The key events of the frame are read before its update
+                while iKey<len(keys) and keys[iKey][0]<=tFrame:
+                    te,command = keys[iKey]
+                    iKey += 1
+                    if command != Command.StopMove:
+                        probe.press(te,engine)
+                    recorder.sent.append(te)
+                    if fQueue:
+                        queue.push(te,command)
+                    else:
+                        inputs.append(command)
+                queue.schedule(engine,tFrame,dt)
+                engine.step(dt,inputs)
+                inputs.clear()
+                probe.shown(tFrame)
+                if engine.fGameOver:
+                    engine.newGame()
+                    queue.clear()
+                    probe.clear()
+                    recorder.tGame = tFrame
+                    recorder.sent.clear()
+            results['{}_{}'.format(name,'queue' if fQueue else 'frame')] = {
+                'moves_shown': hist.nbSamples,
+                'key_to_frame': time_stats(hist.recent()),
+                'key_to_tick': time_stats(recorder.delays),
+                # Range of the simulated times of the keys, one tick at best
+                'key_to_tick_spread_ms': (max(recorder.delays)-min(recorder.delays))/1e6,
+            }
+    return {'presses': args.presses, 'fps': args.fps, 'hold_ms': args.hold, **results}
+
+
+def bench_rotation(args) -> dict:
+    '''duration of the rotations on random stacks, classic rotation versus
+    the SRS kicks, and the kick which fitted'''
+    from engine import Engine, CELL_SIZE, fits, kicksTable, rotationsTable
+    rng = random.Random(args.seed)
+    engines = {'classic': Engine(args.seed), 'srs': Engine(args.seed,kicks=True)}
+    # Random ragged stacks and tetromino positions where the tetromino fits, on the ground or just above
+    cases = []
+    board = engines['classic'].board
+    while len(cases)<args.rotations:
+        heights = [rng.randint(0,8) for _ in range(board.nbColumns)]
+        cells = [(x,y) for x,h in enumerate(heights) for y in range(h) if rng.random()<0.85]
+        shape = rng.randint(1,7)
+        rot = rng.randint(0,3)
+        ix = rng.randint(0,board.nbColumns-1)
+        iy = max(heights) - rotationsTable[shape][rot].minY - rng.randint(0,4)
+        board.reset()
+        for x,y in cells:
+            board[x+y*board.nbColumns] = 1
+        if fits(board,shape,rot,ix,iy):
+            cases.append((cells,shape,rot,ix,iy))
+    results = {}
+    for name,engine in engines.items():
+        board = engine.board
+        tetro = engine.curTetromino
+        times = []
+        kicks = [0]*6
+        for cells,shape,rot,ix,iy in cases:
+            board.reset()
+            for x,y in cells:
+                board[x+y*board.nbColumns] = 1
+            tetro.setShape(shape)
+            tetro.setRotation(rot)
+            tetro.x,tetro.y = ix*CELL_SIZE,iy*CELL_SIZE
+            t0 = perf_counter_ns()
+            if name == 'srs':
+                engine.kickTetromino()
+            else:
+                engine.rotateTetromino()
+            times.append(perf_counter_ns()-t0)
+            if tetro.rot == rot:
+                kicks[5] += 1
+            elif name == 'srs':
+                dx,dy = tetro.x//CELL_SIZE-ix,tetro.y//CELL_SIZE-iy
+                kicks[kicksTable[shape][rot].index((dx,dy))] += 1
+        times.sort()
+        results[name] = {
+            'mean_us': sum(times)/len(times)/1e3,
+            'p50_us': percentile(times,0.50)/1e3,
+            'p99_us': percentile(times,0.99)/1e3,
+            'failed': kicks[5],
+        }
+        if name == 'srs':
+            results[name]['kicks'] = {str(i): n for i,n in enumerate(kicks[:5])}
+    return {'rotations': args.rotations, **results}
+
+
+def bench_beam(args) -> dict:
+    '''games of the greedy AutoPlayer and of the BeamPlayer on the same
+    seeds, duration, nodes and transposition table hits of the searches'''
+    from ai import AutoPlayer, BeamPlayer
+    from engine import Engine
+    results = {'games': args.games, 'max_pieces': args.pieces, 'depth': args.depth, 'width': args.width}
+    for name in ('auto','beam'):
+        scores = []
+        nbPieces = 0
+        nbDeaths = 0
+        searchTimes = []
+        nodes = []
+        for seed in range(args.seed,args.seed+args.games):
+            engine = Engine(seed)
+            if name == 'auto':
+                policy = AutoPlayer()
+            else:
+                # The search runs in the loop, the ticks wait for it
+                policy = BeamPlayer(args.depth,args.width,worker=None)
+            while not engine.fEnded and engine.nbPieces<args.pieces:
+                # The placement is chosen by the first call after the spawn
+                fSearch = policy.nbPieces != engine.nbPieces and engine.nbCompletedLines == 0
+                t0 = perf_counter_ns()
+                engine.pendingCommands.extend(policy.commands(engine))
+                if fSearch:
+                    searchTimes.append(perf_counter_ns()-t0)
+                engine.tick()
+            scores.append(engine.score)
+            nbPieces += engine.nbPieces
+            nbDeaths += engine.fEnded
+            if name == 'beam':
+                nodes.append(policy.summary())
+                policy.close()
+        results[name] = {
+            'mean_score': sum(scores)/len(scores),
+            'pieces': nbPieces,
+            'deaths': nbDeaths,
+            'move': time_stats(searchTimes),
+        }
+        if nodes:
+            results[name]['nodes_per_move'] = sum(n['nodes_per_move'] for n in nodes)/len(nodes)
+            results[name]['hit_rate'] = sum(n['hit_rate'] for n in nodes)/len(nodes)
+    return results
+
+
+def bench_env(args) -> dict:
+    '''env steps per second of a TetrisEnv, placement and key actions, and of
+    VecEnvs of growing sizes with random placement actions'''
+    import numpy as np
+    from gymenv import TetrisEnv, VecEnv
+    rng = np.random.default_rng(args.seed)
+    results = {'steps': args.steps}
+    for name,fPlacement in (('placement',True),('keys',False)):
+        env = TetrisEnv(fPlacement=fPlacement,seed=args.seed)
+        env.reset(args.seed)
+        actions = rng.integers(0,env.nbActions,args.steps).tolist()
+        t0 = perf_counter_ns()
+        for action in actions:
+            _,_,fTerminated,_,_ = env.step(action)
+            if fTerminated:
+                env.reset()
+        results['env_{}_steps_per_s'.format(name)] = args.steps/((perf_counter_ns()-t0)/1e9)
+    for n in args.sizes:
+        env = VecEnv(n,seed=args.seed)
+        env.reset()
+        nbBatches = max(1,args.steps//n)
+        actions = rng.integers(0,env.nbActions,(nbBatches,n))
+        t0 = perf_counter_ns()
+        for batch in actions:
+            env.step(batch)
+        t = (perf_counter_ns()-t0)/1e9
+        results['vec_{}'.format(n)] = {
+            'steps_per_s': nbBatches*n/t,
+            'batch_step_ms': t/nbBatches*1e3,
+        }
+    return results
+
+
+def bench_offscreen(args) -> dict:
+    '''frames per second of the offscreen renderers along a game of the
+    computer, rendering alone then with the PNG encoding, and the memory
+    kept by the frames once the buffers are allocated'''
+    import tracemalloc
+    from offscreen import PngWriter, SoftwareRenderer, selfPlayFrames, createRenderer
+    renderers = [('software',SoftwareRenderer())]
+    if not args.software:
+        renderers.append(('gl',createRenderer('gl')))
+    results = {'frames': args.frames, 'every': args.every}
+    for name,renderer in renderers:
+        pngWriter = PngWriter()
+        renderTimes = []
+        pngTimes = []
+        memory = []
+        tracemalloc.start()
+        for i,engine in enumerate(selfPlayFrames(args.seed,args.every)):
+            if i == args.frames:
+                break
+            t0 = perf_counter_ns()
+            frame = renderer.render(engine)
+            t1 = perf_counter_ns()
+            pngWriter.encode(frame)
+            t2 = perf_counter_ns()
+            renderTimes.append(t1-t0)
+            pngTimes.append(t2-t1)
+            if i in (10,args.frames-1):
+                # Only the memory allocated by the renderers, the game allocates its own
+                snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True,'*offscreen.py')])
+                memory.append(sum(stat.size for stat in snapshot.statistics('filename')))
+        tracemalloc.stop()
+        results[name] = {
+            'render_fps': len(renderTimes)/(sum(renderTimes)/1e9),
+            'png_fps': len(renderTimes)/((sum(renderTimes)+sum(pngTimes))/1e9),
+            'render': time_stats(renderTimes),
+            'retained_bytes': memory[-1]-memory[0] if len(memory)==2 else None,
+        }
+    return results
+
+
+def bench_render(args) -> dict:
+    '''frame time of the legacy per-cell drawing versus the batched BoardView'''
+    import pyglet
+    pyglet.options['headless'] = args.headless
+    pyglet.options['vsync'] = False
+    from pyglet.shapes import Rectangle
+    import main
+    from main import OX, OY
+    from boardview import BoardView
+    from engine import Tetromino, NB_ROWS, NB_COLUMNS, CELL_SIZE
+    from board import ListBoard
+
+    window = pyglet.window.Window(main.WIN_WIDTH, main.WIN_HEIGHT, visible=not args.headless)
+    rnd = random.Random(args.seed)
+    # Typical mid game board : bottom half filled with holes
+    board = ListBoard(NB_COLUMNS,NB_ROWS)
+    for i in range(0,NB_COLUMNS*NB_ROWS//2):
+        if rnd.random()<0.8:
+            board[i] = rnd.randint(1,7)
+    curTetromino = Tetromino(5*CELL_SIZE,18*CELL_SIZE,3)
+    nextTetromino = Tetromino(14*CELL_SIZE,10*CELL_SIZE,4)
+
+    def legacy_draw():
+        boardRect = Rectangle(OX,OY,CELL_SIZE*NB_COLUMNS,CELL_SIZE*NB_ROWS,color=(0,0,50,255))
+        boardRect.draw()
+        rect = Rectangle(100,100,CELL_SIZE-2,CELL_SIZE-2,color=(0x00,0x00,0x00,0x00))
+        for y in range(0,NB_ROWS):
+            for x in range(0,NB_COLUMNS):
+                typ = board[x + y * NB_COLUMNS]
+                if typ != 0 :
+                    rect.x = (x * (CELL_SIZE) + OX + 1)
+                    rect.y = (y * (CELL_SIZE) + OY + 1)
+                    rect.color = Tetromino.colorsTable[typ]
+                    rect.draw()
+        for tetro in (curTetromino,nextTetromino):
+            rect = Rectangle(100,100,CELL_SIZE-2,CELL_SIZE-2,color=tetro.color)
+            for [vx,vy] in tetro.v:
+                rect.x = tetro.x + vx*CELL_SIZE + OX + 1
+                rect.y = tetro.y + vy*CELL_SIZE + OY + 1
+                rect.draw()
+
+    batch = pyglet.graphics.Batch()
+    boardView = BoardView(batch)
+
+    def batched_draw():
+        boardView.update(board, curTetromino, nextTetromino)
+        batch.draw()
+
+    def run(draw) -> list[int]:
+        times = []
+        for i in range(args.frames):
+            curTetromino.y = (18*CELL_SIZE - i) % (18*CELL_SIZE)
+            t0 = perf_counter_ns()
+            window.switch_to()
+            window.clear()
+            draw()
+            pyglet.gl.glFinish()
+            times.append(perf_counter_ns()-t0)
+        return times
+
+    results = {}
+    for name,draw in (('legacy',legacy_draw),('batched',batched_draw)):
+        run(draw) # warm up
+        results[name] = time_stats(run(draw))
+    results['speedup'] = results['legacy']['mean_ms']/max(1e-9,results['batched']['mean_ms'])
+    window.close()
+    return results
+
+
+def bench_skins(args) -> dict:
+    '''frame time of the board drawn with each skin, texture binds per frame
+    and cost of the skin switches'''
+    import tracemalloc
+    import pyglet
+    pyglet.options['headless'] = args.headless
+    pyglet.options['vsync'] = False
+    import pyglet.sprite
+    import skins
+    import main
+    from boardview import BoardView
+    from layout import CLASSIC_LAYOUT
+    from engine import Tetromino, NB_ROWS, NB_COLUMNS, CELL_SIZE
+    from board import BitBoard
+
+    window = pyglet.window.Window(main.WIN_WIDTH, main.WIN_HEIGHT, visible=not args.headless)
+    rnd = random.Random(args.seed)
+    board = BitBoard(NB_COLUMNS,NB_ROWS)
+    for i in range(0,NB_COLUMNS*NB_ROWS//2):
+        if rnd.random()<0.8:
+            board[i] = rnd.randint(1,7)
+    curTetromino = Tetromino(5*CELL_SIZE,18*CELL_SIZE,3)
+    nextTetromino = Tetromino(14*CELL_SIZE,10*CELL_SIZE,4)
+    atlas = skins.SkinAtlas(CLASSIC_LAYOUT.cellSize-2)
+    batch = pyglet.graphics.Batch()
+    boardView = BoardView(batch,CLASSIC_LAYOUT,atlas)
+
+    # Count the texture binds of the atlas group and of the sprite groups
+    nbBinds = [0]
+    glBindTexture = pyglet.gl.glBindTexture
+    def countBind(target, texture):
+        nbBinds[0] += 1
+        glBindTexture(target,texture)
+    skins.glBindTexture = countBind
+    pyglet.sprite.glBindTexture = countBind
+
+    def run() -> list[int]:
+        times = []
+        for i in range(args.frames):
+            curTetromino.y = (18*CELL_SIZE - i) % (18*CELL_SIZE)
+            t0 = perf_counter_ns()
+            window.switch_to()
+            window.clear()
+            boardView.update(board, curTetromino, nextTetromino)
+            batch.draw()
+            pyglet.gl.glFinish()
+            times.append(perf_counter_ns()-t0)
+        return times
+
+    results = {}
+    for i,name in enumerate(atlas.names):
+        atlas.setSkin(i)
+        boardView.applySkin()
+        run() # warm up
+        nbBinds[0] = 0
+        results[name] = time_stats(run())
+        results[name]['binds_per_frame'] = nbBinds[0]/args.frames
+    skins.glBindTexture = glBindTexture
+    pyglet.sprite.glBindTexture = glBindTexture
+
+    times = []
+    for i in range(args.switches):
+        t0 = perf_counter_ns()
+        atlas.nextSkin()
+        boardView.applySkin()
+        times.append(perf_counter_ns()-t0)
+    results['switch'] = time_stats(times)
+    # The switches only change the texture coordinates, the memory stays flat
+    tracemalloc.start()
+    before,_ = tracemalloc.get_traced_memory()
+    for i in range(args.switches):
+        atlas.nextSkin()
+        boardView.applySkin()
+    after,_ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results['switch']['retained_bytes'] = after-before
+    window.close()
+    return results
+
+
+def bench_scaling(args) -> dict:
+    '''engine step and board view update per frame for growing boards
+
+    The view only reads the rows changed since the last frame, the full
+    scan of every cell done before is timed for comparison.
+    '''
+    import pyglet
+    pyglet.options['headless'] = args.headless
+    pyglet.options['vsync'] = False
+    from boardview import BoardView
+    from layout import Layout
+    from engine import Engine
+
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes.split(',')]
+    # One window for all the sizes, the vertex arrays are not shared between contexts
+    layouts = [Layout(nbColumns,nbRows,4) for nbColumns,nbRows in sizes]
+    window = pyglet.window.Window(max(layout.width for layout in layouts),max(layout.height for layout in layouts),
+                                  visible=not args.headless)
+    results = {}
+    for (nbColumns,nbRows),layout in zip(sizes,layouts):
+        batch = pyglet.graphics.Batch()
+        boardView = BoardView(batch,layout)
+        engine = Engine(args.seed,nbColumns=nbColumns,nbRows=nbRows)
+        policy = RandomPolicy(random.Random(args.seed),nbColumns)
+        pending = engine.pendingCommands
+        stepTimes = []
+        viewTimes = []
+        fullScanTimes = []
+        drawTimes = []
+        for i in range(args.frames):
+            if engine.fEnded:
+                engine.newGame(args.seed+i)
+            t0 = perf_counter_ns()
+            for _ in range(2):
+                pending.extend(policy.commands(engine))
+                engine.tick()
+            t1 = perf_counter_ns()
+            boardView.update(engine.board, engine.curTetromino, engine.nextTetromino)
+            t2 = perf_counter_ns()
+            window.switch_to()
+            window.clear()
+            batch.draw()
+            pyglet.gl.glFinish()
+            t3 = perf_counter_ns()
+            # Forget the drawn board, the next update reads every cell
+            boardView.board = None
+            boardView.updateBoard(engine.board)
+            t4 = perf_counter_ns()
+            stepTimes.append(t1-t0)
+            viewTimes.append(t2-t1)
+            drawTimes.append(t3-t2)
+            fullScanTimes.append(t4-t3)
+        results['{}x{}'.format(nbColumns,nbRows)] = {
+            'cells': nbColumns*nbRows,
+            'step': time_stats(stepTimes),
+            'view_update': time_stats(viewTimes),
+            'view_full_scan': time_stats(fullScanTimes),
+            'draw': time_stats(drawTimes),
+        }
+    window.close()
+    return results
+
+
+def bench_versus(args) -> dict:
+    '''frame time of versus games of 1 to 4 players, one batch for all the
+    players versus one batch per player'''
+    import pyglet
+    pyglet.options['headless'] = args.headless
+    pyglet.options['vsync'] = False
+    from boardview import BoardView
+    from layout import CLASSIC_LAYOUT
+    from versus import Versus
+
+    layouts = [CLASSIC_LAYOUT.player(i) for i in range(args.players)]
+    window = pyglet.window.Window(layouts[-1].width,CLASSIC_LAYOUT.height,visible=not args.headless)
+    results = {}
+    for nbPlayers in range(1,args.players+1):
+        for fShared in (True,False):
+            batches = [pyglet.graphics.Batch()]
+            if not fShared:
+                batches += [pyglet.graphics.Batch() for i in range(1,nbPlayers)]
+            boardViews = [BoardView(batches[i if not fShared else 0],layouts[i]) for i in range(nbPlayers)]
+            versus = Versus(nbPlayers,args.seed)
+            policies = [RandomPolicy(random.Random(args.seed+i)) for i in range(nbPlayers)]
+            times = []
+            for i in range(args.frames):
+                if versus.fEnded or versus.engines[0].fEnded:
+                    versus.newGame(args.seed+i)
+                t0 = perf_counter_ns()
+                versus.step(1/60,[policy.commands(engine) for policy,engine in zip(policies,versus.engines)])
+                for boardView,engine in zip(boardViews,versus.engines):
+                    boardView.update(engine.board,engine.curTetromino,engine.nextTetromino)
+                window.switch_to()
+                window.clear()
+                for batch in batches:
+                    batch.draw()
+                pyglet.gl.glFinish()
+                times.append(perf_counter_ns()-t0)
+            results['{}_{}'.format(nbPlayers,'shared' if fShared else 'batches')] = time_stats(times)
+    base = results['1_shared']['mean_ms']
+    # Cost of a frame of n players in frames of 1 player, below n when the batch is shared
+    results['relative'] = {str(n): results['{}_shared'.format(n)]['mean_ms']/max(1e-9,base)
+                           for n in range(1,args.players+1)}
+    window.close()
+    return results
+
+
+def bench_highscores(args) -> dict:
+    '''frame time of the high scores screen, labels built every frame versus cached labels'''
+    import pyglet
+    pyglet.options['headless'] = args.headless
+    pyglet.options['vsync'] = False
+    import main
+    from main import ScreenView, GameMode, HighScore, OX, OY
+    from engine import NB_COLUMNS, CELL_SIZE
+
+    window = pyglet.window.Window(main.WIN_WIDTH, main.WIN_HEIGHT, visible=not args.headless)
+    pyglet.font.add_file('sansation.ttf')
+    hightScores = [HighScore('PLAYER{}'.format(i),(10-i)*1000) for i in range(10)]
+    idHightScore = 3
+
+    def legacy_draw(iColorHighScore: int):
+        title_label = pyglet.text.Label('HIGH SCORES',font_name='sansation',
+                                             font_size=14,bold=True,x=OX+NB_COLUMNS*CELL_SIZE/2,y=OY+18*CELL_SIZE,
+                                             anchor_x='center',color=(255, 255, 0,255))
+        yTop = OY+16*CELL_SIZE
+        listHighScoresNames = [pyglet.text.Label('xxxxxx',font_name='sansation',
+                                             font_size=12,bold=True,x=OX+CELL_SIZE,y=(yTop-i*CELL_SIZE),
+                                             anchor_x='left',color=(255, 255, 0,255)) for i in range(10)]
+        listHighScoresValues = [pyglet.text.Label('000000',font_name='sansation',
+                                             font_size=12,bold=True,x=OX+NB_COLUMNS*CELL_SIZE/2,y=(yTop-i*CELL_SIZE),
+                                             anchor_x='left',color=(255, 255, 0,255)) for i in range(10)]
+        for i in range(10):
+            hs = hightScores[i]
+            lblName = listHighScoresNames[i]
+            lblName.text = hs.name
+            lblValue = listHighScoresValues[i]
+            lblValue.text = '{:06d}'.format(hs.score)
+            if i==idHightScore:
+                if (iColorHighScore % 2)==0:
+                    lblValue.color = (255, 255, 0,255)
+                else:
+                    lblValue.color = (55, 55, 0, 255)
+                lblName.color = lblValue.color
+            lblName.draw()
+            lblValue.draw()
+        title_label.draw()
+
+    screenView = ScreenView()
+
+    def cached_draw(iColorHighScore: int):
+        screenView.updateHighScores(hightScores,idHightScore,iColorHighScore)
+        screenView.draw(GameMode.HightScore)
+
+    def run(draw) -> list[int]:
+        times = []
+        for i in range(args.frames):
+            t0 = perf_counter_ns()
+            window.switch_to()
+            window.clear()
+            # The highlighted row blinks every 0.2s, about every 12 frames
+            draw(i//12)
+            pyglet.gl.glFinish()
+            times.append(perf_counter_ns()-t0)
+        return times
+
+    results = {}
+    for name,draw in (('legacy',legacy_draw),('cached',cached_draw)):
+        run(draw) # warm up
+        results[name] = time_stats(run(draw))
+    results['speedup'] = results['legacy']['mean_ms']/max(1e-9,results['cached']['mean_ms'])
+    window.close()
+    return results
+
+
+def bench_startup(args) -> dict:
+    '''time from process start to the first on_draw of the game window'''
+    import os
+    import subprocess
+    import sys
+    import time
+    env = dict(os.environ, TETRIS_STARTUP_PROBE='1')
+    if args.headless:
+        env['PYGLET_HEADLESS'] = '1'
+    times = []
+    for _ in range(args.runs):
+        t0 = time.time()
+        out = subprocess.run([sys.executable,'main.py'],env=env,capture_output=True,text=True,
+                             timeout=60,cwd=os.path.dirname(os.path.abspath(__file__)))
+        for line in out.stdout.splitlines():
+            if line.startswith('first_draw '):
+                times.append(int((float(line.split()[1])-t0)*1e9))
+                break
+        else:
+            raise SystemExit('no first draw reported :\n' + out.stdout + out.stderr)
+    return {'runs': args.runs, 'startup': time_stats(times)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tetris benchmarks')
+    parser.add_argument('--seed', type=int, default=1)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('offscreen', help='frames per second of the offscreen GL and software renderers')
+    p.add_argument('--frames', type=int, default=300)
+    p.add_argument('--every', type=int, default=4, help='ticks of the game between two frames')
+    p.add_argument('--software', action='store_true', help='only the software renderer, without GL')
+    p.set_defaults(func=bench_offscreen)
+
+    p = sub.add_parser('render', help='frame time of the board rendering')
+    p.add_argument('--frames', type=int, default=500)
+    p.add_argument('--headless', action='store_true')
+    p.set_defaults(func=bench_render)
+
+    p = sub.add_parser('skins', help='frame time and texture binds of each skin, cost of the skin switches')
+    p.add_argument('--frames', type=int, default=500)
+    p.add_argument('--switches', type=int, default=300)
+    p.add_argument('--headless', action='store_true')
+    p.set_defaults(func=bench_skins)
+
+    p = sub.add_parser('scaling', help='engine and view costs per frame for growing boards')
+    p.add_argument('--sizes', default='10x20,40x100,100x200', help='comma separated COLUMNSxROWS')
+    p.add_argument('--frames', type=int, default=1000)
+    p.add_argument('--headless', action='store_true')
+    p.set_defaults(func=bench_scaling)
+
+    p = sub.add_parser('versus', help='frame time of versus games for 1 to 4 players')
+    p.add_argument('--players', type=int, default=4, choices=range(1,5))
+    p.add_argument('--frames', type=int, default=1000)
+    p.add_argument('--headless', action='store_true')
+    p.set_defaults(func=bench_versus)
+
+    p = sub.add_parser('highscores', help='frame time of the high scores screen')
+    p.add_argument('--frames', type=int, default=300)
+    p.add_argument('--headless', action='store_true')
+    p.set_defaults(func=bench_highscores)
+
+    p = sub.add_parser('startup', help='time from process start to the first frame')
+    p.add_argument('--runs', type=int, default=5)
+    p.add_argument('--headless', action='store_true')
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser('selfplay', help='headless games played in parallel by all the cores')
+    p.add_argument('--games', type=int, default=200)
+    p.add_argument('--workers', type=int, default=0, help='number of processes, all the cores by default')
+    p.add_argument('--max-ticks', type=int, default=100000, help='limit of the length of a game')
+    p.add_argument('--animate', action='store_true', help='play the erase animation of the completed lines')
+    p.add_argument('--policy', choices=('random','auto'), default='random')
+    p.set_defaults(func=bench_selfplay)
+
+    p = sub.add_parser('phases', help='duration of the engine phases in ns, as the F3 overlay of the game')
+    p.add_argument('--games', type=int, default=20)
+    p.add_argument('--output', help='JSON file of the histograms')
+    p.set_defaults(func=bench_phases)
+
+    p = sub.add_parser('evaluator', help='placements scored per millisecond')
+    p.add_argument('--boards', type=int, default=1000)
+    p.set_defaults(func=bench_evaluator)
+
+    p = sub.add_parser('latency', help='key to move latency of the keys read once a frame and of the input queue')
+    p.add_argument('--presses', type=int, default=1000)
+    p.add_argument('--fps', type=float, default=60)
+    p.add_argument('--jitter', type=float, default=2, help='random change of the frame time in ms')
+    p.add_argument('--hold', type=float, default=50, help='time a move key is held in ms')
+    p.set_defaults(func=bench_latency)
+
+    p = sub.add_parser('rotation', help='cost of the classic rotations and of the SRS kicks')
+    p.add_argument('--rotations', type=int, default=20000)
+    p.set_defaults(func=bench_rotation)
+
+    p = sub.add_parser('beam', help='games and search costs of the greedy and the beam search players')
+    p.add_argument('--games', type=int, default=5)
+    p.add_argument('--pieces', type=int, default=200, help='pieces played by game at most')
+    p.add_argument('--depth', type=int, default=3)
+    p.add_argument('--width', type=int, default=8, help='boards kept at each level of the search')
+    p.set_defaults(func=bench_beam)
+
+    p = sub.add_parser('env', help='steps per second of the Gym style environments')
+    p.add_argument('--steps', type=int, default=20000, help='env steps of each measure')
+    p.add_argument('--sizes', type=int, nargs='+', default=[1,16,64,256,1024], help='games of the VecEnvs')
+    p.set_defaults(func=bench_env)
+
+    p = sub.add_parser('alloc', help='steady state allocations of the engine')
+    p.add_argument('--frames', type=int, default=20000)
+    p.set_defaults(func=bench_alloc)
+
+    p = sub.add_parser('snapshot', help='duration of the engine snapshots and restores in us')
+    p.add_argument('--ticks', type=int, default=20000)
+    p.add_argument('--depth', type=int, default=9, help='number of ticks kept by the ring')
+    p.set_defaults(func=bench_snapshot)
+
+    args = parser.parse_args()
+    print(json.dumps(args.func(args), indent=2))
+
+if __name__ == "__main__" :
+    main()
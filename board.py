@@ -0,0 +1,361 @@
+"""  Game board backends  """
+
+from array import array
+import struct
+
+# Header of the BitBoard snapshots : top, nbFullRows, aggregateHeight, nbBlocks
+BOARD_STATE = struct.Struct('<IIII')
+
+class ListBoard(list):
+    '''Board stored as a flat list of cells, board[x + nbColumns*y]'''
+
+    def __init__(self, nbColumns: int, nbRows: int):
+        super().__init__(0 for i in range(0,nbColumns*nbRows))
+        self.nbColumns = nbColumns
+        self.nbRows = nbRows
+
+    def reset(self):
+        '''empty the board'''
+        for i in range(0,len(self)):
+            self[i] = 0
+
+    def isRowEmpty(self, y: int)->bool:
+        iRow = y*self.nbColumns
+        for x in range(0,self.nbColumns):
+            if self[iRow+x] != 0:
+                return False
+        return True
+
+    def computeCompletedLines(self)->int :
+        nbL = 0
+        for y in range(0,self.nbRows):
+            #-- Check completed line
+            f_complete = True
+            for x in range(0,self.nbColumns):
+                if self[x + y * self.nbColumns] == 0 :
+                    f_complete = False
+                    break
+            if f_complete :
+                nbL += 1
+        return nbL
+
+    def eraseFirstCompletedLine(self):
+        for y in range(0,self.nbRows):
+            #-- Check completed line
+            f_complete = True
+            for x in range(0,self.nbColumns):
+                if self[x + y * self.nbColumns] == 0 :
+                    f_complete = False
+                    break
+            if f_complete :
+                #-- Shift down the game board
+                y1 = y
+                while y1 < (self.nbRows-1) :
+                    ySrcOffset = (y1 + 1) * self.nbColumns
+                    yDesOffset = y1 * self.nbColumns
+                    for x in range(0,self.nbColumns) :
+                        self[x + yDesOffset] = self[x + ySrcOffset]
+                    y1 += 1
+                return
+
+    def eraseCompletedLines(self)->int:
+        '''erase all the completed lines, returns the number of erased lines'''
+        nbL = 0
+        while self.computeCompletedLines()>0:
+            self.eraseFirstCompletedLine()
+            nbL += 1
+        return nbL
+
+    def insertGarbage(self, nbLines: int, hole: int, typ: int)->int:
+        '''push the board up by nbLines rows filled but the hole column,
+        returns the number of blocks pushed out of the top'''
+        nbLost = 0
+        for i in range((self.nbRows-nbLines)*self.nbColumns,len(self)):
+            if i>=0 and self[i] != 0:
+                nbLost += 1
+        y = self.nbRows-1
+        while y >= nbLines :
+            yDesOffset = y * self.nbColumns
+            ySrcOffset = (y - nbLines) * self.nbColumns
+            for x in range(0,self.nbColumns) :
+                self[x + yDesOffset] = self[x + ySrcOffset]
+            y -= 1
+        for y in range(0,min(nbLines,self.nbRows)):
+            for x in range(0,self.nbColumns):
+                self[x + y*self.nbColumns] = typ if x != hole else 0
+        return nbLost
+
+    def snapshot(self)->bytes:
+        return bytes(self)
+
+    def restore(self, state: bytes):
+        self[:] = state
+
+
+class BitBoard:
+    '''Board storing each row as an int bitmask plus a parallel colour array
+
+    Reads and writes keep the board[x + nbColumns*y] semantics of the
+    ListBoard, the bit x of rows[y] is set when the cell is not empty.
+
+    An index is kept up to date by each write and line erase: the height
+    of each column, the number of blocks of each row, the number of full
+    rows and the number of holes (empty cells under the top of their
+    column). version changes with every change of the board and
+    rowVersions[y] is the version of the last change of row y, a view
+    only reads again the rows changed since the version it last saw.
+    The rows above the highest column are empty, a line erase or a reset
+    only moves or clears the rows under it.
+
+    The cells are a bytearray, a snapshot is a bytes blob of the rows
+    under the top, taking and restoring it are a few buffer copies.
+    '''
+
+    def __init__(self, nbColumns: int, nbRows: int):
+        self.nbColumns = nbColumns
+        self.nbRows = nbRows
+        self.fullRow = (1<<nbColumns) - 1
+        self.rows = [0 for i in range(0,nbRows)]
+        self.cells = bytearray(nbColumns*nbRows)
+        self.heights = [0 for i in range(0,nbColumns)]
+        self.rowCounts = [0 for i in range(0,nbRows)]
+        self.nbFullRows = 0
+        # Sum of the heights and number of blocks, their difference is the number of holes
+        self.aggregateHeight = 0
+        self.nbBlocks = 0
+        self.version = 0
+        self.rowVersions = [0 for i in range(0,nbRows)]
+        # The row masks of the boards up to 64 columns are stored as an array of uint64
+        self.fWideRows = nbColumns > 64
+        self.rowBytes = (nbColumns+7)//8
+        self.heightsStruct = struct.Struct(f'<{nbColumns}H')
+
+    def __len__(self)->int:
+        return len(self.cells)
+
+    def __iter__(self):
+        return iter(self.cells)
+
+    def __getitem__(self, i: int)->int:
+        return self.cells[i]
+
+    def __setitem__(self, i: int, typ: int):
+        old = self.cells[i]
+        self.cells[i] = typ
+        self.version += 1
+        y,x = divmod(i,self.nbColumns)
+        self.rowVersions[y] = self.version
+        if (old != 0) == (typ != 0):
+            # Only the colour changed
+            return
+        if typ != 0:
+            self.rows[y] |= (1<<x)
+            self.rowCounts[y] += 1
+            if self.rowCounts[y] == self.nbColumns:
+                self.nbFullRows += 1
+            self.nbBlocks += 1
+            if y >= self.heights[x]:
+                self.aggregateHeight += y + 1 - self.heights[x]
+                self.heights[x] = y + 1
+        else:
+            if self.rowCounts[y] == self.nbColumns:
+                self.nbFullRows -= 1
+            self.rows[y] &= ~(1<<x)
+            self.rowCounts[y] -= 1
+            self.nbBlocks -= 1
+            if y+1 == self.heights[x]:
+                # The top block is removed, look for the next one below
+                bit = 1<<x
+                h = y
+                while h>0 and not (self.rows[h-1] & bit):
+                    h -= 1
+                self.aggregateHeight -= self.heights[x] - h
+                self.heights[x] = h
+
+    @property
+    def nbHoles(self)->int:
+        return self.aggregateHeight - self.nbBlocks
+
+    def top(self)->int:
+        '''number of rows under the highest block, the rows above are empty'''
+        return max(self.heights)
+
+    def touchRows(self, y0: int, y1: int):
+        '''new version of the rows y0 to y1 excluded'''
+        self.version += 1
+        for y in range(y0,y1):
+            self.rowVersions[y] = self.version
+
+    def reset(self):
+        '''empty the board'''
+        top = self.top()
+        for y in range(0,top):
+            self.rows[y] = 0
+            self.rowCounts[y] = 0
+        self.cells[0:top*self.nbColumns] = bytes(top*self.nbColumns)
+        for x in range(0,self.nbColumns):
+            self.heights[x] = 0
+        self.nbFullRows = 0
+        self.aggregateHeight = 0
+        self.nbBlocks = 0
+        self.touchRows(0,top)
+
+    def isRowEmpty(self, y: int)->bool:
+        return self.rows[y] == 0
+
+    def computeCompletedLines(self)->int :
+        return self.nbFullRows
+
+    def linesErased(self, nbLines: int, yTop: int):
+        '''update the index after erasing nbLines full rows, the highest one was yTop
+
+        The columns with blocks above yTop move down by nbLines, the others
+        had their top in row yTop and look for their new top below it.
+        '''
+        heights = self.heights
+        rows = self.rows
+        for x in range(0,self.nbColumns):
+            h = heights[x] - nbLines
+            if heights[x] == yTop+1:
+                bit = 1<<x
+                while h>0 and not (rows[h-1] & bit):
+                    h -= 1
+            heights[x] = h
+        self.aggregateHeight = sum(heights)
+        self.nbBlocks -= nbLines*self.nbColumns
+        self.nbFullRows -= nbLines
+
+    def eraseFirstCompletedLine(self):
+        if self.nbFullRows>0:
+            rows = self.rows
+            rowCounts = self.rowCounts
+            nbColumns = self.nbColumns
+            y = rows.index(self.fullRow)
+            # Only the rows up to the highest block move down
+            top = self.top()
+            rows[y:top-1] = rows[y+1:top]
+            rows[top-1] = 0
+            rowCounts[y:top-1] = rowCounts[y+1:top]
+            rowCounts[top-1] = 0
+            self.cells[y*nbColumns:(top-1)*nbColumns] = self.cells[(y+1)*nbColumns:top*nbColumns]
+            self.cells[(top-1)*nbColumns:top*nbColumns] = bytes(nbColumns)
+            self.linesErased(1,y)
+            self.touchRows(y,top)
+
+    def insertGarbage(self, nbLines: int, hole: int, typ: int)->int:
+        '''push the board up by nbLines rows filled but the hole column,
+        returns the number of blocks pushed out of the top'''
+        nbRows = self.nbRows
+        nbColumns = self.nbColumns
+        nbLines = min(nbLines,nbRows)
+        rows = self.rows
+        rowCounts = self.rowCounts
+        cells = self.cells
+        top = self.top()
+        newTop = min(top+nbLines,nbRows)
+        # Rows of the board still inside it once moved up
+        nbKept = newTop - nbLines
+        nbLost = sum(rowCounts[nbKept:top])
+        self.nbFullRows -= sum(1 for row in rows[nbKept:top] if row == self.fullRow)
+        rows[nbLines:newTop] = rows[0:nbKept]
+        rowCounts[nbLines:newTop] = rowCounts[0:nbKept]
+        cells[nbLines*nbColumns:newTop*nbColumns] = cells[0:nbKept*nbColumns]
+        mask = self.fullRow & ~(1<<hole)
+        garbage = bytearray([typ])*nbColumns
+        garbage[hole] = 0
+        for y in range(0,nbLines):
+            rows[y] = mask
+            rowCounts[y] = nbColumns-1
+            cells[y*nbColumns:(y+1)*nbColumns] = garbage
+        heights = self.heights
+        for x in range(0,nbColumns):
+            h = heights[x]
+            if h == 0:
+                h = nbLines if x != hole else 0
+            elif h+nbLines <= nbRows:
+                h += nbLines
+            else:
+                # The top of the column was pushed out, look for the new one
+                bit = 1<<x
+                h = nbRows
+                while h>0 and not (rows[h-1] & bit):
+                    h -= 1
+            heights[x] = h
+        self.aggregateHeight = sum(heights)
+        self.nbBlocks += nbLines*(nbColumns-1) - nbLost
+        self.touchRows(0,newTop)
+        return nbLost
+
+    def snapshot(self)->bytes:
+        '''copy of the rows under the top and of the index as one bytes blob
+
+        The blob holds the header, the row masks, the heights, the row
+        counts and the cells, the rows above the top are empty and left out.
+        '''
+        top = self.top()
+        if self.fWideRows:
+            rows = b''.join(row.to_bytes(self.rowBytes,'little') for row in self.rows[0:top])
+        else:
+            rows = array('Q',self.rows[0:top])
+        return b''.join((BOARD_STATE.pack(top,self.nbFullRows,self.aggregateHeight,self.nbBlocks),
+                         rows,self.heightsStruct.pack(*self.heights),array('H',self.rowCounts[0:top]),
+                         self.cells[0:top*self.nbColumns]))
+
+    def restore(self, state: bytes):
+        '''put back a snapshot, only the rows under the old and the new top are written'''
+        nbColumns = self.nbColumns
+        oldTop = self.top()
+        top,self.nbFullRows,self.aggregateHeight,self.nbBlocks = BOARD_STATE.unpack_from(state)
+        view = memoryview(state)
+        i = BOARD_STATE.size
+        if self.fWideRows:
+            rowBytes = self.rowBytes
+            for y in range(0,top):
+                self.rows[y] = int.from_bytes(view[i:i+rowBytes],'little')
+                i += rowBytes
+        else:
+            self.rows[0:top] = view[i:i+8*top].cast('Q')
+            i += 8*top
+        self.heights[:] = self.heightsStruct.unpack_from(state,i)
+        i += self.heightsStruct.size
+        self.rowCounts[0:top] = view[i:i+2*top].cast('H')
+        i += 2*top
+        self.cells[0:top*nbColumns] = view[i:i+top*nbColumns]
+        if oldTop>top:
+            for y in range(top,oldTop):
+                self.rows[y] = 0
+                self.rowCounts[y] = 0
+            self.cells[top*nbColumns:oldTop*nbColumns] = bytes((oldTop-top)*nbColumns)
+        self.touchRows(0,max(top,oldTop))
+
+    def eraseCompletedLines(self)->int:
+        '''erase all the completed lines in one pass, returns the number of erased lines'''
+        if self.nbFullRows == 0:
+            return 0
+        rows = self.rows
+        rowCounts = self.rowCounts
+        cells = self.cells
+        nbColumns = self.nbColumns
+        # The rows under the first full one and above the highest block do not move
+        top = self.top()
+        yFirst = rows.index(self.fullRow)
+        yDes = yFirst
+        yTop = yFirst
+        for ySrc in range(yFirst,top):
+            row = rows[ySrc]
+            if row == self.fullRow:
+                yTop = ySrc
+                continue
+            if yDes != ySrc:
+                rows[yDes] = row
+                rowCounts[yDes] = rowCounts[ySrc]
+                cells[yDes*nbColumns:(yDes+1)*nbColumns] = cells[ySrc*nbColumns:(ySrc+1)*nbColumns]
+            yDes += 1
+        nbL = top - yDes
+        for y in range(yDes,top):
+            rows[y] = 0
+            rowCounts[y] = 0
+        cells[yDes*nbColumns:top*nbColumns] = bytes(nbL*nbColumns)
+        self.linesErased(nbL,yTop)
+        self.touchRows(yFirst,top)
+        return nbL
@@ -0,0 +1,154 @@
+"""  Batched pyglet renderer of a board and its tetrominos  """
+
+import pyglet
+from engine import CELL_SIZE, Tetromino, rotationsTable
+from ai import Placement
+from skins import SkinAtlas, BlockSprite, BOARD_TILE, GHOST_TILE
+from layout import Layout, CLASSIC_LAYOUT
+
+
+class BoardView:
+    '''Batched renderer of the board and the tetrominos
+
+    One sprite is allocated per board cell and per tetromino block, only
+    the cells of the rows which changed since the last frame are updated.
+    The sprites show the tiles of a SkinAtlas, they are drawn in layers
+    under its group : the atlas texture is bound once per frame whatever
+    the number of players sharing it.
+    '''
+
+    ghostOpacity = 40
+    hintOpacity = 80
+
+    def __init__(self, batch: pyglet.graphics.Batch, layout: Layout = CLASSIC_LAYOUT, atlas: SkinAtlas = None):
+        if atlas is None:
+            atlas = SkinAtlas(layout.cellSize-2)
+        self.batch = batch
+        self.layout = layout
+        self.atlas = atlas
+        self.backGroup = pyglet.graphics.Group(order=0,parent=atlas.group)
+        self.playGroup = pyglet.graphics.Group(order=1,parent=atlas.group)
+        self.pieceGroup = pyglet.graphics.Group(order=2,parent=atlas.group)
+        cs = layout.cellSize
+        ox = layout.ox
+        oy = layout.oy
+        # The background tile is stretched over the board
+        self.boardSprite = atlas.sprite(BOARD_TILE,ox,oy,batch,self.backGroup)
+        self.boardSprite.update(scale_x=layout.boardWidth/atlas.blockSize,
+                                scale_y=layout.nbRows*cs/atlas.blockSize)
+        self.cells = []
+        for y in range(0,layout.nbRows):
+            for x in range(0,layout.nbColumns):
+                sprite = atlas.sprite(BOARD_TILE,x*cs + ox + 1,y*cs + oy + 1,batch,self.playGroup)
+                sprite.visible = False
+                self.cells.append(sprite)
+        self.cellTypes = [0 for i in range(0,layout.nbColumns*layout.nbRows)]
+        # Board and version drawn by the last frame
+        self.board = None
+        self.boardVersion = 0
+        self.curSprites = [atlas.sprite(BOARD_TILE,0,0,batch,self.playGroup) for i in range(4)]
+        self.nextSprites = [atlas.sprite(BOARD_TILE,0,0,batch,self.pieceGroup) for i in range(4)]
+        # Landing spot of the current tetromino
+        self.ghostSprites = [atlas.sprite(GHOST_TILE,0,0,batch,self.playGroup) for i in range(4)]
+        for sprite in self.ghostSprites:
+            sprite.opacity = BoardView.ghostOpacity
+        # Best placement of the current tetromino
+        self.hintSprites = [atlas.sprite(BOARD_TILE,0,0,batch,self.playGroup) for i in range(4)]
+        for sprite in self.hintSprites:
+            sprite.opacity = BoardView.hintOpacity
+            sprite.visible = False
+        self.sprites = ([self.boardSprite] + self.cells + self.curSprites + self.nextSprites
+                        + self.ghostSprites + self.hintSprites)
+
+    def applySkin(self):
+        '''show the tiles of the current skin of the atlas, only the texture coordinates and scales change'''
+        tiles = self.atlas.tiles
+        scale = self.atlas.scale
+        for sprite in self.sprites:
+            sprite.setTile(sprite.kind,tiles[sprite.kind])
+            if sprite.scale != scale:
+                sprite.scale = scale
+
+    def setTile(self, sprite: BlockSprite, kind: int):
+        if sprite.kind != kind:
+            sprite.setTile(kind,self.atlas.tiles[kind])
+
+    def moveSprite(self, sprite: BlockSprite, x: float, y: float):
+        '''the vertices are only written when the block moved, the next tetromino and the ghost seldom move'''
+        if sprite.x != x or sprite.y != y:
+            sprite.position = (x, y, 0)
+
+    def setPlayVisible(self, fVisible: bool):
+        '''show or hide the frozen cells and the current tetromino'''
+        if self.playGroup.visible != fVisible:
+            self.playGroup.visible = fVisible
+
+    def changedRows(self, board: list[int]):
+        '''the rows changed since the last frame, all of them for a board without rowVersions'''
+        rowVersions = getattr(board,'rowVersions',None)
+        if rowVersions is None or board is not self.board:
+            self.board = board
+            self.boardVersion = getattr(board,'version',0)
+            return range(0,self.layout.nbRows)
+        version = self.boardVersion
+        if board.version == version:
+            return ()
+        self.boardVersion = board.version
+        return [y for y,v in enumerate(rowVersions) if v>version]
+
+    def updateBoard(self, board: list[int]):
+        '''update only the cells which changed since the last frame'''
+        cellTypes = self.cellTypes
+        nbColumns = self.layout.nbColumns
+        for y in self.changedRows(board):
+            for i in range(y*nbColumns,(y+1)*nbColumns):
+                typ = board[i]
+                if typ != cellTypes[i]:
+                    cellTypes[i] = typ
+                    sprite = self.cells[i]
+                    if typ != 0:
+                        self.setTile(sprite,typ)
+                        sprite.visible = True
+                    else:
+                        sprite.visible = False
+
+    def updateTetromino(self, sprites: list[BlockSprite], tetro: Tetromino, x: float, y: float):
+        '''move the 4 blocks of a tetromino, x,y is the pixel position of its center block'''
+        kind = tetro.pieceShape
+        cs = self.layout.cellSize
+        for sprite,[vx,vy] in zip(sprites,tetro.v):
+            self.moveSprite(sprite, x + vx*cs + 1, y + vy*cs + 1)
+            self.setTile(sprite,kind)
+
+    def updateHint(self, placement: Placement, shape: int):
+        '''show the blocks of the placement, hide them if placement is None'''
+        if placement is None:
+            for sprite in self.hintSprites:
+                if sprite.visible:
+                    sprite.visible = False
+            return
+        layout = self.layout
+        cs = layout.cellSize
+        for sprite,(vx,vy) in zip(self.hintSprites,rotationsTable[shape][placement.rot].v):
+            self.moveSprite(sprite, (placement.ix+vx)*cs + layout.ox + 1, (placement.iy+vy)*cs + layout.oy + 1)
+            self.setTile(sprite,shape)
+            if not sprite.visible:
+                sprite.visible = True
+
+    def updateGhost(self, tetro: Tetromino, y: int):
+        '''show the blocks of the tetromino at its landing height y'''
+        layout = self.layout
+        cs = layout.cellSize
+        x = tetro.x*layout.unit + layout.ox
+        y = y*layout.unit + layout.oy
+        for sprite,[vx,vy] in zip(self.ghostSprites,tetro.v):
+            self.moveSprite(sprite, x + vx*cs + 1, y + vy*cs + 1)
+
+    def update(self, board: list[int], curTetromino: Tetromino, nextTetromino: Tetromino):
+        layout = self.layout
+        self.updateBoard(board)
+        # The landing row is looked up in the board index, it is not searched again every frame
+        self.updateGhost(curTetromino, curTetromino.dropRow(board)*CELL_SIZE)
+        self.updateTetromino(self.curSprites, curTetromino, curTetromino.x*layout.unit + layout.ox,
+                             curTetromino.y*layout.unit + layout.oy)
+        self.updateTetromino(self.nextSprites, nextTetromino, layout.nextX, layout.nextY)
@@ -0,0 +1,1225 @@
+"""  Tetris game engine without any pyglet dependency  """
+
+from enum import IntEnum, unique
+import random
+import struct
+from typing import Iterable, NamedTuple
+from board import BitBoard
+
+# Size of the classic board, the Engine accepts any other size
+NB_ROWS = 20
+NB_COLUMNS = 10
+# Size of a cell in the tetromino coordinates unit, pieces move by one unit
+CELL_SIZE = 25
+# Fixed simulation step in seconds and the most ticks run by a single step()
+TICK_DT = 0.01
+MAX_TICKS_PER_STEP = 10
+# Timers in ticks
+HMOVE_TICKS = 4
+FALL_TICKS = 4
+DROP_TICKS = 2
+ERASE_TICKS = 20
+GAMEOVER_TICKS = 40
+# Moves of a Handling : delayed auto shift, auto repeat rate and lock delay
+# in ticks, and the moves or rotations of a landed tetromino restarting its
+# lock delay
+DAS_TICKS = 17
+ARR_TICKS = 5
+LOCK_TICKS = 50
+LOCK_RESETS = 15
+# Garbage lines sent to the opponent of a versus game for 0 to 4 completed lines
+GARBAGE_LINES = (0, 0, 1, 2, 4)
+# Board cell type of the garbage lines
+GARBAGE_TYPE = 8
+# Scalars heading the engine snapshots : score, nbCompletedLines, the flags,
+# hVelocity, the timers, accumulator, nbPieces, idTetroBag, the garbage
+# counters, the number of pending commands, the auto shift and lock timers
+# and the lock resets
+ENGINE_STATE = struct.Struct('<IB???bIIIdIBHHHHHB')
+
+@unique
+class TetrominoShape(IntEnum):
+    
+    NoShape = 0
+    ZShape = 1
+    SShape = 2
+    LineShape = 3
+    TShape = 4
+    SquareShape = 5
+    LShape = 6
+    MirroredLShape = 7
+
+class Tetromino:
+
+    __slots__ = ('v','x','y','pieceShape','color','velocityX','velocityY')
+
+    coordsTable = (
+        ((0, 0),     (0, 0),     (0, 0),     (0, 0)),
+        ((0, -1),    (0, 0),     (-1, 0),    (-1, 1)),
+        ((0, -1),    (0, 0),     (1, 0),     (1, 1)),
+        ((0, -1),    (0, 0),     (0, 1),     (0, 2)),
+        ((-1, 0),    (0, 0),     (1, 0),     (0, 1)),
+        ((0, 0),     (1, 0),     (0, 1),     (1, 1)),
+        ((-1, -1),   (0, -1),    (0, 0),     (0, 1)),
+        ((1, -1),    (0, -1),    (0, 0),     (0, 1))
+    )
+
+    colorsTable = [(0x00,0x00,0x00,0x00),
+                    (0xCC,0x66,0x66,0xFF),
+                    (0x66,0xCC,0x66,0xFF),
+                    (0x66,0x66,0xCC,0xFF),
+                    (0xCC,0xCC,0x66,0xFF),
+                    (0xCC,0x66,0xCC,0xFF),
+                    (0x66,0xCC,0xCC,0xFF),
+                    (0xDA,0xAA,0x00,0xFF),
+                    (0x80,0x80,0x80,0xFF)]
+    
+    def __init__(self,x :int ,y :int, shape :int) -> None:
+        self.v = [[0,0] for i in range(4)]
+        self.x = x
+        self.y = y
+        self.pieceShape = shape
+        self.color = Tetromino.colorsTable[shape]
+        self.setShape(shape)
+        self.velocityX = 0
+        self.velocityY = -1
+
+    def reset(self, x: int, y: int, shape: int):
+        '''reuse the tetromino for a new piece'''
+        self.x = x
+        self.y = y
+        self.setShape(shape)
+        self.velocityX = 0
+        self.velocityY = -1
+
+    def setShape(self, shape):
+        '''sets a shape'''
+        table = Tetromino.coordsTable[shape]
+        for i in range(4):
+            for j in range(2):
+                self.v[i][j] = table[i][j]
+        self.pieceShape = shape
+        self.color = Tetromino.colorsTable[shape]
+
+    def rotateLeft(self):
+        '''rotate shape to the left'''
+        if self.pieceShape == TetrominoShape.SquareShape:
+            return
+        for id,[vx,vy] in enumerate(self.v):
+            self.v[id][0] = vy
+            self.v[id][1] = -vx
+
+    def rotateRight(self):
+        '''rotate shape to the right'''        
+        if self.pieceShape == TetrominoShape.SquareShape:
+            return
+        for id,[vx,vy] in enumerate(self.v):
+            self.v[id][0] = -vy
+            self.v[id][1] = vx
+
+    def minX(self)->int:
+        '''returns min x value'''
+        m = 1000
+        for [vx,_] in self.v:
+            m = min(m, vx)
+        return m
+        
+    def maxX(self)->int:
+        '''returns max x value'''
+        m = -1000
+        for [vx,_] in self.v:
+            m = max(m, vx)
+        return m
+    
+    def minY(self)->int:
+        '''returns min y value'''
+        m = 1000
+        for [_,vy] in self.v:
+            m = min(m, vy)
+        return m
+        
+    def maxY(self)->int:
+        '''returns max y value'''
+        m = -1000
+        for [_,vy] in self.v:
+            m = max(m, vy)
+        return m
+    
+    def iX(self)->int:
+        ix = int((self.x)/CELL_SIZE)
+        return ix
+    
+    def iY(self)->int:
+        iy = int((self.y)/CELL_SIZE)
+        return iy
+    
+    def hitGround(self, board: list[int])->bool:
+        
+        for [vx,vy] in self.v:
+
+            # Top Left
+            ix = int((vx*CELL_SIZE + self.x)/CELL_SIZE)
+            iy = int((vy*CELL_SIZE + self.y)/CELL_SIZE)
+            if (ix>=0) and (ix<board.nbColumns) and (iy>=0) and (iy<board.nbRows):
+                t = board[ix+board.nbColumns*iy]
+                if t!=0:
+                    return True                        
+            # Top Right
+            ix = int((vx*CELL_SIZE + self.x + CELL_SIZE - 1)/CELL_SIZE)
+            iy = int((vy*CELL_SIZE + self.y)/CELL_SIZE)
+            if (ix>=0) and (ix<board.nbColumns) and (iy>=0) and (iy<board.nbRows):
+                t = board[ix+board.nbColumns*iy]
+                if t!=0:
+                    return True        
+
+            # Bottom Right
+            ix = int((vx*CELL_SIZE + self.x + CELL_SIZE - 1)/CELL_SIZE)
+            iy = int((vy*CELL_SIZE + self.y + CELL_SIZE - 1)/CELL_SIZE)
+            if (ix>=0) and (ix<board.nbColumns) and (iy>=0) and (iy<board.nbRows):
+                t = board[ix+board.nbColumns*iy]
+                if t!=0:
+                    return True        
+
+            # Bottom Left
+            ix = int((vx*CELL_SIZE + self.x)/CELL_SIZE)
+            iy = int((vy*CELL_SIZE + self.y + CELL_SIZE -1)/CELL_SIZE)
+            if (ix>=0) and (ix<board.nbColumns) and (iy>=0) and (iy<board.nbRows):
+                t = board[ix+board.nbColumns*iy]
+                if t!=0:
+                    return True        
+                
+        return False
+
+    def hitLeft(self, board: list[int])->bool:
+        self.velocityX = -1
+        fHit = False
+        for [vx,vy] in self.v:
+            x = vx*CELL_SIZE + self.x - 1
+            y = vy*CELL_SIZE + self.y
+            ix = int(x/CELL_SIZE)
+            iy = int(y/CELL_SIZE)
+            if (ix>=0) and (ix<board.nbColumns) and (iy>=0) and (iy<board.nbRows):
+                if board[ix+iy*board.nbColumns]!=0:
+                    fHit = True
+                    break
+            y = vy*CELL_SIZE + self.y + CELL_SIZE - 1
+            iy = int(y/CELL_SIZE)
+            if (ix>=0) and (ix<board.nbColumns) and (iy>=0) and (iy<board.nbRows):
+                if board[ix+iy*board.nbColumns]!=0:
+                    fHit = True
+                    break
+        return fHit
+    
+    def hitRight(self,board: list[int])->bool:
+        fHit = False
+        for [vx,vy] in self.v:
+            x = vx*CELL_SIZE + self.x + CELL_SIZE
+            y = vy*CELL_SIZE + self.y
+            ix = int(x/CELL_SIZE)
+            iy = int(y/CELL_SIZE)
+            if (ix>=0) and (ix<board.nbColumns) and (iy>=0) and (iy<board.nbRows):
+                if board[ix+iy*board.nbColumns]!=0:
+                    fHit = True
+                    break
+            y = vy*CELL_SIZE + self.y + CELL_SIZE - 1
+            iy = int(y/CELL_SIZE)
+            if (ix>=0) and (ix<board.nbColumns) and (iy>=0) and (iy<board.nbRows):
+                if board[ix+iy*board.nbColumns]!=0:
+                    fHit = True
+                    break
+        return fHit
+
+    def hitDown(self, board: list[int])->bool:
+        '''test the cells one pixel below the tetromino'''
+        for [vx,vy] in self.v:
+            x = vx*CELL_SIZE + self.x
+            y = vy*CELL_SIZE + self.y - 1
+            ix = int(x/CELL_SIZE)
+            iy = int(y/CELL_SIZE)
+            if (ix>=0) and (ix<board.nbColumns) and (iy>=0) and (iy<board.nbRows):
+                if board[ix+iy*board.nbColumns]!=0:
+                    return True
+            x = vx*CELL_SIZE + self.x + CELL_SIZE - 1
+            ix = int(x/CELL_SIZE)
+            if (ix>=0) and (ix<board.nbColumns) and (iy>=0) and (iy<board.nbRows):
+                if board[ix+iy*board.nbColumns]!=0:
+                    return True
+        return False
+
+    def isOutLimits(self, nbColumns: int = NB_COLUMNS, nbRows: int = NB_ROWS)->bool:
+        for [vx,vy] in self.v:
+            x = vx*CELL_SIZE + self.x
+            y = vy*CELL_SIZE + self.y
+            ix = int(x/CELL_SIZE)
+            iy = int(y/CELL_SIZE)
+            if (ix<0) or (ix>=nbColumns) or (iy<0) or (iy>=nbRows):
+                return True
+        return False
+    
+    def isOutRightLimit(self, nbColumns: int = NB_COLUMNS)->bool:
+        for [vx,_] in self.v:
+            x = vx*CELL_SIZE + self.x
+            ix = int(x/CELL_SIZE)
+            if (ix>=nbColumns):
+                return True
+        return False            
+       
+    def isOutLeftLimit(self)->bool:
+        for [vx,_] in self.v:
+            x = vx*CELL_SIZE + self.x
+            ix = int(x/CELL_SIZE)
+            if (ix<0):
+                return True
+        return False            
+
+    def hitBottom(self)->bool:
+        for [_,vy] in self.v:
+            y = vy*CELL_SIZE + self.y+CELL_SIZE
+            iy = int(y/CELL_SIZE)
+            if iy==0:
+                return True
+        return False
+
+    def dropRow(self, board: list[int])->int:
+        '''row where the tetromino of an aligned column lands when dropped straight down'''
+        savY = self.y
+        # Between two rows it covers both, start from the upper one as freeze_tetromino does
+        self.y = -(-self.y//CELL_SIZE)*CELL_SIZE
+        while self.y + self.minY()*CELL_SIZE > 0:
+            self.y -= CELL_SIZE
+            if self.hitGround(board):
+                self.y += CELL_SIZE
+                break
+        iy = max(self.y//CELL_SIZE,-self.minY())
+        self.y = savY
+        return iy
+
+    # x, y, shape, velocities and the 4 blocks
+    stateStruct = struct.Struct('<iiBhh8b')
+
+    def snapshot(self)->bytes:
+        v = self.v
+        return self.stateStruct.pack(self.x,self.y,self.pieceShape,self.velocityX,self.velocityY,
+                                     v[0][0],v[0][1],v[1][0],v[1][1],v[2][0],v[2][1],v[3][0],v[3][1])
+
+    def restore(self, state: bytes, offset: int = 0):
+        self.x,self.y,shape,self.velocityX,self.velocityY,*v = self.stateStruct.unpack_from(state,offset)
+        self.setShape(shape)
+        for i,p in enumerate(self.v):
+            p[0],p[1] = v[2*i],v[2*i+1]
+
+
+class Rotation(NamedTuple):
+    '''precomputed rotation state of a shape'''
+    v: tuple
+    minX: int
+    maxX: int
+    minY: int
+    maxY: int
+    # (dy, mask) for each row of the shape, bit i of mask is the block at x = minX + i
+    rowMasks: tuple
+
+def buildRotation(v: tuple)->Rotation:
+    minX = min(vx for vx,_ in v)
+    minY = min(vy for _,vy in v)
+    masks = {}
+    for vx,vy in v:
+        masks[vy] = masks.get(vy,0) | (1<<(vx-minX))
+    return Rotation(v, minX, max(vx for vx,_ in v), minY, max(vy for _,vy in v),
+                    tuple(sorted(masks.items())))
+
+def buildRotationsTable()->tuple:
+    '''the 4 rotation states of each shape, rotation r is r rotateRight() of coordsTable'''
+    table = []
+    for shape,coords in enumerate(Tetromino.coordsTable):
+        v = tuple(coords)
+        states = []
+        for r in range(4):
+            states.append(buildRotation(v))
+            if shape != TetrominoShape.SquareShape:
+                v = tuple((-vy,vx) for vx,vy in v)
+        table.append(tuple(states))
+    return tuple(table)
+
+rotationsTable = buildRotationsTable()
+
+def fits(board: BitBoard, shape: int, rot: int, ix: int, iy: int)->bool:
+    '''True if the shape in rotation rot fits at cell ix,iy, rows above the board are free'''
+    state = rotationsTable[shape][rot]
+    shift = ix + state.minX
+    if shift<0 or ix+state.maxX>=board.nbColumns or iy+state.minY<0:
+        return False
+    rows = board.rows
+    nbRows = board.nbRows
+    for dy,mask in state.rowMasks:
+        y = iy + dy
+        if y<nbRows and (rows[y] & (mask<<shift)):
+            return False
+    return True
+
+# Super Rotation System : the kicks (dx, dy) tried in turn by a rotation are
+# the offsets of the start state minus those of the end state, the states
+# are 0, R, 2 and L. The I tetromino has its own kicks for each turn.
+SRS_OFFSETS = (
+    ((0,0), (0,0), (0,0), (0,0), (0,0)),
+    ((0,0), (1,0), (1,-1), (0,2), (1,2)),
+    ((0,0), (0,0), (0,0), (0,0), (0,0)),
+    ((0,0), (-1,0), (-1,-1), (0,2), (-1,2)),
+)
+SRS_LINE_KICKS = {
+    (0,3): ((0,0), (-1,0), (2,0), (-1,2), (2,-1)),
+    (3,2): ((0,0), (-2,0), (1,0), (-2,-1), (1,2)),
+    (2,1): ((0,0), (1,0), (-2,0), (1,-2), (-2,1)),
+    (1,0): ((0,0), (2,0), (-1,0), (2,1), (-1,-2)),
+}
+
+def srsState(rot: int)->int:
+    '''SRS state of rotation rot, a rotateRight() is a quarter turn counterclockwise'''
+    return -rot & 3
+
+def buildKicksTable()->tuple:
+    '''the kicks of each shape for the turn from rotation r to r+1, the O tetromino does not move'''
+    table = []
+    for shape in range(len(rotationsTable)):
+        kicks = []
+        for r in range(4):
+            start,end = srsState(r),srsState(r+1)
+            if shape in (TetrominoShape.NoShape,TetrominoShape.SquareShape):
+                kicks.append(((0,0),))
+            elif shape == TetrominoShape.LineShape:
+                kicks.append(SRS_LINE_KICKS[start,end])
+            else:
+                kicks.append(tuple((x0-x1,y0-y1) for (x0,y0),(x1,y1) in zip(SRS_OFFSETS[start],SRS_OFFSETS[end])))
+        table.append(tuple(kicks))
+    return tuple(table)
+
+kicksTable = buildKicksTable()
+
+# Landing row when no block is under the tetromino
+NO_CONTACT = -(1<<30)
+
+class GridTetromino(Tetromino):
+    '''Tetromino answering the hit tests from the precomputed rotation states
+
+    The board must be a BitBoard, each test converts the pixel position to
+    the few cells it overlaps and ANDs the row masks with the board rows.
+    '''
+
+    __slots__ = ('rot','state','landingX','landingState','landingVersion','landingRow')
+
+    def __init__(self,x :int ,y :int, shape :int) -> None:
+        self.rot = 0
+        self.state = rotationsTable[shape][0]
+        self.landingX = None
+        self.landingState = None
+        self.landingVersion = None
+        self.landingRow = 0
+        super().__init__(x,y,shape)
+
+    def setShape(self, shape):
+        '''sets a shape'''
+        self.rot = 0
+        self.state = rotationsTable[shape][0]
+        self.v = self.state.v
+        self.pieceShape = shape
+        self.color = Tetromino.colorsTable[shape]
+
+    def setRotation(self, rot: int):
+        self.rot = rot & 3
+        self.state = rotationsTable[self.pieceShape][self.rot]
+        self.v = self.state.v
+
+    def rotateLeft(self):
+        '''rotate shape to the left'''
+        self.setRotation(self.rot-1)
+
+    def rotateRight(self):
+        '''rotate shape to the right'''
+        self.setRotation(self.rot+1)
+
+    def minX(self)->int:
+        return self.state.minX
+
+    def maxX(self)->int:
+        return self.state.maxX
+
+    def minY(self)->int:
+        return self.state.minY
+
+    def maxY(self)->int:
+        return self.state.maxY
+
+    def iX(self)->int:
+        return self.x//CELL_SIZE
+
+    def iY(self)->int:
+        return self.y//CELL_SIZE
+
+    def collides(self, board: BitBoard, ix: int, iy: int)->bool:
+        '''True if a block at cell ix,iy overlaps a board cell, cells outside the board are ignored'''
+        rows = board.rows
+        nbRows = board.nbRows
+        shift = ix + self.state.minX
+        for dy,mask in self.state.rowMasks:
+            y = iy + dy
+            if (y>=0) and (y<nbRows):
+                if shift>=0:
+                    if rows[y] & (mask<<shift):
+                        return True
+                elif rows[y] & (mask>>-shift):
+                    return True
+        return False
+
+    def hitGround(self, board: BitBoard)->bool:
+        ix0 = self.x//CELL_SIZE
+        iy0 = self.y//CELL_SIZE
+        ix1 = (self.x + CELL_SIZE - 1)//CELL_SIZE
+        iy1 = (self.y + CELL_SIZE - 1)//CELL_SIZE
+        if self.collides(board,ix0,iy0):
+            return True
+        if ix1!=ix0 and self.collides(board,ix1,iy0):
+            return True
+        if iy1!=iy0:
+            if self.collides(board,ix0,iy1):
+                return True
+            if ix1!=ix0 and self.collides(board,ix1,iy1):
+                return True
+        return False
+
+    def hitSide(self, board: BitBoard, x: int)->bool:
+        '''test the cells overlapped by the blocks left edge moved at pixel x'''
+        ix = x//CELL_SIZE
+        iy0 = self.y//CELL_SIZE
+        iy1 = (self.y + CELL_SIZE - 1)//CELL_SIZE
+        if self.collides(board,ix,iy0):
+            return True
+        return iy1!=iy0 and self.collides(board,ix,iy1)
+
+    def hitLeft(self, board: BitBoard)->bool:
+        self.velocityX = -1
+        return self.hitSide(board,self.x-1)
+
+    def hitRight(self, board: BitBoard)->bool:
+        return self.hitSide(board,self.x+CELL_SIZE)
+
+    def stackRow(self, board: BitBoard, ix: int)->int:
+        '''lowest row of the tetromino at column ix above the top of the columns under it
+
+        NO_CONTACT if these columns are empty. The blocks outside the
+        board are ignored, a rotation during a slide along the wall can
+        leave one there.
+        '''
+        heights = board.heights
+        nbColumns = len(heights)
+        row = NO_CONTACT
+        for vx,vy in self.state.v:
+            x = ix+vx
+            if x<0 or x>=nbColumns:
+                continue
+            h = heights[x]
+            if h>0 and h-vy>row:
+                row = h-vy
+        return row
+
+    def updateLanding(self, board: BitBoard):
+        '''the row where the tetromino rests on the board blocks, looked up in the column heights
+
+        It is only computed again when the tetromino moves to other columns,
+        rotates or when the board changes.
+        '''
+        if self.x != self.landingX or self.state is not self.landingState or board.version != self.landingVersion:
+            self.landingX = self.x
+            self.landingState = self.state
+            self.landingVersion = board.version
+            ix0 = self.x//CELL_SIZE
+            ix1 = (self.x + CELL_SIZE - 1)//CELL_SIZE
+            row = self.stackRow(board,ix0)
+            if ix1!=ix0:
+                row = max(row,self.stackRow(board,ix1))
+            self.landingRow = row
+
+    def hitDown(self, board: BitBoard)->bool:
+        # Above the landing row every block is above the top of its column
+        self.updateLanding(board)
+        yLanding = self.landingRow*CELL_SIZE
+        if self.y > yLanding:
+            return False
+        if self.y == yLanding:
+            return True
+        # Below the top of a column, under an overhang
+        ix0 = self.x//CELL_SIZE
+        ix1 = (self.x + CELL_SIZE - 1)//CELL_SIZE
+        iy = (self.y - 1)//CELL_SIZE
+        if self.collides(board,ix0,iy):
+            return True
+        return ix1!=ix0 and self.collides(board,ix1,iy)
+
+    def dropRow(self, board: BitBoard)->int:
+        '''row where the tetromino of an aligned row lands when dropped straight down'''
+        self.updateLanding(board)
+        iy = self.y//CELL_SIZE
+        floor = -self.state.minY
+        if iy >= self.landingRow:
+            return max(self.landingRow,floor)
+        # Under an overhang, test the rows one by one
+        ix0 = self.x//CELL_SIZE
+        ix1 = (self.x + CELL_SIZE - 1)//CELL_SIZE
+        while iy>floor and not self.collides(board,ix0,iy-1) and not (ix1!=ix0 and self.collides(board,ix1,iy-1)):
+            iy -= 1
+        return iy
+
+    def isOutLimits(self, nbColumns: int = NB_COLUMNS, nbRows: int = NB_ROWS)->bool:
+        ix = self.x//CELL_SIZE
+        iy = self.y//CELL_SIZE
+        state = self.state
+        return (ix+state.minX<0) or (ix+state.maxX>=nbColumns) or (iy+state.minY<0) or (iy+state.maxY>=nbRows)
+
+    def isOutRightLimit(self, nbColumns: int = NB_COLUMNS)->bool:
+        return self.x//CELL_SIZE + self.state.maxX >= nbColumns
+
+    def isOutLeftLimit(self)->bool:
+        return self.x//CELL_SIZE + self.state.minX < 0
+
+    def hitBottom(self)->bool:
+        return self.y + self.state.minY*CELL_SIZE < 0
+
+    # x, y, shape, velocities and rotation
+    stateStruct = struct.Struct('<iiBhhB')
+
+    def snapshot(self)->bytes:
+        return self.stateStruct.pack(self.x,self.y,self.pieceShape,self.velocityX,self.velocityY,self.rot)
+
+    def restore(self, state: bytes, offset: int = 0):
+        self.x,self.y,shape,self.velocityX,self.velocityY,rot = self.stateStruct.unpack_from(state,offset)
+        self.setShape(shape)
+        self.setRotation(rot)
+
+class Handling(NamedTuple):
+    '''Moves of the guideline games, the Engine slides the tetrominos without it
+
+    A press of left or right shifts the tetromino by one cell at once, held
+    das ticks the shift repeats every arr ticks, 0 moves it to the wall. A
+    landed tetromino locks after lockDelay ticks, each move or rotation
+    restarts the delay up to LOCK_RESETS times.
+    '''
+    das: int = DAS_TICKS
+    arr: int = ARR_TICKS
+    lockDelay: int = LOCK_TICKS
+
+def shuffleBag(rng: random.Random, bag: list[int]):
+    '''shuttle the 14 tetrominos of the bag in place, they are drawn from bag[0]'''
+    getrandbits = rng.getrandbits
+    for _ in range(14):
+        # The draws of rng.randint(0, 13) without its argument checks
+        iSrc = getrandbits(4)
+        while iSrc >= 14:
+            iSrc = getrandbits(4)
+        ityp = bag[iSrc]
+        bag[iSrc] = bag[0]
+        bag[0] = ityp
+
+@unique
+class Command(IntEnum):
+    MoveLeft = 1
+    MoveRight = 2
+    StopMove = 3
+    Rotate = 4
+    Drop = 5
+    HardDrop = 6
+    # One garbage line received from an opponent
+    Garbage = 7
+
+@unique
+class Event(IntEnum):
+    LineErased = 1
+    GameOver = 2
+
+class Engine:
+    '''Game state and rules of a Tetris game, stepped by step(dt, inputs)
+
+    The board size is chosen at creation, the tetrominos spawn at the
+    middle column of the two top rows.
+
+    In a versus game (see versus.py) the completed lines add GARBAGE_LINES
+    to garbageOut, they first cancel the garbage lines received and not
+    risen yet. The received lines come as Command.Garbage, so they are
+    recorded by the replays, and rise from the bottom when the next
+    tetromino is frozen.
+    '''
+
+    def __init__(self, seed: int = None, boardClass = BitBoard, fAnimateErase: bool = True,
+                 tetrominoClass = GridTetromino, nbColumns: int = NB_COLUMNS, nbRows: int = NB_ROWS,
+                 handling: Handling = None, kicks: bool = False) -> None:
+        self.rng = random.Random()
+        # Column of the holes of the garbage lines, the tetrominos do not depend on it
+        self.garbageRng = random.Random()
+        # GridTetromino needs a BitBoard, use Tetromino for a ListBoard
+        self.tetrominoClass = tetrominoClass
+        # When fAnimateErase is False all the completed lines are erased at freeze time
+        self.fAnimateErase = fAnimateErase
+        self.nbColumns = nbColumns
+        self.nbRows = nbRows
+        self.board = boardClass(nbColumns,nbRows)
+        self.spawnX = (nbColumns//2)*CELL_SIZE
+        self.spawnY = (nbRows-1)*CELL_SIZE
+        self.tetroBag = [1,2,3,4,5,6,7,1,2,3,4,5,6,7]
+        self.curTetromino = self.tetrominoClass(self.spawnX,self.spawnY-CELL_SIZE,0)
+        self.nextTetromino = self.tetrominoClass(0,0,0)
+        # Number of tetrominos spawned, the current and next ones are reused
+        self.nbPieces = 0
+        self.pendingCommands = []
+        # (tick, command) applied by step() before the tick, the key events at the time they occurred
+        self.scheduledCommands = []
+        # The DAS, ARR and lock delay need a GridTetromino, None for the classic slides
+        self.handling = handling
+        # The rotations try the SRS kicks of kicksTable, they need a GridTetromino too
+        self.fKicks = kicks
+        self.events = []
+        # Receives record(tick, command) for each applied command, see replay.py
+        self.recorder = None
+        self.newGame(seed)
+
+    def newGame(self, seed: int = None):
+        '''reset the game and its random generator, a 64 bits seed is drawn if none is given'''
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        self.seed = seed
+        self.rng.seed(seed)
+        self.garbageRng.seed(seed+1)
+        # States of the random generators shared by the snapshots, None once they are used
+        self.rngState = None
+        self.garbageRngState = None
+        self.pendingGarbage = 0
+        self.garbageOut = 0
+        for i in range(14):
+            self.tetroBag[i] = i%7 + 1
+        self.idTetroBag = 14
+        self.score = 0
+        self.board.reset()
+        self.nbCompletedLines = 0
+        self.fDropTetromino = False
+        self.fGameOver = False
+        self.fEnded = False
+        self.hVelocity = 0
+        self.ticks1 = 0
+        self.ticks3 = 0
+        self.nbTicks = 0
+        self.accumulator = 0.0
+        self.dasTicks = 0
+        self.lockTicks = 0
+        self.nbLockResets = 0
+        self.pendingCommands.clear()
+        self.scheduledCommands.clear()
+        self.curTetromino.reset(self.spawnX,self.spawnY-CELL_SIZE,self.tetrisRandomizer())
+        self.nextTetromino.reset(0,0,self.tetrisRandomizer())
+        self.nbPieces += 1
+
+    def is_game_over(self)->bool:
+        return not self.board.isRowEmpty(self.nbRows-1)
+
+    @staticmethod
+    def compute_score(nb_lines: int) -> int:
+        if nb_lines==1:
+            return 40
+        elif nb_lines==2:
+            return 100
+        elif nb_lines==3:
+            return 300
+        elif nb_lines==4:
+            return 1200
+        elif nb_lines>4:
+            return 2000
+        return 0
+
+    def freeze_tetromino(self)->bool:
+        ix = int((self.curTetromino.x+1)/CELL_SIZE)
+        iy = int((self.curTetromino.y+1)/CELL_SIZE)
+        for [vx,vy] in self.curTetromino.v:
+            x = vx + ix
+            y = vy + iy
+            if (x>=0) and (x<self.nbColumns) and (y>=0) and (y<self.nbRows) :
+                self.board[x+y*self.nbColumns] = self.curTetromino.pieceShape
+
+        self.nbCompletedLines = self.computeCompletedLines()
+        if self.nbCompletedLines>0:
+            self.score += self.compute_score(self.nbCompletedLines)
+            nbGarbage = GARBAGE_LINES[min(self.nbCompletedLines,4)]
+            nbCancelled = min(nbGarbage,self.pendingGarbage)
+            self.pendingGarbage -= nbCancelled
+            self.garbageOut += nbGarbage - nbCancelled
+            if not self.fAnimateErase:
+                self.board.eraseCompletedLines()
+            return True
+
+        return False
+
+    def computeCompletedLines(self)->int :
+        return self.board.computeCompletedLines()
+
+    def eraseFirstCompletedLine(self):
+        self.board.eraseFirstCompletedLine()
+
+    def tetrisRandomizer(self)->int:
+        ityp = 0
+        if self.idTetroBag<14:
+            ityp = self.tetroBag[self.idTetroBag]
+            self.idTetroBag += 1
+        else:
+            shuffleBag(self.rng,self.tetroBag)
+            ityp = self.tetroBag[0]
+            self.idTetroBag = 1
+            self.rngState = None
+        return ityp
+
+    def rotateTetromino(self):
+        '''rotate the current tetromino, shift it inside the board if needed'''
+        self.curTetromino.rotateRight()
+        savX = self.curTetromino.x
+        fUndo = False
+        if self.curTetromino.hitGround(self.board):
+            fUndo = True
+        elif self.curTetromino.isOutRightLimit(self.nbColumns):
+            # Try to shift inside board
+            while True:
+                self.curTetromino.x -= CELL_SIZE
+                if not self.curTetromino.isOutRightLimit(self.nbColumns):
+                    break
+            if self.curTetromino.hitGround(self.board):
+                fUndo = True
+        elif self.curTetromino.isOutLeftLimit():
+            # Try to shift inside board
+            while True:
+                self.curTetromino.x += CELL_SIZE
+                if not self.curTetromino.isOutLeftLimit():
+                    break
+            if self.curTetromino.hitGround(self.board):
+                fUndo = True
+        if fUndo:
+            self.curTetromino.x = savX
+            self.curTetromino.rotateLeft()
+
+    def applyCommand(self, command: Command):
+        match command:
+            case Command.MoveLeft:
+                self.hVelocity = -1
+                if self.handling is not None:
+                    self.pressShift()
+            case Command.MoveRight:
+                self.hVelocity = 1
+                if self.handling is not None:
+                    self.pressShift()
+            case Command.StopMove:
+                self.hVelocity = 0
+            case Command.Rotate:
+                if self.fKicks:
+                    if self.kickTetromino() and self.handling is not None:
+                        self.resetLock()
+                elif self.handling is None:
+                    self.rotateTetromino()
+                else:
+                    rot = self.curTetromino.rot
+                    self.rotateTetromino()
+                    if self.curTetromino.rot != rot:
+                        self.resetLock()
+            case Command.Drop:
+                self.fDropTetromino = True
+            case Command.HardDrop:
+                self.hardDrop()
+            case Command.Garbage:
+                self.pendingGarbage += 1
+
+    def hardDrop(self):
+        '''move the current tetromino straight to its landing row and freeze it'''
+        if self.nbCompletedLines>0 or self.fGameOver:
+            return
+        tetro = self.curTetromino
+        if tetro.x % CELL_SIZE != 0:
+            # Complete the slide in progress, its cells were checked when it started
+            if tetro.velocityX == -1:
+                tetro.x = (tetro.x//CELL_SIZE)*CELL_SIZE
+            else:
+                tetro.x = (tetro.x//CELL_SIZE+1)*CELL_SIZE
+        tetro.velocityX = 0
+        tetro.y = tetro.dropRow(self.board)*CELL_SIZE
+        self.spawnTetromino()
+
+    def kickTetromino(self)->bool:
+        '''turn the current tetromino at the first of its SRS kicks where it fits'''
+        tetro = self.curTetromino
+        shape = tetro.pieceShape
+        rot = (tetro.rot+1) & 3
+        ix = tetro.x//CELL_SIZE
+        iy = tetro.y//CELL_SIZE
+        # Between two rows while falling, between two columns during a classic slide
+        fBetweenRows = tetro.y % CELL_SIZE != 0
+        fBetweenColumns = tetro.x % CELL_SIZE != 0
+        board = self.board
+        for dx,dy in kicksTable[shape][tetro.rot]:
+            x = ix+dx
+            y = iy+dy
+            if (fits(board,shape,rot,x,y) and (not fBetweenRows or fits(board,shape,rot,x,y+1))
+                    and (not fBetweenColumns or (fits(board,shape,rot,x+1,y)
+                                                 and (not fBetweenRows or fits(board,shape,rot,x+1,y+1))))):
+                tetro.setRotation(rot)
+                tetro.x += dx*CELL_SIZE
+                tetro.y += dy*CELL_SIZE
+                return True
+        return False
+
+    def pressShift(self):
+        '''handling : a key press shifts the tetromino at once, the auto shift starts das ticks later'''
+        self.dasTicks = self.handling.das
+        self.shiftTetromino(self.hVelocity)
+
+    def shiftTetromino(self, direction: int)->bool:
+        '''handling : move the current tetromino by one cell if its cells are free'''
+        if self.nbCompletedLines>0 or self.fGameOver:
+            return False
+        tetro = self.curTetromino
+        ix = tetro.x//CELL_SIZE + direction
+        if ix + tetro.minX()<0 or ix + tetro.maxX()>=self.nbColumns:
+            return False
+        # Between two rows while falling
+        iy = tetro.y//CELL_SIZE
+        if tetro.collides(self.board,ix,iy) or (tetro.y % CELL_SIZE != 0 and tetro.collides(self.board,ix,iy+1)):
+            return False
+        tetro.x = ix*CELL_SIZE
+        self.resetLock()
+        return True
+
+    def autoShift(self):
+        '''handling : repeat the shift of the held key after the DAS, every ARR ticks'''
+        if self.hVelocity == 0:
+            return
+        self.dasTicks -= 1
+        if self.dasTicks>0:
+            return
+        if self.handling.arr == 0:
+            while self.shiftTetromino(self.hVelocity):
+                pass
+            self.dasTicks = 1
+        else:
+            self.shiftTetromino(self.hVelocity)
+            self.dasTicks = self.handling.arr
+
+    def resetLock(self):
+        '''restart the lock delay of a landed tetromino which moved, LOCK_RESETS times at most'''
+        if self.lockTicks>0 and self.nbLockResets<LOCK_RESETS:
+            self.lockTicks = 0
+            self.nbLockResets += 1
+
+    def isLanded(self)->bool:
+        tetro = self.curTetromino
+        if tetro.y % CELL_SIZE != 0:
+            return False
+        return tetro.y <= -tetro.minY()*CELL_SIZE or tetro.hitDown(self.board)
+
+    def fall(self):
+        '''handling : let the current tetromino fall, lock it once landed for the lock delay'''
+        if self.isLanded():
+            self.lockTicks += 1
+            if self.lockTicks >= self.handling.lockDelay:
+                self.spawnTetromino()
+            return
+        self.lockTicks = 0
+        if self.fDropTetromino:
+            delay = DROP_TICKS
+            nbRepeat = 10
+        else:
+            delay = FALL_TICKS
+            nbRepeat = 3
+        if self.ticks3 >= delay:
+            self.ticks3 = 0
+            tetro = self.curTetromino
+            for _ in range(nbRepeat):
+                tetro.y += tetro.velocityY
+                if self.isLanded():
+                    break
+
+    def spawnTetromino(self):
+        '''freeze the current tetromino and take the next one'''
+        self.lockTicks = 0
+        self.nbLockResets = 0
+        if self.freeze_tetromino() and not self.fAnimateErase:
+            self.events.extend(Event.LineErased for i in range(self.nbCompletedLines))
+            self.nbCompletedLines = 0
+        fOverflow = False
+        if self.pendingGarbage>0 and self.nbCompletedLines==0:
+            fOverflow = self.riseGarbage()
+        if fOverflow or self.is_game_over():
+            self.fGameOver = True
+        else:
+            self.fDropTetromino = False
+            self.curTetromino.reset(self.spawnX,self.spawnY,self.nextTetromino.pieceShape)
+            self.nextTetromino.reset(0,0,self.tetrisRandomizer())
+            self.nbPieces += 1
+
+    def riseGarbage(self)->bool:
+        '''push the board up by the received garbage lines, they have the same hole
+
+        Returns True if blocks were pushed out of the board.
+        '''
+        nbLines = self.pendingGarbage
+        self.pendingGarbage = 0
+        hole = self.garbageRng.randrange(self.nbColumns)
+        self.garbageRngState = None
+        return self.board.insertGarbage(nbLines,hole,GARBAGE_TYPE)>0
+
+    def snapshot(self)->tuple:
+        '''copy of the game state, restore() brings the game back to it
+
+        The state is a bytes blob plus the states of the two random
+        generators. These are only read again after the generators were
+        used, once per bag of tetrominos or garbage rise, the snapshots in
+        between share them. The events, the recorder and the seed of the
+        game are not part of the state, the rollback of a network game
+        replays the ticks from the last confirmed one.
+        '''
+        if self.rngState is None:
+            self.rngState = self.rng.getstate()
+        if self.garbageRngState is None:
+            self.garbageRngState = self.garbageRng.getstate()
+        blob = b''.join((ENGINE_STATE.pack(self.score,self.nbCompletedLines,self.fDropTetromino,
+                                           self.fGameOver,self.fEnded,self.hVelocity,self.ticks1,
+                                           self.ticks3,self.nbTicks,self.accumulator,self.nbPieces,
+                                           self.idTetroBag,self.pendingGarbage,self.garbageOut,
+                                           len(self.pendingCommands),self.dasTicks,self.lockTicks,
+                                           self.nbLockResets),
+                         self.curTetromino.snapshot(),self.nextTetromino.snapshot(),
+                         bytes(self.tetroBag),bytes(self.pendingCommands),self.board.snapshot()))
+        return (blob,self.rngState,self.garbageRngState)
+
+    def restore(self, state: tuple):
+        blob,rngState,garbageRngState = state
+        (self.score,self.nbCompletedLines,self.fDropTetromino,self.fGameOver,self.fEnded,
+         self.hVelocity,self.ticks1,self.ticks3,self.nbTicks,self.accumulator,self.nbPieces,
+         self.idTetroBag,self.pendingGarbage,self.garbageOut,nbPending,self.dasTicks,self.lockTicks,
+         self.nbLockResets) = ENGINE_STATE.unpack_from(blob)
+        i = ENGINE_STATE.size
+        self.curTetromino.restore(blob,i)
+        i += self.curTetromino.stateStruct.size
+        self.nextTetromino.restore(blob,i)
+        i += self.nextTetromino.stateStruct.size
+        self.tetroBag[:] = blob[i:i+14]
+        i += 14
+        self.pendingCommands[:] = [Command(c) for c in blob[i:i+nbPending]]
+        i += nbPending
+        self.board.restore(memoryview(blob)[i:])
+        if rngState is not self.rngState:
+            self.rng.setstate(rngState)
+            self.rngState = rngState
+        if garbageRngState is not self.garbageRngState:
+            self.garbageRng.setstate(garbageRngState)
+            self.garbageRngState = garbageRngState
+
+    def step(self, dt: float, inputs: Iterable[Command] = ()) -> list[Event]:
+        '''queue the inputs then advance the game by dt seconds of fixed ticks
+
+        The inputs are applied by the next tick, the scheduledCommands by
+        the tick they are scheduled for. At most MAX_TICKS_PER_STEP ticks
+        are run, a longer stall is dropped instead of caught up.
+        Returns the events which occured, the list is reused by the next step.
+        '''
+        events = self.events
+        events.clear()
+        self.pendingCommands.extend(inputs)
+        self.accumulator += dt
+        nbTicks = 0
+        while self.accumulator >= TICK_DT - 1e-9:
+            if nbTicks == MAX_TICKS_PER_STEP:
+                self.accumulator = 0.0
+                break
+            self.accumulator -= TICK_DT
+            if self.scheduledCommands:
+                self.applyScheduledCommands()
+            self.tick()
+            nbTicks += 1
+        return events
+
+    def applyScheduledCommands(self):
+        '''queue the scheduled commands of the next tick and of the ticks already run'''
+        scheduled = self.scheduledCommands
+        tick = self.nbTicks + 1
+        i = 0
+        while i<len(scheduled) and scheduled[i][0] <= tick:
+            self.pendingCommands.append(scheduled[i][1])
+            i += 1
+        del scheduled[:i]
+
+    def tick(self):
+        '''apply the pending commands and advance the game by one fixed step'''
+        events = self.events
+        if self.fEnded:
+            self.pendingCommands.clear()
+            return
+        self.applyPendingCommands()
+
+        self.nbTicks += 1
+        self.ticks1 += 1
+        self.ticks3 += 1
+
+        if self.nbCompletedLines>0:
+            if self.ticks1 >= ERASE_TICKS:
+                self.ticks1 = 0
+                self.eraseFirstCompletedLine()
+                self.nbCompletedLines -= 1
+                events.append(Event.LineErased)
+            return
+
+        if self.fGameOver:
+            if self.ticks1 >= GAMEOVER_TICKS:
+                self.fEnded = True
+                events.append(Event.GameOver)
+            return
+
+        if self.handling is not None:
+            self.autoShift()
+            self.fall()
+            return
+
+        # Horizontal move
+        if self.ticks1 >= HMOVE_TICKS:
+            self.ticks1 = 0
+            self.moveHorizontal()
+
+        self.moveDown()
+
+    def applyPendingCommands(self):
+        for command in self.pendingCommands:
+            if self.recorder is not None:
+                self.recorder.record(self.nbTicks,command)
+            self.applyCommand(command)
+        self.pendingCommands.clear()
+
+    def moveHorizontal(self):
+        '''slide the current tetromino by up to 4 sub-cells'''
+        for _ in range(4):
+            if self.curTetromino.velocityX == 1:
+                dum = self.curTetromino.x + self.curTetromino.velocityX
+                if (dum % CELL_SIZE)!=0:
+                    if not (self.curTetromino.hitRight(self.board)):
+                        self.curTetromino.x += self.curTetromino.velocityX
+                else:
+                    self.curTetromino.x += self.curTetromino.velocityX
+                    self.curTetromino.velocityX = 0
+            elif self.curTetromino.velocityX == -1:
+                dum = self.curTetromino.x + self.curTetromino.velocityX
+                if (dum % CELL_SIZE)!=0:
+                    if not (self.curTetromino.hitLeft(self.board)):
+                        self.curTetromino.x += self.curTetromino.velocityX
+                else:
+                    self.curTetromino.x += self.curTetromino.velocityX
+                    self.curTetromino.velocityX = 0
+            else:
+                if  self.hVelocity==-1:
+                    if (self.curTetromino.x % CELL_SIZE)==0:
+                        _x = self.curTetromino.minX() + self.curTetromino.iX()
+                        if  _x > 0:
+                            self.curTetromino.velocityX = -1
+                            if not (self.curTetromino.hitLeft(self.board)):
+                                self.curTetromino.x += self.curTetromino.velocityX
+
+                elif self.hVelocity==1:
+                    if (self.curTetromino.x % CELL_SIZE)==0:
+                        _x = self.curTetromino.maxX() + self.curTetromino.iX()
+                        if _x<(self.nbColumns-1):
+                            self.curTetromino.velocityX = 1
+                            if not (self.curTetromino.hitRight(self.board)):
+                                self.curTetromino.x += self.curTetromino.velocityX
+
+    def moveDown(self):
+        '''let the current tetromino fall, freeze it when it lands'''
+        if self.fDropTetromino:
+            delay = DROP_TICKS
+            nbRepeat = 10
+        else:
+            delay = FALL_TICKS
+            nbRepeat = 3
+
+        if self.ticks3 >= delay:
+            self.ticks3 = 0
+            for _ in range(nbRepeat):
+                # Test hit freeze tetromino's cells
+                if self.curTetromino.hitDown(self.board):
+                    if (self.curTetromino.x % CELL_SIZE)==0 and (self.curTetromino.y % CELL_SIZE)==0:
+                        self.spawnTetromino()
+                else:
+                    # Current Tetromino reach the bottom
+                    if not self.curTetromino.hitBottom():
+                        self.curTetromino.y += self.curTetromino.velocityY
+                        if (self.curTetromino.x%CELL_SIZE)==0:
+                            if (self.curTetromino.y%CELL_SIZE)==0:
+                                # Allow horizontal sliding
+                                if  self.hVelocity!=0:
+                                    break
+                    else:
+                        if self.hVelocity!=0:
+                            # Allow horizontal movement
+                            break
+                        else:
+                            # Freeze current Tetromino
+                            # Ajust Tetromino horizontal position
+                            if self.curTetromino.x%CELL_SIZE!=0:
+                                self.curTetromino.x = (int(self.curTetromino.x/CELL_SIZE)+1)*CELL_SIZE
+                            self.spawnTetromino()
+
+
+class SnapshotRing:
+    '''Snapshots of the last ticks, the oldest one is overwritten when full
+
+    The slots are allocated once, pushing a snapshot only stores a
+    reference. Used by the network rollback and the undo of the practice
+    mode.
+    '''
+
+    __slots__ = ('ticks','states','iNext','count')
+
+    def __init__(self, capacity: int):
+        self.ticks = [0]*capacity
+        self.states = [None]*capacity
+        self.iNext = 0
+        self.count = 0
+
+    def __len__(self)->int:
+        return self.count
+
+    def clear(self):
+        self.states[:] = [None]*len(self.states)
+        self.iNext = 0
+        self.count = 0
+
+    def push(self, tick: int, state):
+        i = self.iNext
+        self.ticks[i] = tick
+        self.states[i] = state
+        self.iNext = (i+1) % len(self.states)
+        if self.count<len(self.states):
+            self.count += 1
+
+    def get(self, tick: int):
+        '''the newest snapshot of tick, None if it is not kept'''
+        capacity = len(self.states)
+        i = self.iNext
+        for _ in range(self.count):
+            i = (i-1) % capacity
+            if self.ticks[i] == tick:
+                return self.states[i]
+        return None
+
+    def oldestTick(self)->int:
+        '''tick of the oldest snapshot kept, -1 if none'''
+        if self.count == 0:
+            return -1
+        return self.ticks[(self.iNext-self.count) % len(self.states)]
+
+    def rewind(self, tick: int):
+        '''drop the snapshots newer than tick, returns the newest one left, None if none is left'''
+        capacity = len(self.states)
+        while self.count>0:
+            i = (self.iNext-1) % capacity
+            if self.ticks[i] <= tick:
+                return self.states[i]
+            self.states[i] = None
+            self.iNext = i
+            self.count -= 1
+        return None
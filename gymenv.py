@@ -0,0 +1,272 @@
+"""  Gym style environments of the game for the reinforcement learning  """
+
+import random
+import numpy as np
+from engine import (Engine, Command, Event, shuffleBag, rotationsTable, CELL_SIZE, NB_COLUMNS, NB_ROWS)
+
+try:
+    from gymnasium import spaces
+except ImportError:
+    spaces = None
+
+# Commands of the key actions, action 0 presses no key
+KEY_ACTIONS = (None, Command.MoveLeft, Command.MoveRight, Command.StopMove, Command.Rotate, Command.Drop,
+               Command.HardDrop)
+# Ticks run by a key step, the time of one horizontal move
+KEY_TICKS = 4
+# Score of 0 to 4 lines completed by a placement, from the rules of the Engine
+LINE_SCORES = tuple(Engine.compute_score(nbLines) for nbLines in range(5))
+# The piece and next observations are shapes below NB_SHAPES, 0 is no shape
+NB_SHAPES = len(rotationsTable)
+
+
+def placementAction(rot: int, column: int, nbColumns: int = NB_COLUMNS)->int:
+    '''action dropping the tetromino in rotation rot with its left block in column'''
+    return rot*nbColumns + column
+
+
+class TetrisEnv:
+    '''One game with the reset() / step(action) API of Gym
+
+    The observation is a dict of the board, a (rows, columns) uint8 array
+    of 0 and 1 whose row 0 is the bottom, and of the shapes of the current
+    and next tetrominos. The reward is the score of the completed lines.
+
+    With fPlacement an action is placementAction(rot, column) : the
+    tetromino turns, moves over the column of its left block and drops
+    straight down, the column is clamped inside the board. Otherwise an
+    action is an index of KEY_ACTIONS and the game runs KEY_TICKS ticks.
+    The completed lines are erased at once, an episode ends at the game
+    over and is truncated after maxSteps steps.
+
+    The actions are below nbActions. With gymnasium installed action_space
+    and observation_space describe them, else they are None.
+    '''
+
+    def __init__(self, nbColumns: int = NB_COLUMNS, nbRows: int = NB_ROWS, fPlacement: bool = True,
+                 maxSteps: int = None, seed: int = None):
+        self.nbColumns = nbColumns
+        self.nbRows = nbRows
+        self.fPlacement = fPlacement
+        self.maxSteps = maxSteps
+        self.nbActions = 4*nbColumns if fPlacement else len(KEY_ACTIONS)
+        self.action_space = None
+        self.observation_space = None
+        if spaces is not None:
+            self.action_space = spaces.Discrete(self.nbActions)
+            self.observation_space = spaces.Dict({
+                'board': spaces.Box(0,1,(nbRows,nbColumns),np.uint8),
+                'piece': spaces.Discrete(NB_SHAPES),
+                'next': spaces.Discrete(NB_SHAPES),
+            })
+        self.engine = Engine(seed,fAnimateErase=False,nbColumns=nbColumns,nbRows=nbRows)
+        self.nbSteps = 0
+
+    def observation(self)->dict:
+        engine = self.engine
+        cells = np.frombuffer(engine.board.cells,dtype=np.uint8).reshape(self.nbRows,self.nbColumns)
+        return {
+            'board': (cells != 0).view(np.uint8),
+            'piece': engine.curTetromino.pieceShape,
+            'next': engine.nextTetromino.pieceShape,
+        }
+
+    def reset(self, seed: int = None, options: dict = None)->tuple:
+        '''start a new game, returns (observation, info)'''
+        self.engine.newGame(seed)
+        self.nbSteps = 0
+        return self.observation(),{'score': 0}
+
+    def place(self, action: int):
+        '''drop the current tetromino where the placement action puts it'''
+        rot,column = divmod(int(action),self.nbColumns)
+        tetro = self.engine.curTetromino
+        tetro.setRotation(rot)
+        state = tetro.state
+        column = min(column,self.nbColumns-1-(state.maxX-state.minX))
+        tetro.x = (column-state.minX)*CELL_SIZE
+        # Above the board, it lands on the highest block under it
+        tetro.y = self.nbRows*CELL_SIZE
+        tetro.velocityX = 0
+        self.engine.hardDrop()
+
+    def step(self, action: int)->tuple:
+        '''play an action, returns (observation, reward, terminated, truncated, info)'''
+        engine = self.engine
+        score = engine.score
+        events = engine.events
+        events.clear()
+        if self.fPlacement:
+            self.place(action)
+        else:
+            command = KEY_ACTIONS[action]
+            if command is not None:
+                engine.pendingCommands.append(command)
+            for _ in range(KEY_TICKS):
+                engine.tick()
+                if engine.fGameOver:
+                    break
+        self.nbSteps += 1
+        fTruncated = self.maxSteps is not None and self.nbSteps >= self.maxSteps
+        return (self.observation(),engine.score-score,engine.fGameOver,fTruncated,
+                {'score': engine.score, 'lines': events.count(Event.LineErased)})
+
+
+class VecEnv:
+    '''n games played in lockstep by placement actions, see TetrisEnv
+
+    The boards are the bitmask rows of a (n, rows+4) array, a step places
+    the tetrominos of all the games with a few array operations instead of
+    n engine calls. The games follow the rules of the Engine and draw the
+    same tetrominos : with the same seeds and actions a VecEnv and
+    TetrisEnvs play the same games.
+
+    The observations and rewards are arrays of n. A game which ends is
+    reset by the step with a seed drawn from the seed of the VecEnv, the
+    observation is then the one of the new game, info['final_score'] is
+    the score of the games ended by the step.
+
+    As for TetrisEnv, the actions are below nbActions and action_space and
+    observation_space are the gymnasium spaces of the n games or None.
+    '''
+
+    def __init__(self, n: int, nbColumns: int = NB_COLUMNS, nbRows: int = NB_ROWS, maxSteps: int = None,
+                 seed: int = None):
+        if nbColumns>64:
+            raise ValueError('the rows of a VecEnv board hold 64 columns at most')
+        self.n = n
+        self.nbColumns = nbColumns
+        self.nbRows = nbRows
+        self.maxSteps = maxSteps
+        self.nbActions = 4*nbColumns
+        self.action_space = None
+        self.observation_space = None
+        if spaces is not None:
+            self.action_space = spaces.MultiDiscrete([self.nbActions]*n)
+            self.observation_space = spaces.Dict({
+                'board': spaces.Box(0,1,(n,nbRows,nbColumns),np.uint8),
+                'piece': spaces.MultiDiscrete([NB_SHAPES]*n),
+                'next': spaces.MultiDiscrete([NB_SHAPES]*n),
+            })
+        self.seedRng = random.Random(seed)
+        self.dtype = np.uint16 if nbColumns<=16 else np.uint32 if nbColumns<=32 else np.uint64
+        self.fullRow = self.dtype((1<<nbColumns) - 1)
+        self.columnBits = np.array([1<<x for x in range(nbColumns)],dtype=self.dtype)
+        self.lineScores = np.array(LINE_SCORES,dtype=np.int64)
+        # Per shape*4 + rotation : columns of the blocks from the left one, their rows,
+        # the (dy, mask) of the 4 rows from minY and the rightmost column of the left block
+        nbStates = len(rotationsTable)*4
+        self.cellsX = np.zeros((nbStates,4),dtype=np.intp)
+        self.cellsY = np.zeros((nbStates,4),dtype=np.intp)
+        self.rowsDy = np.zeros((nbStates,4),dtype=np.intp)
+        self.rowsMask = np.zeros((nbStates,4),dtype=self.dtype)
+        self.maxColumn = np.zeros(nbStates,dtype=np.intp)
+        for shape,states in enumerate(rotationsTable):
+            for rot,state in enumerate(states):
+                k = shape*4 + rot
+                self.cellsX[k] = [vx-state.minX for vx,_ in state.v]
+                self.cellsY[k] = [vy for _,vy in state.v]
+                masks = dict(state.rowMasks)
+                self.rowsDy[k] = range(state.minY,state.minY+4)
+                self.rowsMask[k] = [masks.get(dy,0) for dy in range(state.minY,state.minY+4)]
+                self.maxColumn[k] = max(0,nbColumns-1-(state.maxX-state.minX))
+        # 4 spare rows on top for the blocks above the board
+        self.rows = np.zeros((n,nbRows+4),dtype=self.dtype)
+        self.cells = np.zeros((n,nbRows,nbColumns),dtype=bool)
+        self.scores = np.zeros(n,dtype=np.int64)
+        self.nbSteps = np.zeros(n,dtype=np.int64)
+        self.pieces = np.zeros(n,dtype=np.intp)
+        self.nextPieces = np.zeros(n,dtype=np.intp)
+        # The shuttle bag of each game, the next tetrominos are bags[i, iBags[i]:]
+        self.rngs = [random.Random() for _ in range(n)]
+        self.bags = np.zeros((n,14),dtype=np.intp)
+        self.iBags = np.zeros(n,dtype=np.intp)
+        self.ids = np.arange(n)
+
+    def refillBags(self, games):
+        '''shuffle the bags of games, as Engine.tetrisRandomizer does'''
+        for i in games:
+            bag = self.bags[i].tolist()
+            shuffleBag(self.rngs[i],bag)
+            self.bags[i] = bag
+        self.iBags[games] = 0
+
+    def drawPieces(self)->np.ndarray:
+        '''next tetromino of every game'''
+        empty = np.flatnonzero(self.iBags == 14)
+        if len(empty):
+            self.refillBags(empty)
+        pieces = self.bags[self.ids,self.iBags]
+        self.iBags += 1
+        return pieces
+
+    def newGames(self, games, seeds: list[int]):
+        for i,seed in zip(games,seeds):
+            self.rngs[i].seed(seed)
+        self.rows[games] = 0
+        self.cells[games] = False
+        self.scores[games] = 0
+        self.nbSteps[games] = 0
+        self.bags[games] = [i%7 + 1 for i in range(14)]
+        self.refillBags(games)
+        self.pieces[games] = self.bags[games,0]
+        self.nextPieces[games] = self.bags[games,1]
+        self.iBags[games] = 2
+
+    def observation(self)->dict:
+        return {
+            'board': self.cells.view(np.uint8).copy(),
+            'piece': self.pieces.copy(),
+            'next': self.nextPieces.copy(),
+        }
+
+    def reset(self, seeds: list[int] = None)->tuple:
+        '''start n new games, seeds are drawn from the seed of the VecEnv if not given'''
+        if seeds is None:
+            seeds = [self.seedRng.getrandbits(64) for _ in range(self.n)]
+        self.newGames(self.ids,seeds)
+        return self.observation(),{'score': self.scores.copy()}
+
+    def step(self, actions)->tuple:
+        '''play one placement action per game, returns (observations, rewards, terminated, truncated, info)'''
+        nbRows = self.nbRows
+        dtype = self.dtype
+        rows = self.rows
+        rot,columns = np.divmod(np.asarray(actions,dtype=np.intp),self.nbColumns)
+        k = self.pieces*4 + (rot & 3)
+        columns = np.minimum(columns,self.maxColumn[k])
+        # Height of each column, the tetromino lands on the highest one under its blocks
+        cells = self.cells
+        heights = np.where(cells.any(axis=1),nbRows - cells[:,::-1].argmax(axis=1),0)
+        x = self.cellsX[k] + columns[:,None]
+        iy = (np.take_along_axis(heights,x,axis=1) - self.cellsY[k]).max(axis=1)
+        # The 4 rows of a placement are distinct
+        ys = iy[:,None] + self.rowsDy[k]
+        rows[self.ids[:,None],ys] |= self.rowsMask[k] << columns[:,None].astype(dtype)
+        # The blocks above the board are lost, as Engine.freeze_tetromino does
+        rows[:,nbRows:] = 0
+        full = rows[:,:nbRows] == self.fullRow
+        nbLines = full.sum(axis=1)
+        games = np.flatnonzero(nbLines)
+        if len(games):
+            # Move down the kept rows of the games with completed lines
+            kept = ~full[games]
+            g,y = np.nonzero(kept)
+            dst = np.cumsum(kept,axis=1)[g,y] - 1
+            erased = np.zeros((len(games),nbRows+4),dtype=dtype)
+            erased[g,dst] = rows[games[g],y]
+            rows[games] = erased
+        rewards = self.lineScores[nbLines]
+        self.scores += rewards
+        self.nbSteps += 1
+        terminated = rows[:,nbRows-1] != 0
+        truncated = self.nbSteps >= self.maxSteps if self.maxSteps is not None else np.zeros(self.n,dtype=bool)
+        self.pieces[:] = self.nextPieces
+        self.nextPieces[:] = self.drawPieces()
+        info = {'score': self.scores.copy(), 'lines': nbLines}
+        ended = np.flatnonzero(terminated | truncated)
+        if len(ended):
+            info['final_score'] = np.where(terminated | truncated,self.scores,0)
+            self.newGames(ended,[self.seedRng.getrandbits(64) for _ in range(len(ended))])
+        np.not_equal(rows[:,:nbRows,None] & self.columnBits,0,out=cells)
+        return self.observation(),rewards,terminated,truncated,info
@@ -0,0 +1,156 @@
+"""  High scores tables and their crash safe storage  """
+
+import os
+from bisect import bisect_right
+
+HEADER = '# highscores 2\n'
+# Board of the classic game, the one shown by the high scores screen
+CLASSIC_BOARD = 'classic'
+
+
+class HighScore:
+
+    __slots__ = ('name','score')
+
+    def __init__(self, name:str, score:int):
+        self.name = name
+        self.score = score
+
+
+def cleanName(name: str)->str:
+    '''a name fit for one line of the file'''
+    return name.replace('\n',' ').replace('\r',' ')
+
+
+class HighScoreTable:
+    '''Best scores of a board, sorted from the best one, at most capacity entries
+
+    keys holds the negated scores in increasing order, next to the
+    entries, so a score is placed with a bisect. A new score is placed
+    after the equal ones, it has to beat a score to take its place.
+    '''
+
+    def __init__(self, capacity: int = 10):
+        self.capacity = capacity
+        self.entries = []
+        self.keys = []
+        self.fDirty = False
+
+    def __len__(self)->int:
+        return len(self.entries)
+
+    def __getitem__(self, i: int)->HighScore:
+        return self.entries[i]
+
+    def top(self, n: int)->list[HighScore]:
+        return self.entries[:n]
+
+    def rank(self, score: int)->int:
+        '''position the score would take, may be beyond the capacity'''
+        return bisect_right(self.keys,-score)
+
+    def isHighScore(self, score: int)->bool:
+        return score>0 and self.rank(score)<self.capacity
+
+    def insert(self, name: str, score: int)->int:
+        '''insert a score, returns its position or -1 if it is not a high score'''
+        if not self.isHighScore(score):
+            return -1
+        i = self.rank(score)
+        self.entries.insert(i,HighScore(cleanName(name),score))
+        self.keys.insert(i,-score)
+        if len(self.entries)>self.capacity:
+            self.entries.pop()
+            self.keys.pop()
+        self.fDirty = True
+        return i
+
+    def setName(self, i: int, name: str):
+        name = cleanName(name)
+        if 0<=i<len(self.entries) and self.entries[i].name != name:
+            self.entries[i].name = name
+            self.fDirty = True
+
+    def load(self, entries: list[tuple]):
+        '''replace the table by (name, score) entries in any order'''
+        entries = sorted(entries,key=lambda e: -e[1])[:self.capacity]
+        self.entries = [HighScore(cleanName(name),score) for name,score in entries]
+        self.keys = [-score for _,score in entries]
+        self.fDirty = False
+
+
+class HighScoreStore:
+    '''High scores boards (per mode, per player...) saved in one text file
+
+    Each line holds board;score;name, the name is last so it may contain
+    ';'. The file is written to a temporary file then renamed over the
+    old one, a crash keeps either the old or the new table. It is only
+    written when a board changed since the last save.
+    The file of the first version (name;score lines) is read as the
+    classic board. The entries of a board are only sorted when the board
+    is used, with its capacity, the others are written back unchanged.
+    '''
+
+    def __init__(self, filename: str, capacity: int = 10):
+        self.filename = filename
+        self.capacity = capacity
+        self.boards = {}
+        # Entries loaded for the boards not used yet
+        self.pending = {}
+
+    def board(self, name: str = CLASSIC_BOARD, capacity: int = None)->HighScoreTable:
+        '''the table of a board, created empty if needed'''
+        table = self.boards.get(name)
+        if table is None:
+            if ';' in name or '\n' in name:
+                raise ValueError('bad board name {!r}'.format(name))
+            table = HighScoreTable(capacity if capacity is not None else self.capacity)
+            self.boards[name] = table
+            entries = self.pending.pop(name,None)
+            if entries is not None:
+                table.load(entries)
+        return table
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        entries = {}
+        with open(self.filename,'r',encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        fLegacy = len(lines)==0 or lines[0] != HEADER.strip()
+        for line in lines:
+            if len(line)==0 or line.startswith('#'):
+                continue
+            try:
+                if fLegacy:
+                    name,score = line.rsplit(';',1)
+                    boardName = CLASSIC_BOARD
+                else:
+                    boardName,score,name = line.split(';',2)
+                entries.setdefault(boardName,[]).append((name,int(score)))
+            except ValueError:
+                print('Skip bad high score line : {!r}'.format(line))
+        for boardName,boardEntries in entries.items():
+            if boardName in self.boards:
+                self.boards[boardName].load(boardEntries)
+            else:
+                self.pending[boardName] = boardEntries
+
+    def save(self, fForce: bool = False):
+        '''write the boards if one of them changed'''
+        if not fForce and not any(table.fDirty for table in self.boards.values()):
+            return
+        tmpName = self.filename + '.tmp'
+        with open(tmpName,'w',encoding="utf-8") as f:
+            f.write(HEADER)
+            for boardName,table in self.boards.items():
+                for hs in table.entries:
+                    f.write('{};{};{}\n'.format(boardName,hs.score,hs.name))
+            for boardName,entries in self.pending.items():
+                for name,score in entries:
+                    f.write('{};{};{}\n'.format(boardName,score,name))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpName,self.filename)
+        for table in self.boards.values():
+            table.fDirty = False
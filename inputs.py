@@ -0,0 +1,93 @@
+"""  Timestamped keyboard inputs and the latency of their moves  """
+
+import math
+from engine import Engine, Command, TICK_DT, MAX_TICKS_PER_STEP
+
+# A key press whose move is not shown within this time moved nothing (wall, O rotation...)
+LATENCY_TIMEOUT = 0.5
+
+
+class InputQueue:
+    '''Commands of the keys of a player with the time of their event
+
+    The keys are read between two frames. Instead of applying all of them
+    at the first tick of the next frame, schedule() gives each command to
+    the tick of the engine which covers the time of its key event : the
+    press and the release of a tap shorter than a frame are applied by
+    different ticks and the moves keep the rhythm of the keys whatever the
+    frame rate. An event after the last tick of the step, in the part of a
+    tick left in the accumulator, goes to that last tick : one tick early
+    rather than one frame late.
+    '''
+
+    def __init__(self):
+        # (time, command) in the order of the events
+        self.events = []
+
+    def push(self, t: float, command: Command):
+        self.events.append((t,command))
+
+    def clear(self):
+        self.events.clear()
+
+    def schedule(self, engine: Engine, now: float, dt: float):
+        '''schedule the commands for the ticks run by engine.step(dt) at the time now'''
+        events = self.events
+        if not events:
+            return
+        # Time of the engine state before the step, its ticks end every TICK_DT after it
+        t0 = now - dt - engine.accumulator
+        nbTicks = min(int((engine.accumulator+dt)/TICK_DT + 1e-6),MAX_TICKS_PER_STEP)
+        if nbTicks == 0:
+            # No tick in this frame, the events wait for the next one
+            return
+        for t,command in events:
+            j = min(max(1,math.ceil((t-t0)/TICK_DT - 1e-6)),nbTicks)
+            engine.scheduledCommands.append((engine.nbTicks+j,command))
+        events.clear()
+
+
+class LatencyProbe:
+    '''Time from the key presses to the first frame showing their move
+
+    press() notes the position of the current tetromino, shown() is called
+    once a frame is flipped : the presses whose tetromino moved or turned
+    since are added to the histogram in ns. The presses of a tetromino
+    which was frozen meanwhile or not moved after LATENCY_TIMEOUT are
+    dropped.
+    '''
+
+    def __init__(self, hist):
+        self.hist = hist
+        # (time, engine, x, blocks, nbPieces)
+        self.probes = []
+
+    @staticmethod
+    def blocks(tetro)->tuple:
+        '''coordinates of the blocks, they change with the rotation'''
+        return tuple(tuple(v) for v in tetro.v)
+
+    def press(self, t: float, engine: Engine):
+        '''the previous presses of the engine showed nothing, they are dropped'''
+        if self.probes:
+            self.probes = [probe for probe in self.probes if probe[1] is not engine]
+        tetro = engine.curTetromino
+        self.probes.append((t,engine,tetro.x,self.blocks(tetro),engine.nbPieces))
+
+    def clear(self):
+        self.probes.clear()
+
+    def shown(self, t: float):
+        if not self.probes:
+            return
+        kept = []
+        for probe in self.probes:
+            tPress,engine,x,blocks,nbPieces = probe
+            tetro = engine.curTetromino
+            if engine.nbPieces != nbPieces or t-tPress > LATENCY_TIMEOUT:
+                continue
+            if tetro.x != x or self.blocks(tetro) != blocks:
+                self.hist.add(round((t-tPress)*1e9))
+            else:
+                kept.append(probe)
+        self.probes = kept
@@ -0,0 +1,47 @@
+"""  Geometry and colours of the game screen, without any pyglet dependency  """
+
+from engine import NB_ROWS, NB_COLUMNS, CELL_SIZE
+
+# Colours of the board background and of the landing spot of the tetromino
+BOARD_COLOR = (0,0,50,255)
+GHOST_COLOR = (255,255,255,255)
+
+
+class Layout:
+    '''Size of the board and pixel positions of the window
+
+    cellSize is the size of a cell in pixels, the engine moves the
+    tetrominos by 1/CELL_SIZE of a cell whatever its size on screen.
+    scale enlarges the texts and the margins, for HiDPI screens.
+    x0 is the left of the area of the player, the players of a versus
+    game are side by side and width is the right of the area.
+    '''
+
+    def __init__(self, nbColumns: int = NB_COLUMNS, nbRows: int = NB_ROWS, cellSize: int = CELL_SIZE,
+                 scale: float = 1.0, x0: int = 0):
+        self.nbColumns = nbColumns
+        self.nbRows = nbRows
+        self.cellSize = cellSize
+        self.scale = scale
+        self.x0 = x0
+        # Pixels per unit of the tetromino coordinates
+        self.unit = cellSize/CELL_SIZE
+        self.ox = x0 + max(round(10*scale),cellSize)
+        self.oy = round(50*scale)
+        self.boardWidth = nbColumns*cellSize
+        self.boardTop = self.oy + nbRows*cellSize
+        self.width = self.ox + self.boardWidth + max(round(205*scale),8*cellSize+5)
+        self.height = self.boardTop + round(10*scale)
+        # Position of the next tetromino preview
+        self.nextX = self.ox + self.boardWidth + 4*cellSize
+        self.nextY = self.boardTop - 9*cellSize
+
+    def px(self, v: float)->int:
+        '''size v of the classic layout in pixels'''
+        return round(v*self.scale)
+
+    def player(self, i: int)->'Layout':
+        '''layout of the player i of a versus game, at the right of the player i-1'''
+        return Layout(self.nbColumns,self.nbRows,self.cellSize,self.scale,self.x0 + i*(self.width-self.x0))
+
+CLASSIC_LAYOUT = Layout()
@@ -3,24 +3,51 @@
 """      Raymond NGUYEN THANH       """
 
 from enum import IntEnum, unique
-import random
 import pyglet
 from pyglet.window import Window
 from pyglet.shapes import Rectangle
 from pyglet.window import key
 from pyglet import clock
-from random import randint,seed
-from os import path
-from datetime import datetime
-
-# Constants
-WIN_WIDTH = 480
-WIN_HEIGHT = 560
-NB_ROWS = 20
-NB_COLUMNS = 10
-CELL_SIZE  = int(WIN_WIDTH / (NB_COLUMNS + 9))
-OX = CELL_SIZE
-OY = 50
+from os import environ
+import argparse
+import json
+import sys
+import platform
+import time
+from audio import Audio
+from replay import ReplayRecorder, saveReplay
+from highscores import HighScore, HighScoreStore, CLASSIC_BOARD
+from engine import NB_ROWS, NB_COLUMNS, CELL_SIZE, TICK_DT, Engine, Command, Event, Handling, SnapshotRing
+from ai import AutoPlayer, BeamPlayer
+from profiler import Profiler, percentile
+from versus import Versus
+from netplay import NetClient, NetSession, DEFAULT_PORT, MSG_START
+from skins import SkinAtlas, SKINS, NB_TILES
+from layout import Layout, CLASSIC_LAYOUT
+from boardview import BoardView
+from inputs import InputQueue, LatencyProbe
+
+# Constants of the classic layout
+WIN_WIDTH = CLASSIC_LAYOUT.width
+WIN_HEIGHT = CLASSIC_LAYOUT.height
+OX = CLASSIC_LAYOUT.ox
+OY = CLASSIC_LAYOUT.oy
+
+# Keys of the players : left, right, rotate, drop and hard drop on release
+PLAYER_KEYS = (
+    (key.LEFT, key.RIGHT, key.UP, key.DOWN, key.SPACE),
+    (key.A, key.D, key.W, key.S, key.Q),
+    (key.J, key.L, key.I, key.K, key.U),
+    (key.NUM_4, key.NUM_6, key.NUM_8, key.NUM_5, key.NUM_0),
+)
+# Keys switching the computer player on and off for each player of a versus game
+AUTOPLAY_KEYS = (key.F5, key.F6, key.F7, key.F8)
+# Practice mode : snapshots of the last frames kept, about 10 seconds, and
+# ticks rewound by each press of Backspace
+PRACTICE_HISTORY = 600
+UNDO_TICKS = 100
+# Commands of the keys whose latency is measured while profiling, they move or turn the tetromino
+LATENCY_COMMANDS = (Command.MoveLeft, Command.MoveRight, Command.Rotate)
 
 @unique
 class GameMode(IntEnum):
@@ -29,279 +56,302 @@ class GameMode(IntEnum):
     GameOver = 3
     HightScore = 4
 
-@unique
-class TetrominoShape(IntEnum):
-    
-    NoShape = 0
-    ZShape = 1
-    SShape = 2
-    LineShape = 3
-    TShape = 4
-    SquareShape = 5
-    LShape = 6
-    MirroredLShape = 7
-
-class Tetromino:
-    
-    coordsTable = (
-        ((0, 0),     (0, 0),     (0, 0),     (0, 0)),
-        ((0, -1),    (0, 0),     (-1, 0),    (-1, 1)),
-        ((0, -1),    (0, 0),     (1, 0),     (1, 1)),
-        ((0, -1),    (0, 0),     (0, 1),     (0, 2)),
-        ((-1, 0),    (0, 0),     (1, 0),     (0, 1)),
-        ((0, 0),     (1, 0),     (0, 1),     (1, 1)),
-        ((-1, -1),   (0, -1),    (0, 0),     (0, 1)),
-        ((1, -1),    (0, -1),    (0, 0),     (0, 1))
-    )
-
-    colorsTable = [(0x00,0x00,0x00,0x00),
-                    (0xCC,0x66,0x66,0xFF),
-                    (0x66,0xCC,0x66,0xFF),
-                    (0x66,0x66,0xCC,0xFF),
-                    (0xCC,0xCC,0x66,0xFF),
-                    (0xCC,0x66,0xCC,0xFF),
-                    (0x66,0xCC,0xCC,0xFF),
-                    (0xDA,0xAA,0x00,0xFF)]
-    
-    def __init__(self,x :int ,y :int, shape :int) -> None:
-        self.v = [[0,0] for i in range(4)]
-        self.x = x
-        self.y = y
-        self.pieceShape = shape
-        self.color = Tetromino.colorsTable[shape]
-        self.setShape(shape)
-        self.velocityX = 0
-        self.velocityY = -1
-
-    def setShape(self, shape):
-        '''sets a shape'''
-        table = Tetromino.coordsTable[shape]
-        for i in range(4):
-            for j in range(2):
-                self.v[i][j] = table[i][j]
-        self.pieceShape = shape
-        self.color = Tetromino.colorsTable[shape]
+class ScreenView:
+    '''Labels of the menu, game over and high scores screens
+
+    The labels are built once and held in one batch per mode, a label is
+    only laid out again when its text or colour changes.
+    '''
+
+    textColor = (255, 255, 0,255)
+    blinkColor = (55, 55, 0, 255)
+
+    def __init__(self, layout: Layout = CLASSIC_LAYOUT):
+        self.layout = layout
+        self.batches = {
+            GameMode.StandBy: pyglet.graphics.Batch(),
+            GameMode.GameOver: pyglet.graphics.Batch(),
+            GameMode.HightScore: pyglet.graphics.Batch()
+        }
+        self.labels = []
+        # Two lines of the StandBy and GameOver screens
+        self.titles = {}
+        self.makeTitle(GameMode.StandBy,'TETRIS in PyGlet','Press Space to Play')
+        self.makeTitle(GameMode.GameOver,'Game Over','Press Space to Continue')
+
+        # The texts are placed from the top of the board, they keep their size on any board
+        batch = self.batches[GameMode.HightScore]
+        xCenter = layout.ox + layout.boardWidth/2
+        self.labels.append(self.makeLabel('HIGH SCORES',14,xCenter,layout.boardTop-layout.px(50),'center',batch))
+        yTop = layout.boardTop - layout.px(100)
+        self.listHighScoresNames = [self.makeLabel('',12,layout.ox+layout.px(25),yTop-layout.px(i*25),'left',batch)
+                                    for i in range(10)]
+        self.listHighScoresValues = [self.makeLabel('',12,xCenter,yTop-layout.px(i*25),'left',batch)
+                                     for i in range(10)]
+
+    def makeLabel(self, text: str, size: int, x: int, y: int, anchor_x: str, batch: pyglet.graphics.Batch):
+        return pyglet.text.Label(text,font_name='sansation',font_size=size*self.layout.scale,bold=True,x=x,y=y,
+                                 anchor_x=anchor_x,color=ScreenView.textColor,batch=batch)
+
+    def makeTitle(self, mode: GameMode, line1: str, line2: str):
+        batch = self.batches[mode]
+        layout = self.layout
+        xCenter = layout.ox + layout.boardWidth/2
+        self.labels.append(self.makeLabel(line1,14,xCenter,layout.boardTop-layout.px(100),'center',batch))
+        self.labels.append(self.makeLabel(line2,12,xCenter,layout.boardTop-layout.px(150),'center',batch))
+        self.titles[mode] = tuple(self.labels[-2:])
+
+    def setTitle(self, mode: GameMode, line1: str, line2: str = None):
+        '''change the title of a screen, the winner of a versus game replaces Game Over'''
+        label1,label2 = self.titles[mode]
+        self.setLabel(label1,line1,ScreenView.textColor)
+        if line2 is not None:
+            self.setLabel(label2,line2,ScreenView.textColor)
+
+    def setLabel(self, label: pyglet.text.Label, text: str, color: tuple):
+        '''change the label only if needed, each change lays the label out again'''
+        if label.text != text:
+            label.text = text
+        if label.color != color:
+            label.color = color
+
+    def updateHighScores(self, hightScores: list[HighScore], idHightScore: int, iColorHighScore: int):
+        for i in range(10):
+            color = ScreenView.textColor
+            if i==idHightScore and (iColorHighScore % 2)!=0:
+                color = ScreenView.blinkColor
+            if i<len(hightScores):
+                hs = hightScores[i]
+                self.setLabel(self.listHighScoresNames[i],hs.name,color)
+                self.setLabel(self.listHighScoresValues[i],'{:06d}'.format(hs.score),color)
+            else:
+                self.setLabel(self.listHighScoresNames[i],'--------',color)
+                self.setLabel(self.listHighScoresValues[i],'{:06d}'.format(0),color)
+
+    def draw(self, mode: GameMode):
+        batch = self.batches.get(mode)
+        if batch is not None:
+            batch.draw()
+
+class DrawCallCounter:
+    '''Counts the GL draw calls of the pyglet batches and labels while installed'''
+
+    names = ('glDrawArrays','glMultiDrawArrays','glDrawElements','glMultiDrawElements')
+
+    def __init__(self):
+        self.nbCalls = 0
+        self.originals = {}
+
+    def counted(self, func):
+        def wrapper(*args):
+            self.nbCalls += 1
+            return func(*args)
+        return wrapper
+
+    def install(self):
+        from pyglet.graphics import vertexdomain
+        for name in DrawCallCounter.names:
+            func = getattr(vertexdomain,name)
+            self.originals[name] = func
+            setattr(vertexdomain,name,self.counted(func))
+
+    def uninstall(self):
+        from pyglet.graphics import vertexdomain
+        for name,func in self.originals.items():
+            setattr(vertexdomain,name,func)
+        self.originals.clear()
+
+
+class ProfileOverlay:
+    '''Frame statistics of the profiler drawn over the game
+
+    The text is only laid out twice a second. The GL draw calls and the
+    allocated blocks of the overlay itself are not counted.
+    '''
+
+    def __init__(self, profiler: Profiler, layout: Layout = CLASSIC_LAYOUT):
+        self.profiler = profiler
+        self.batch = pyglet.graphics.Batch()
+        # Bottom right, below the next tetromino
+        px = layout.px
+        self.background = Rectangle(layout.width-px(192),px(4),px(188),0,color=(0,0,0,170),batch=self.batch)
+        self.label = pyglet.text.Label('',font_name='monospace',font_size=8*layout.scale,x=layout.width-px(188),y=px(8),
+                                       anchor_y='bottom',multiline=True,width=px(180),color=(0,255,0,255),
+                                       batch=self.batch)
+        self.margin = px(8)
+        self.drawCalls = DrawCallCounter()
+        self.nbFrames = 0
+        self.tFrame = 0
+        self.tRefresh = 0
+        self.nbBlocks = 0
+
+    def setEnabled(self, fEnabled: bool):
+        if fEnabled:
+            self.drawCalls.install()
+            self.nbFrames = 0
+            self.tFrame = self.tRefresh = time.perf_counter_ns()
+            self.nbBlocks = sys.getallocatedblocks()
+            self.refresh()
+        else:
+            self.drawCalls.uninstall()
+
+    def endFrame(self):
+        '''record the values of the frame, called once the game is drawn'''
+        t = time.perf_counter_ns()
+        self.profiler.timing('frame').add(t-self.tFrame)
+        self.tFrame = t
+        self.profiler.count('gl_draw_calls',self.drawCalls.nbCalls)
+        nbBlocks = sys.getallocatedblocks()
+        self.profiler.count('alloc_blocks',nbBlocks-self.nbBlocks)
+        self.nbFrames += 1
+
+    def refresh(self):
+        t = time.perf_counter_ns()
+        fps = self.nbFrames*1e9/max(1,t-self.tRefresh)
+        self.nbFrames = 0
+        self.tRefresh = t
+        timings = self.profiler.timings
+        lines = ['FPS {:<6.1f}  mean     p99 ms'.format(fps)]
+        for name in ('update','tick','draw','board','pieces','labels','batch','flip'):
+            hist = timings.get(name)
+            if hist is not None:
+                recent = hist.recent()
+                lines.append('{:6s} {:6.3f}  {:6.3f}'.format(
+                    name,sum(recent)/max(1,len(recent))/1e6,percentile(recent,0.99)/1e6))
+        hist = timings.get('key_latency')
+        if hist is not None and hist.nbSamples>0:
+            recent = hist.recent()
+            lines.append('key    p50 {:6.1f} p99 {:6.1f} ms'.format(percentile(recent,0.50)/1e6,
+                                                                    percentile(recent,0.99)/1e6))
+        counts = self.profiler.counts
+        for name,title in (('gl_draw_calls','GL calls'),('alloc_blocks','allocs')):
+            hist = counts.get(name)
+            if hist is not None:
+                lines.append('{} / frame {}'.format(title,hist.last()))
+        self.label.text = '\n'.join(lines)
+        self.background.height = self.label.content_height + self.margin
 
     def draw(self):
-        '''draw Tetromino'''
-        rect = Rectangle(100,100,CELL_SIZE-2,CELL_SIZE-2,color=self.color)
-        for [vx,vy] in self.v:
-            rect.x = self.x + vx*CELL_SIZE + OX + 1
-            rect.y = self.y + vy*CELL_SIZE + OY + 1
-            rect.draw()
-
-    def rotateLeft(self):
-        '''rotate shape to the left'''
-        if self.pieceShape == TetrominoShape.SquareShape:
-            return
-        for id,[vx,vy] in enumerate(self.v):
-            self.v[id][0] = vy
-            self.v[id][1] = -vx
+        self.batch.draw()
+        self.drawCalls.nbCalls = 0
+        self.nbBlocks = sys.getallocatedblocks()
 
-    def rotateRight(self):
-        '''rotate shape to the right'''        
-        if self.pieceShape == TetrominoShape.SquareShape:
-            return
-        for id,[vx,vy] in enumerate(self.v):
-            self.v[id][0] = -vy
-            self.v[id][1] = vx
-
-    def minX(self)->int:
-        '''returns min x value'''
-        m = 1000
-        for [vx,_] in self.v:
-            m = min(m, vx)
-        return m
-        
-    def maxX(self)->int:
-        '''returns max x value'''
-        m = -1000
-        for [vx,_] in self.v:
-            m = max(m, vx)
-        return m
-    
-    def minY(self)->int:
-        '''returns min y value'''
-        m = 1000
-        for [_,vy] in self.v:
-            m = min(m, vy)
-        return m
-        
-    def maxY(self)->int:
-        '''returns max y value'''
-        m = -1000
-        for [_,vy] in self.v:
-            m = max(m, vy)
-        return m
-    
-    def iX(self)->int:
-        ix = int((self.x)/CELL_SIZE)
-        return ix
-    
-    def iY(self)->int:
-        iy = int((self.y)/CELL_SIZE)
-        return iy
-    
-    def hitGround(self, board: list[int])->bool:
-        
-        for [vx,vy] in self.v:
-
-            # Top Left
-            ix = int((vx*CELL_SIZE + self.x)/CELL_SIZE)
-            iy = int((vy*CELL_SIZE + self.y)/CELL_SIZE)
-            if (ix>=0) and (ix<NB_COLUMNS) and (iy>=0) and (iy<NB_ROWS):
-                t = board[ix+NB_COLUMNS*iy]
-                if t!=0:
-                    return True                        
-            # Top Right
-            ix = int((vx*CELL_SIZE + self.x + CELL_SIZE - 1)/CELL_SIZE)
-            iy = int((vy*CELL_SIZE + self.y)/CELL_SIZE)
-            if (ix>=0) and (ix<NB_COLUMNS) and (iy>=0) and (iy<NB_ROWS):
-                t = board[ix+NB_COLUMNS*iy]
-                if t!=0:
-                    return True        
-
-            # Bottom Right
-            ix = int((vx*CELL_SIZE + self.x + CELL_SIZE - 1)/CELL_SIZE)
-            iy = int((vy*CELL_SIZE + self.y + CELL_SIZE - 1)/CELL_SIZE)
-            if (ix>=0) and (ix<NB_COLUMNS) and (iy>=0) and (iy<NB_ROWS):
-                t = board[ix+NB_COLUMNS*iy]
-                if t!=0:
-                    return True        
-
-            # Bottom Left
-            ix = int((vx*CELL_SIZE + self.x)/CELL_SIZE)
-            iy = int((vy*CELL_SIZE + self.y + CELL_SIZE -1)/CELL_SIZE)
-            if (ix>=0) and (ix<NB_COLUMNS) and (iy>=0) and (iy<NB_ROWS):
-                t = board[ix+NB_COLUMNS*iy]
-                if t!=0:
-                    return True        
-                
-        return False
-
-    def hitLeft(self, board: list[int])->bool:
-        self.velocityX = -1
-        fHit = False
-        for [vx,vy] in self.v:
-            x = vx*CELL_SIZE + self.x - 1
-            y = vy*CELL_SIZE + self.y
-            ix = int(x/CELL_SIZE)
-            iy = int(y/CELL_SIZE)
-            if (ix>=0) and (ix<NB_COLUMNS) and (iy>=0) and (iy<NB_ROWS):
-                if board[ix+iy*NB_COLUMNS]!=0:
-                    fHit = True
-                    break
-            y = vy*CELL_SIZE + self.y + CELL_SIZE - 1
-            iy = int(y/CELL_SIZE)
-            if (ix>=0) and (ix<NB_COLUMNS) and (iy>=0) and (iy<NB_ROWS):
-                if board[ix+iy*NB_COLUMNS]!=0:
-                    fHit = True
-                    break
-        return fHit
-    
-    def hitRight(self,board: list[int])->bool:
-        fHit = False
-        for [vx,vy] in self.v:
-            x = vx*CELL_SIZE + self.x + CELL_SIZE
-            y = vy*CELL_SIZE + self.y
-            ix = int(x/CELL_SIZE)
-            iy = int(y/CELL_SIZE)
-            if (ix>=0) and (ix<NB_COLUMNS) and (iy>=0) and (iy<NB_ROWS):
-                if board[ix+iy*NB_COLUMNS]!=0:
-                    fHit = True
-                    break
-            y = vy*CELL_SIZE + self.y + CELL_SIZE - 1
-            iy = int(y/CELL_SIZE)
-            if (ix>=0) and (ix<NB_COLUMNS) and (iy>=0) and (iy<NB_ROWS):
-                if board[ix+iy*NB_COLUMNS]!=0:
-                    fHit = True
-                    break
-        return fHit
-
-    def isOutLimits(self)->bool:
-        for [vx,vy] in self.v:
-            x = vx*CELL_SIZE + self.x
-            y = vy*CELL_SIZE + self.y
-            ix = int(x/CELL_SIZE)
-            iy = int(y/CELL_SIZE)
-            if (ix<0) or (ix>=NB_COLUMNS) or (iy<0) or (iy>=NB_ROWS):
-                return True
-        return False
-    
-    def isOutRightLimit(self)->bool:
-        for [vx,vy] in self.v:
-            x = vx*CELL_SIZE + self.x
-            y = vy*CELL_SIZE + self.y
-            ix = int(x/CELL_SIZE)
-            iy = int(y/CELL_SIZE)
-            if (ix>=NB_COLUMNS):
-                return True
-        return False            
-       
-    def isOutLeftLimit(self)->bool:
-        for [vx,vy] in self.v:
-            x = vx*CELL_SIZE + self.x
-            y = vy*CELL_SIZE + self.y
-            ix = int(x/CELL_SIZE)
-            iy = int(y/CELL_SIZE)
-            if (ix<0):
-                return True
-        return False            
-
-    def hitBottom(self)->bool:
-        for [_,vy] in self.v:
-            y = vy*CELL_SIZE + self.y+CELL_SIZE
-            iy = int(y/CELL_SIZE)
-            if iy==0:
-                return True
-        return False
-
-class HighScore:
-    def __init__(self, name:str, score:int):
+
+class Player:
+    '''Engine, inputs and views of a player, the views of all the players share one batch'''
+
+    def __init__(self, engine: Engine, batch: pyglet.graphics.Batch, layout: Layout, name: str, atlas: SkinAtlas,
+                 autoPlayer: AutoPlayer = None):
+        self.engine = engine
+        self.layout = layout
         self.name = name
-        self.score = score
+        self.inputs = []
+        # The keys with the time of their events, see inputs.py
+        self.inputQueue = InputQueue()
+        # The computer plays through the inputs, like the keyboard
+        self.autoPlayer = autoPlayer if autoPlayer is not None else AutoPlayer()
+        self.fAutoPlay = False
+        self.boardView = BoardView(batch,layout,atlas)
+        self.score = engine.score
+        self.scoreLabel = pyglet.text.Label(self.scoreText(),font_name='sansation',
+                                            font_size=14*layout.scale,bold=True,
+                                            x=layout.x0+layout.px(10),y=layout.px(15),
+                                            color=(255, 255, 0,255),batch=batch)
+
+    def scoreText(self)->str:
+        return '{} : {:06d}'.format(self.name,self.engine.score)
+
+    def updateScore(self):
+        '''lay the score label out again only when the score changed'''
+        if self.engine.score != self.score:
+            self.score = self.engine.score
+            self.scoreLabel.text = self.scoreText()
+
+    def newGame(self):
+        self.inputs.clear()
+        self.inputQueue.clear()
+        self.autoPlayer.reset()
+        self.updateScore()
+
+    def setAutoPlay(self, fAutoPlay: bool):
+        self.fAutoPlay = fAutoPlay
+        # Release the keys held by the computer
+        self.inputs.append(Command.StopMove)
+        self.autoPlayer.reset()
+
 
 class Fenetre(Window):
 
-    def __init__(self,width,height):
-        super().__init__(width,height,vsync=True)
+    def __init__(self, layout: Layout = CLASSIC_LAYOUT, nbPlayers: int = 1, netClient: NetClient = None,
+                 fPractice: bool = False, skin: str = None, beamDepth: int = 0, handling: Handling = None,
+                 kicks: bool = False):
+        # The players of a versus game are side by side
+        super().__init__(layout.player(nbPlayers-1).width,layout.height,vsync=True)
         self.set_caption('Tetris 0.01')
         pyglet.font.add_file('sansation.ttf')
-        self.sansation = pyglet.font.load('sansation')
-        now = datetime.now()
-        random.seed(now.second)
-        self.soundSucces = pyglet.resource.media('109662__grunz__success.wav', streaming=False)
-        self.soundSucces.volume = 0.05
-        self.myplayer = pyglet.media.Player()
-        self.myplayer.loop = True
-        self.source = pyglet.media.load(filename="Tetris.ogg", streaming=False)
-        self.myplayer.queue(self.source)
-        self.musicVolume = 3
-        self.myplayer.volume = self.musicVolume/10.0
-        self.myplayer.play()
+        self.layout = layout
+        self.versus = Versus(nbPlayers,nbColumns=layout.nbColumns,nbRows=layout.nbRows,handling=handling,kicks=kicks)
+        self.fVersus = nbPlayers>1
+        # A practice game can be rewound with Backspace, it has no high score nor replay
+        self.fPractice = fPractice and not self.fVersus
+        self.history = SnapshotRing(PRACTICE_HISTORY)
+        self.historyTick = -1
+        # The first player plays the classic game
+        self.engine = self.versus.engines[0]
+        self.fHint = False
+        # The music plays once decoded, the window does not wait for it
+        self.audio = Audio(3)
+        self.audio.startMusic("Tetris.ogg")
         self.mode = GameMode.StandBy
-        self.fMusic = False
-        self.score = 0
         self.player_name = "XXXXX"
-        self.hightScores = [HighScore("--------",0) for i in range(10)]
+        self.highScoreStore = HighScoreStore("highscores.txt")
         self.loadHightScore()
         self.idHightScore = -1
         self.iColorHighScore = 0
-        self.board = [0 for i in range(0,NB_COLUMNS*NB_ROWS)]
-        self.tetroBag = [1,2,3,4,5,6,7,1,2,3,4,5,6,7]
-        self.idTetroBag = 14
-        self.curTetromino = Tetromino(5*CELL_SIZE,18*CELL_SIZE,self.tetrisRandomizer())
-        self.nextTetromino = Tetromino(13*CELL_SIZE,10*CELL_SIZE,self.tetrisRandomizer())
-        self.nbCompletedLines = 0
-        self.fDropTetromino = False
-        self.fGameOver = False
-        self.hVelocity = 0
-        self.elapseTime1 = 0
-        self.elapseTime2 = 0
-        self.elapseTime3 = 0
-        self.boardRect = Rectangle(OX,OY,CELL_SIZE*NB_COLUMNS,CELL_SIZE*NB_ROWS,color=(0,0,50,255))
-        self.score_label = pyglet.text.Label('SCORE : {:06d}'.format(self.score),font_name='sansation',
-                                             font_size=14,bold=True,x=10,y=15,color=(255, 255, 0,255))
+        self.fRedraw = False
+        # All the players are drawn by one batch.draw(), F4 changes the skin of their blocks
+        self.batch = pyglet.graphics.Batch()
+        fSkinFile = skin is not None and skin.lower().endswith('.png')
+        self.atlas = SkinAtlas(layout.cellSize-2,[skin] if fSkinFile else [])
+        if skin is not None:
+            self.atlas.setSkin(self.atlas.names.index(skin))
+        self.players = [Player(engine,self.batch,layout.player(i),
+                               'PLAYER {}'.format(i+1) if self.fVersus else
+                               'PRACTICE' if self.fPractice else 'SCORE',self.atlas,
+                               BeamPlayer(beamDepth) if beamDepth>0 else None)
+                        for i,engine in enumerate(self.versus.engines)]
+        # H shows the best placement of the local player, A lets the computer play it
+        self.player1 = self.players[0]
+        self.localPlayer = self.player1
+        self.boardView = self.player1.boardView
+        self.screenView = ScreenView(layout)
+        self.bindKeys(self.players)
+        # The network game starts when the relay has all its players, see netplay.py
+        self.netClient = netClient
+        self.netSession = None
+        if netClient is not None:
+            self.screenView.setTitle(GameMode.StandBy,'Network game','Waiting for the players')
+            netClient.start()
+            clock.schedule_interval(self.on_net_poll,0.1)
+        # F3 or TETRIS_PROFILE=1 times the phases of the frames, see profiler.py
+        self.profiler = Profiler()
+        self.profiler.watchEngine(self.engine)
+        self.profiler.watch(self,'on_update','update')
+        self.profiler.watch(self,'on_draw','draw')
+        self.profiler.watch(self,'flip','flip')
+        for player in self.players:
+            self.profiler.watch(player.boardView,'updateBoard','board')
+            self.profiler.watch(player.boardView,'updateTetromino','pieces')
+            self.profiler.watch(player.boardView,'updateGhost','pieces')
+        self.profiler.watch(self.boardView,'updateHint','pieces')
+        self.profiler.watch(self.screenView,'draw','labels')
+        self.profiler.watch(self.batch,'draw','batch')
+        # Time from a press of a move key to the flip of the frame showing the move
+        self.latency = LatencyProbe(self.profiler.timing('key_latency'))
+        self.profileOverlay = ProfileOverlay(self.profiler,layout)
+        self.profileInfo = None
+        if environ.get('TETRIS_PROFILE','0') != '0':
+            self.setProfiling(True)
         self.tblChars = {
             key.A:'A',
             key.B:'B',
@@ -350,311 +400,242 @@ class Fenetre(Window):
             key._9:'9'
         }
 
-        # self.board[5] = 3
-        # self.board[NB_COLUMNS+5] = 3
-        # self.board[2*NB_COLUMNS+5] = 3
-        # self.board[3*NB_COLUMNS+5] = 3
-        # self.board[4*NB_COLUMNS+5] = 3
-        # self.board[5*NB_COLUMNS+5] = 3
-        # self.board[6*NB_COLUMNS+5] = 3
+        # Timers of each mode, the idle modes are only redrawn on input or animation
+        self.modeTimers = {
+            GameMode.Play: ((self.on_frame, 1/60),),
+            GameMode.HightScore: ((self.on_blink, 0.2),)
+        }
+        clock.schedule_interval(self.on_rotate_next, 0.5)
+        self.invalidate()
+
+        # self.engine.board[5] = 3
+        # self.engine.board[NB_COLUMNS+5] = 3
+        # self.engine.board[2*NB_COLUMNS+5] = 3
+        # self.engine.board[3*NB_COLUMNS+5] = 3
+        # self.engine.board[4*NB_COLUMNS+5] = 3
+        # self.engine.board[5*NB_COLUMNS+5] = 3
+        # self.engine.board[6*NB_COLUMNS+5] = 3
         
+    def bindKeys(self, players: list[Player]):
+        '''the keys of PLAYER_KEYS in turn for each player'''
+        self.playerKeys = {}
+        for player,(left,right,rotate,drop,hardDrop) in zip(players,PLAYER_KEYS):
+            # Command on press, command on release
+            self.playerKeys[left] = (player,Command.MoveLeft,Command.StopMove)
+            self.playerKeys[right] = (player,Command.MoveRight,Command.StopMove)
+            self.playerKeys[rotate] = (player,Command.Rotate,None)
+            self.playerKeys[drop] = (player,Command.Drop,None)
+            self.playerKeys[hardDrop] = (player,None,Command.HardDrop)
+
+    def on_net_poll(self, dt):
+        '''wait for the start of the network game, the window is not blocked'''
+        messages = self.netClient.poll()
+        for i,msg in enumerate(messages):
+            if msg is None:
+                clock.unschedule(self.on_net_poll)
+                self.screenView.setTitle(GameMode.StandBy,'Network game','No connection to the relay')
+                print('Network game : {}'.format(self.netClient.error))
+            elif msg[0] == MSG_START:
+                clock.unschedule(self.on_net_poll)
+                try:
+                    self.netSession = NetSession.fromStart(self.netClient,self.versus,msg)
+                except ValueError as e:
+                    self.screenView.setTitle(GameMode.StandBy,'Network game','Other game on the relay')
+                    print('Network game : {}'.format(e))
+                    self.netClient.close()
+                    break
+                # The messages of the other players may come with the start
+                for other in messages[i+1:]:
+                    self.netSession.receive(other)
+                self.localPlayer = self.players[self.netSession.player]
+                self.bindKeys([self.localPlayer])
+                for player in self.players:
+                    player.newGame()
+                self.setMode(GameMode.Play)
+                break
+        self.invalidate()
+
+    def endNetGame(self):
+        '''leave the relay and report the network statistics'''
+        if self.netSession is not None and not self.netClient.fClosed:
+            self.netClient.close()
+            print(json.dumps(self.netSession.stats(),indent=2))
+        self.screenView.setTitle(GameMode.StandBy,'Network game','Press Escape to Quit')
+
     def saveHightScore(self):
-        with open("highscores.txt",'w',encoding="utf-8") as f:
-            for hs in self.hightScores:
-                strLi = "{};{}\n".format(hs.name,hs.score)
-                f.write(strLi)
+        '''write the high scores file, only if they changed'''
+        self.highScoreStore.save()
 
     def loadHightScore(self):
-        if path.exists("highscores.txt"):
-            with open("highscores.txt",'r',encoding="utf-8") as f:
-                strLines = f.readlines()
-                i = 0
-                for strL in strLines:
-                    if len(strL)>1:
-                        name,score = strL.split(';')
-                        self.hightScores[i].name = name
-                        self.hightScores[i].score = int(score)
-                        i += 1
-                        
+        self.highScoreStore.load()
+        # The games on other board sizes have their own high scores
+        boardName = CLASSIC_BOARD
+        if (self.engine.nbColumns,self.engine.nbRows) != (NB_COLUMNS,NB_ROWS):
+            boardName = '{}x{}'.format(self.engine.nbColumns,self.engine.nbRows)
+        self.hightScores = self.highScoreStore.board(boardName)
+
     def isHightScore(self)->int:
         self.idHightScore = -1
-        for i, hs in enumerate(self.hightScores):
-            if self.score>hs.score:
-                self.idHightScore = i
-                return i
-        return -1
+        if self.hightScores.isHighScore(self.engine.score):
+            self.idHightScore = self.hightScores.rank(self.engine.score)
+        return self.idHightScore
 
     def insertHightScore(self, id:int, name:str, score:int):
         if id>=0:
-            self.hightScores.insert(id,HighScore(name,score))
-            self.hightScores.pop()
+            self.idHightScore = self.hightScores.insert(name,score)
 
     def setHightScoreName(self,name:str):
-        if self.idHightScore>=0:
-            self.hightScores[self.idHightScore].name = name
-
-    def is_game_over(self)->bool:
-        iTop = (NB_ROWS - 1)*NB_COLUMNS
-        for x in range(0,NB_COLUMNS):
-            if self.board[iTop+x] != 0:
-                return True
-        return False
-
-    def compute_score(self, nb_lines: int) -> int:
-        if nb_lines==1:
-            return 40
-        elif nb_lines==2:
-            return 100
-        elif nb_lines==3:
-            return 300
-        elif nb_lines==4:
-            return 1200
-        elif nb_lines>4:
-            return 2000
-        return 0
-
-    def freeze_tetromino(self)->bool:
-        ix = int((self.curTetromino.x+1)/CELL_SIZE)
-        iy = int((self.curTetromino.y+1)/CELL_SIZE)
-        for [vx,vy] in self.curTetromino.v:
-            x = vx + ix
-            y = vy + iy
-            if (x>=0) and (x<NB_COLUMNS) and (y>=0) and (y<NB_ROWS) :
-                self.board[x+y*NB_COLUMNS] = self.curTetromino.pieceShape
-
-        self.nbCompletedLines = self.computeCompletedLines()
-        if self.nbCompletedLines>0:
-            self.score += self.compute_score(self.nbCompletedLines)
-            self.score_label.text = 'SCORE : {:06d}'.format(self.score)
-            return True
-
-        return False
-
-    def computeCompletedLines(self)->int :
-        nbL = 0
-        for y in range(0,NB_ROWS):
-            #-- Check completed line
-            f_complete = True
-            for x in range(0,NB_COLUMNS):
-                if self.board[x + y * NB_COLUMNS] == 0 :
-                    f_complete = False
-                    break
-            if f_complete :
-                nbL += 1
-        return nbL
-
-    def eraseFirstCompletedLine(self):
-        for y in range(0,NB_ROWS):
-            #-- Check completed line
-            f_complete = True
-            for x in range(0,NB_COLUMNS):
-                if self.board[x + y * NB_COLUMNS] == 0 :
-                    f_complete = False
-                    break
-            if f_complete :
-                #-- Shift down the game board
-                y1 = y
-                while y1 < (NB_ROWS-1) :
-                    ySrcOffset = (y1 + 1) * NB_COLUMNS
-                    yDesOffset = y1 * NB_COLUMNS
-                    for x in range(0,NB_COLUMNS) :
-                        self.board[x + yDesOffset] = self.board[x + ySrcOffset]
-                    y1 += 1
-                return
-
-    def tetrisRandomizer(self)->int:
-        iSrc = 0
-        ityp = 0
-        if self.idTetroBag<14:
-            ityp = self.tetroBag[self.idTetroBag]
-            self.idTetroBag += 1
+        self.hightScores.setName(self.idHightScore,name)
+
+    def setProfiling(self, fEnabled: bool):
+        if fEnabled and self.profileInfo is None:
+            self.profileInfo = {
+                'python': sys.version,
+                'platform': platform.platform(),
+                'pyglet': pyglet.version,
+                'gl_renderer': pyglet.gl.gl_info.get_renderer(),
+            }
+        self.profiler.setEnabled(fEnabled)
+        self.profileOverlay.setEnabled(fEnabled)
+        if fEnabled:
+            clock.schedule_interval(self.on_profile_refresh,0.5)
         else:
-            # Shuttle Bag
-            for _ in range(14):
-                iSrc = randint(0, 13)
-                ityp = self.tetroBag[iSrc]
-                self.tetroBag[iSrc] = self.tetroBag[0]
-                self.tetroBag[0] = ityp
-            ityp = self.tetroBag[0]
-            self.idTetroBag = 1
-        return ityp
+            clock.unschedule(self.on_profile_refresh)
+        self.invalidate()
+
+    def on_profile_refresh(self, dt):
+        self.profileOverlay.refresh()
+        self.invalidate()
+
+    def dumpProfile(self):
+        '''write the histograms if the game was profiled, TETRIS_PROFILE_FILE names the file'''
+        if not self.profiler.isEmpty():
+            self.profiler.dump(environ.get('TETRIS_PROFILE_FILE','profile.json'),self.profileInfo)
 
     def initNewGame(self):
-        self.score = 0
-        self.board = [0 for i in range(0,NB_COLUMNS*NB_ROWS)]
-        self.nbCompletedLines = 0
-        self.fDropTetromino = False
-        self.fGameOver = False
-        self.hVelocity = 0
-        self.elapseTime1 = 0
-        self.elapseTime2 = 0
-        self.elapseTime3 = 0
-        self.curTetromino = Tetromino(5*CELL_SIZE,18*CELL_SIZE,self.nextTetromino.pieceShape)
-        self.nextTetromino = Tetromino(14*CELL_SIZE,10*CELL_SIZE,self.tetrisRandomizer())
-
-    def draw_stanby(self):
-        line1_label = pyglet.text.Label('TETRIS in PyGlet',font_name='sansation',
-                                             font_size=14,bold=True,x=OX+NB_COLUMNS*CELL_SIZE/2,y=OY+16*CELL_SIZE,
-                                             anchor_x='center',color=(255, 255, 0,255))
-        line2_label = pyglet.text.Label('Press Space to Play',font_name='sansation',
-                                             font_size=12,bold=True,x=OX+NB_COLUMNS*CELL_SIZE/2,y=OY+14*CELL_SIZE,
-                                             anchor_x='center',color=(255, 255, 0,255))
-        line1_label.draw()
-        line2_label.draw()
-
-    def draw_game_over(self):
-        line1_label = pyglet.text.Label('Game Over',font_name='sansation',
-                                             font_size=14,bold=True,x=OX+NB_COLUMNS*CELL_SIZE/2,y=OY+16*CELL_SIZE,
-                                             anchor_x='center',color=(255, 255, 0,255))
-        line2_label = pyglet.text.Label('Press Space to Continue',font_name='sansation',
-                                             font_size=12,bold=True,x=OX+NB_COLUMNS*CELL_SIZE/2,y=OY+14*CELL_SIZE,
-                                             anchor_x='center',color=(255, 255, 0,255))
-        line1_label.draw()
-        line2_label.draw()
-
-    def draw_high_scrores(self):
-
-        title_label = pyglet.text.Label('HIGH SCORES',font_name='sansation',
-                                             font_size=14,bold=True,x=OX+NB_COLUMNS*CELL_SIZE/2,y=OY+18*CELL_SIZE,
-                                             anchor_x='center',color=(255, 255, 0,255))
-
-        yTop = y=OY+16*CELL_SIZE
-        listHighScoresNames = [pyglet.text.Label('xxxxxx',font_name='sansation',
-                                             font_size=12,bold=True,x=OX+CELL_SIZE,y=(yTop-i*CELL_SIZE),
-                                             anchor_x='left',color=(255, 255, 0,255)) for i in range(10)]
-        listHighScoresValues = [pyglet.text.Label('000000',font_name='sansation',
-                                             font_size=12,bold=True,x=OX+NB_COLUMNS*CELL_SIZE/2,y=(yTop-i*CELL_SIZE),
-                                             anchor_x='left',color=(255, 255, 0,255)) for i in range(10)]
-        for i in range(10):
-            hs = self.hightScores[i]
-            lblName = listHighScoresNames[i]
-            lblName.text = hs.name
-            lblValue = listHighScoresValues[i]
-            lblValue.text = '{:06d}'.format(hs.score)
-            if i==self.idHightScore:
-                if (self.iColorHighScore % 2)==0:
-                    lblValue.color = (255, 255, 0,255)
-                else:
-                    lblValue.color = (55, 55, 0, 255)
-                lblName.color = lblValue.color
-            lblName.draw()
-            lblValue.draw()
-
-        title_label.draw()
+        self.versus.newGame()
+        for player in self.players:
+            engine = player.engine
+            if not self.fPractice:
+                engine.recorder = ReplayRecorder(engine.seed,engine.nbColumns,engine.nbRows,engine.handling,
+                                                 engine.fKicks)
+            player.newGame()
+        self.history.clear()
+        self.historyTick = -1
+        self.latency.clear()
+
+    def recordHistory(self):
+        '''keep the state of the practice game once per frame, only when ticks were run'''
+        if self.engine.nbTicks != self.historyTick:
+            self.historyTick = self.engine.nbTicks
+            self.history.push(self.historyTick,self.engine.snapshot())
+
+    def undo(self):
+        '''rewind the practice game by UNDO_TICKS, back to the oldest state kept at most'''
+        if len(self.history) == 0:
+            return
+        state = self.history.rewind(max(self.engine.nbTicks-UNDO_TICKS,self.history.oldestTick()))
+        self.engine.restore(state)
+        self.engine.scheduledCommands.clear()
+        self.historyTick = self.engine.nbTicks
+        self.player1.newGame()
 
     def on_draw(self):
         pyglet.gl.glClearColor(0.0,0.0,0.5,1.0)
         self.clear()
-        self.boardRect.draw()
 
-        # Clear Board
-        rect = Rectangle(100,100,CELL_SIZE-2,CELL_SIZE-2,color=(0x00,0x00,0x00,0x00))
-        
-        self.score_label.draw()
+        fPlay = self.mode == GameMode.Play
+        for player in self.players:
+            engine = player.engine
+            player.boardView.setPlayVisible(fPlay)
+            player.boardView.update(engine.board, engine.curTetromino, engine.nextTetromino)
+        player = self.localPlayer
+        engine = player.engine
+        fHint = self.fHint and fPlay
+        player.boardView.updateHint(player.autoPlayer.hint(engine) if fHint else None,
+                                    engine.curTetromino.pieceShape)
+        self.batch.draw()
 
-        match self.mode:
-            case GameMode.StandBy:
-                self.draw_stanby()
-            case GameMode.GameOver:
-                self.draw_game_over()
-            case GameMode.HightScore:
-                self.draw_high_scrores()
-            case GameMode.Play:
-                # Draw Freeze Tetromino
-                for y in range(0,NB_ROWS):
-                    for x in range(0,NB_COLUMNS):
-                        typ = self.board[x + y * NB_COLUMNS]
-                        if typ != 0 :
-                            rect.x = (x * (CELL_SIZE) + OX + 1)
-                            rect.y = (y * (CELL_SIZE) + OY + 1)
-                            rect.color = Tetromino.colorsTable[typ]
-                            rect.draw()
-                self.curTetromino.draw()
-
-        self.nextTetromino.draw()
+        if self.mode == GameMode.HightScore:
+            self.screenView.updateHighScores(self.hightScores.top(10),self.idHightScore,self.iColorHighScore)
+        self.screenView.draw(self.mode)
 
 
     def on_key_press(self,symbol, modifiers):
+        self.invalidate()
+        if symbol == key.F3:
+            self.setProfiling(not self.profiler.fEnabled)
+            return
+        if symbol == key.F4:
+            self.atlas.nextSkin()
+            for player in self.players:
+                player.boardView.applySkin()
+            return
 
         match self.mode:
             case GameMode.Play:
+                binding = self.playerKeys.get(symbol)
+                if binding is not None:
+                    player,command,_ = binding
+                    if command is not None:
+                        self.pushInput(player,command)
+                        if self.profiler.fEnabled and command in LATENCY_COMMANDS:
+                            self.latency.press(clock.get_default().time(),player.engine)
+                    return
+                if symbol in AUTOPLAY_KEYS:
+                    i = AUTOPLAY_KEYS.index(symbol)
+                    # The other players of a network game play on their side
+                    if i<len(self.players) and (self.netSession is None or self.players[i] is self.localPlayer):
+                        self.players[i].setAutoPlay(not self.players[i].fAutoPlay)
+                    return
                 match symbol:
-                    case key.LEFT:
-                        self.hVelocity = -1
-                    case key.RIGHT:
-                        self.hVelocity = 1
-                    case key.UP:
-                        self.curTetromino.rotateRight()
-                        savX = self.curTetromino.x
-                        fUndo = False
-                        if self.curTetromino.hitGround(self.board):
-                            fUndo = True
-                        elif self.curTetromino.isOutRightLimit():
-                            # Try to shift inside board
-                            while True:
-                                self.curTetromino.x -= CELL_SIZE
-                                if not self.curTetromino.isOutRightLimit():
-                                    break
-                            if self.curTetromino.hitGround(self.board):
-                                fUndo = True
-                        elif self.curTetromino.isOutLeftLimit():
-                            # Try to shift inside board
-                            while True:
-                                self.curTetromino.x += CELL_SIZE
-                                if not self.curTetromino.isOutLeftLimit():
-                                    break
-                            if self.curTetromino.hitGround(self.board):
-                                fUndo = True
-                        if fUndo:
-                            self.curTetromino.x = savX
-                            self.curTetromino.rotateLeft()
+                    case key.H:
+                        self.fHint = not self.fHint
+                    case key.A:
+                        self.localPlayer.setAutoPlay(not self.localPlayer.fAutoPlay)
+                    case key.BACKSPACE if self.fPractice:
+                        self.undo()
+                    case key.ESCAPE if self.fVersus or self.fPractice:
+                        self.saveReplay()
+                        if self.netSession is not None:
+                            self.endNetGame()
+                        self.setMode(GameMode.StandBy)
                     case key.ESCAPE:
+                        self.saveReplay()
                         Id = self.isHightScore()
                         if Id>=0:
-                            self.insertHightScore(Id,self.player_name,self.score)
+                            self.insertHightScore(Id,self.player_name,self.engine.score)
                             self.saveHightScore()
-                            self.mode = GameMode.HightScore
+                            self.setMode(GameMode.HightScore)
                         else:
-                            self.mode = GameMode.StandBy
+                            self.setMode(GameMode.StandBy)
                     case key.NUM_ADD | key.PAGEUP:
-                        if self.musicVolume<10:
-                            self.musicVolume += 1
-                            self.myplayer.volume = self.musicVolume/10
+                        self.audio.changeVolume(1)
                     case key.NUM_SUBTRACT | key.PAGEDOWN:
-                        if self.musicVolume>0:
-                            self.musicVolume -= 1
-                            self.myplayer.volume = self.musicVolume/10
+                        self.audio.changeVolume(-1)
 
             case GameMode.StandBy:
                 match symbol:
                     case key.NUM_ADD | key.PAGEUP:
-                        if self.musicVolume<10:
-                            self.musicVolume += 1
-                            self.myplayer.volume = self.musicVolume/10
+                        self.audio.changeVolume(1)
                     case key.NUM_SUBTRACT | key.PAGEDOWN:
-                        if self.musicVolume>0:
-                            self.musicVolume -= 1
-                            self.myplayer.volume = self.musicVolume/10
+                        self.audio.changeVolume(-1)
                     case key.ESCAPE:
                         pyglet.app.exit()
 
             case GameMode.HightScore:
                 match symbol:
                     case key.NUM_ADD | key.PAGEUP:
-                        if self.musicVolume<10:
-                            self.musicVolume += 1
-                            self.myplayer.volume = self.musicVolume/10
+                        self.audio.changeVolume(1)
                     case key.NUM_SUBTRACT | key.PAGEDOWN:
-                        if self.musicVolume>0:
-                            self.musicVolume -= 1
-                            self.myplayer.volume = self.musicVolume/10
+                        self.audio.changeVolume(-1)
                     case key.ESCAPE:
                         if self.idHightScore>=-1:
                             if len(self.player_name)==0:
                                 self.player_name = "XXXXXXXX"
                             self.setHightScoreName(self.player_name)
                             self.saveHightScore()
-                        self.mode = GameMode.StandBy
+                        self.setMode(GameMode.StandBy)
                     case key.BACKSPACE:
                         if len(self.player_name)>0:
                             self.player_name = self.player_name[:-1]
@@ -665,7 +646,7 @@ class Fenetre(Window):
                                 self.player_name = "XXXXXXXX"
                             self.setHightScoreName(self.player_name)
                             self.saveHightScore()
-                        self.mode = GameMode.StandBy
+                        self.setMode(GameMode.StandBy)
                     case _:
                         c = self.tblChars.get(symbol)
                         if c!=None:
@@ -673,167 +654,208 @@ class Fenetre(Window):
                             self.setHightScoreName(self.player_name) 
 
     def on_key_release(self,symbol, modifiers):
+        self.invalidate()
+        binding = self.playerKeys.get(symbol)
+        if binding is not None and self.mode == GameMode.Play:
+            player,_,command = binding
+            if command is not None:
+                self.pushInput(player,command)
+            return
         match symbol:
-            case key.LEFT:
-                self.hVelocity = 0
-            case key.RIGHT:
-                self.hVelocity = 0
             case key.SPACE:
                 match self.mode:
-                    case GameMode.Play:
-                        self.fDropTetromino = True
+                    case GameMode.StandBy if self.netClient is not None:
+                        # A network game is played once
+                        pass
                     case GameMode.StandBy:
-                        self.mode = GameMode.Play
+                        self.setMode(GameMode.Play)
                         self.initNewGame()
                     case GameMode.GameOver:
-                        self.mode = GameMode.StandBy
+                        self.setMode(GameMode.StandBy)
 
             case key.M:
-                if self.myplayer.playing:
-                    self.myplayer.pause()
-                else:
-                    self.myplayer.play()
+                self.audio.toggleMusic()
             case _:
                 pass
 
 
-    def on_update(self,deltatime):
+    def pushInput(self, player: Player, command: Command):
+        '''queue the command of a key with the time of its event, a network game sends it with the next tick'''
+        if self.netSession is not None:
+            player.inputs.append(command)
+        else:
+            player.inputQueue.push(clock.get_default().time(),command)
 
-        self.elapseTime1 += deltatime
-        self.elapseTime2 += deltatime
-        self.elapseTime3 += deltatime
-        match self.mode:
-            case GameMode.Play:
-                if self.nbCompletedLines>0:
-                    if self.elapseTime1 > 0.2:
-                        self.elapseTime1 = 0
-                        self.eraseFirstCompletedLine()
-                        self.nbCompletedLines -= 1
-                        self.soundSucces.play()
-                    return
-                
-                if self.fGameOver:
-                    if self.elapseTime1 > 0.4:
+    def on_update(self,deltatime):
+        if self.netSession is not None:
+            player = self.localPlayer
+            # The commands apply some ticks later, the computer waits for them
+            if player.fAutoPlay and not self.netSession.isInputPending():
+                player.inputs.extend(player.autoPlayer.commands(player.engine))
+            playersEvents = self.netSession.advance(deltatime, player.inputs)
+        else:
+            # The keys apply at the ticks of their events
+            now = clock.get_default().time()
+            for player in self.players:
+                player.inputQueue.schedule(player.engine,now,deltatime)
+                if player.fAutoPlay:
+                    player.inputs.extend(player.autoPlayer.commands(player.engine))
+            # One step of all the engines, the garbage lines are sent after it
+            playersEvents = self.versus.step(deltatime, [player.inputs for player in self.players])
+            if self.fPractice:
+                self.recordHistory()
+        for player,events in zip(self.players,playersEvents):
+            player.inputs.clear()
+            player.updateScore()
+            for event in events:
+                match event:
+                    case Event.LineErased:
+                        self.audio.play('109662__grunz__success.wav',0.05)
+                    case Event.GameOver if self.fPractice:
+                        # The game stays on screen, Backspace rewinds it
+                        pass
+                    case Event.GameOver if not self.fVersus:
+                        self.saveReplay()
                         id = self.isHightScore()
                         if id>=0:
-                            self.insertHightScore(id,self.player_name,self.score)
+                            self.insertHightScore(id,self.player_name,self.engine.score)
                             self.saveHightScore()
-                            self.mode = GameMode.HightScore
-                        else:
-                            self.mode = GameMode.GameOver
-                    return
-
-                # Horizontal move
-                if self.elapseTime1 > 0.03:
-                    self.elapseTime1 = 0
-                    for _ in range(4):
-                        if self.curTetromino.velocityX == 1:
-                            dum = self.curTetromino.x + self.curTetromino.velocityX
-                            if (dum % CELL_SIZE)!=0:
-                                if not (self.curTetromino.hitRight(self.board)):
-                                    self.curTetromino.x += self.curTetromino.velocityX                    
-                            else:
-                                self.curTetromino.x += self.curTetromino.velocityX
-                                self.curTetromino.velocityX = 0
-                        elif self.curTetromino.velocityX == -1:
-                            dum = self.curTetromino.x + self.curTetromino.velocityX
-                            if (dum % CELL_SIZE)!=0:
-                                if not (self.curTetromino.hitLeft(self.board)):
-                                    self.curTetromino.x += self.curTetromino.velocityX                    
-                            else:
-                                self.curTetromino.x += self.curTetromino.velocityX
-                                self.curTetromino.velocityX = 0
-                        else:            
-                            if  self.hVelocity==-1:
-                                if (self.curTetromino.x % CELL_SIZE)==0:
-                                    _x = self.curTetromino.minX() + self.curTetromino.iX()
-                                    if  _x > 0:
-                                        self.curTetromino.velocityX = -1
-                                        if not (self.curTetromino.hitLeft(self.board)):
-                                            self.curTetromino.x += self.curTetromino.velocityX
-
-                            elif self.hVelocity==1:
-                                if (self.curTetromino.x % CELL_SIZE)==0:
-                                    _x = self.curTetromino.maxX() + self.curTetromino.iX()
-                                    if _x<(NB_COLUMNS-1):
-                                        self.curTetromino.velocityX = 1
-                                        if not (self.curTetromino.hitRight(self.board)):
-                                            self.curTetromino.x += self.curTetromino.velocityX
-
-                # Move Down
-                if self.fDropTetromino:
-                    delay = 0.01
-                    nbRepeat = 10
-                else:
-                    delay = 0.03
-                    nbRepeat = 3
-
-                if self.elapseTime3 > delay:
-                    self.elapseTime3 = 0
-                    for _ in range(nbRepeat):
-                        # Test hit freeze tetromino's cells
-                        fHit = False
-                        for [vx,vy] in self.curTetromino.v:
-                            x = vx*CELL_SIZE + self.curTetromino.x
-                            y = vy*CELL_SIZE + self.curTetromino.y - 1
-                            ix = int(x/CELL_SIZE)
-                            iy = int(y/CELL_SIZE)
-                            if (ix>=0) and (ix<NB_COLUMNS) and (iy>=0) and (iy<NB_ROWS):
-                                if self.board[ix+iy*NB_COLUMNS]!=0:
-                                    fHit = True
-                                    break
-                            x = vx*CELL_SIZE + self.curTetromino.x + CELL_SIZE - 1
-                            ix = int(x/CELL_SIZE)
-                            if (ix>=0) and (ix<NB_COLUMNS) and (iy>=0) and (iy<NB_ROWS):
-                                if self.board[ix+iy*NB_COLUMNS]!=0:
-                                    fHit = True
-                                    break
-                        if (fHit):
-                            if (self.curTetromino.x % CELL_SIZE)==0 and (self.curTetromino.y % CELL_SIZE)==0:
-                                self.freeze_tetromino()
-                                if self.is_game_over():
-                                    self.fGameOver = True
-                                else:
-                                    self.fDropTetromino = False
-                                    self.curTetromino = Tetromino(5*CELL_SIZE,19*CELL_SIZE,self.nextTetromino.pieceShape)
-                                    self.nextTetromino = Tetromino(14*CELL_SIZE,11*CELL_SIZE,self.tetrisRandomizer())
+                            self.setMode(GameMode.HightScore)
                         else:
-                            # Current Tetromino reach the bottom
-                            if not self.curTetromino.hitBottom():
-                                self.curTetromino.y += self.curTetromino.velocityY
-                                if (self.curTetromino.x%CELL_SIZE)==0:
-                                    if (self.curTetromino.y%CELL_SIZE)==0:
-                                        # Allow horizontal sliding
-                                        if  self.hVelocity!=0:
-                                            break
-                            else:
-                                if self.hVelocity!=0:
-                                    # Allow horizontal movement
-                                    break
-                                else:
-                                    # Freeze current Tetromino
-                                    # Ajust Tetromino horizontal position
-                                    if self.curTetromino.x%CELL_SIZE!=0:
-                                        self.curTetromino.x = (int(self.curTetromino.x/CELL_SIZE)+1)*CELL_SIZE
-                                    # Freeze
-                                    self.freeze_tetromino()
-                                    if self.is_game_over():
-                                        self.fGameOver = True
-                                    else:
-                                        self.fDropTetromino = False
-                                        self.curTetromino = Tetromino(5*CELL_SIZE,19*CELL_SIZE,self.nextTetromino.pieceShape)
-                                        self.nextTetromino = Tetromino(14*CELL_SIZE,11*CELL_SIZE,self.tetrisRandomizer())
-            case GameMode.HightScore:
-                if self.elapseTime1 > 0.2:
-                    self.elapseTime1 = 0
-                    self.iColorHighScore += 1
-
-        if self.elapseTime2 > 0.5:
-            self.elapseTime2 = 0
-            self.nextTetromino.rotateLeft()
+                            self.setMode(GameMode.GameOver)
+        fLeft = self.netSession is not None and self.netSession.fClosed
+        if self.fVersus and (self.versus.fEnded or fLeft) and self.mode == GameMode.Play:
+            self.saveReplay()
+            winner = self.versus.winner
+            if winner is None:
+                title = 'A PLAYER LEFT'
+            else:
+                title = self.players[winner].name + ' WINS' if winner>=0 else 'DRAW'
+            self.screenView.setTitle(GameMode.GameOver,title)
+            if self.netSession is not None:
+                self.endNetGame()
+            self.setMode(GameMode.GameOver)
+
+    def saveReplay(self):
+        '''keep the replays of the last game, they can be checked with replay.py'''
+        for i,player in enumerate(self.players):
+            engine = player.engine
+            if engine.recorder is not None:
+                filename = 'lastgame_p{}.replay'.format(i+1) if self.fVersus else 'lastgame.replay'
+                saveReplay(filename,engine,engine.recorder)
+                engine.recorder = None
+
+    def on_frame(self, dt):
+        '''Play mode frame : advance the engine then redraw'''
+        self.on_update(dt)
+        self.on_redraw(dt)
+
+    def on_blink(self, dt):
+        self.iColorHighScore += 1
+        self.invalidate()
+
+    def on_rotate_next(self, dt):
+        for player in self.players:
+            player.engine.nextTetromino.rotateLeft()
+        self.invalidate()
+
+    def setMode(self, mode: GameMode):
+        '''switch mode and its timers, only the Play mode is redrawn every frame'''
+        for func,_ in self.modeTimers.get(self.mode,()):
+            clock.unschedule(func)
+        self.mode = mode
+        for func,interval in self.modeTimers.get(self.mode,()):
+            clock.schedule_interval(func,interval)
+        self.invalidate()
+
+    def invalidate(self):
+        '''request a redraw, several requests before the next loop iteration draw once'''
+        if not self.fRedraw:
+            self.fRedraw = True
+            clock.schedule_once(self.on_redraw,0)
+
+    def on_redraw(self, dt):
+        if self.fRedraw:
+            self.fRedraw = False
+            clock.unschedule(self.on_redraw)
+        self.switch_to()
+        self.dispatch_event('on_draw')
+        if self.profiler.fEnabled:
+            self.profileOverlay.endFrame()
+            self.profileOverlay.draw()
+        self.flip()
+        if self.profiler.fEnabled:
+            self.latency.shown(clock.get_default().time())
+
+    def on_expose(self):
+        self.invalidate()
 
 
 if __name__ == "__main__" :
-    fenetre = Fenetre(WIN_WIDTH,WIN_HEIGHT)
-    clock.schedule_interval(fenetre.on_update,1/100)
-    pyglet.app.run()
+    parser = argparse.ArgumentParser(description='Tetris in PyGlet')
+    parser.add_argument('--columns', type=int, default=NB_COLUMNS)
+    parser.add_argument('--rows', type=int, default=NB_ROWS)
+    parser.add_argument('--cell', type=int, help='size of a cell in pixels, 25 times the scale by default')
+    parser.add_argument('--scale', type=float, default=1.0, help='size of the texts and margins, 2 for HiDPI screens')
+    parser.add_argument('--players', type=int, choices=range(1,len(PLAYER_KEYS)+1),
+                        help='versus game of 2 to 4 players side by side')
+    parser.add_argument('--connect', metavar='HOST[:PORT]',
+                        help='network versus game through the relay of netplay.py')
+    parser.add_argument('--skin', help='skin of the blocks : {} or a PNG file of {} square tiles'.format(
+                        ', '.join(SKINS),NB_TILES))
+    parser.add_argument('--practice', action='store_true',
+                        help='single player game without high score, Backspace rewinds it')
+    parser.add_argument('--beam', type=int, default=0, metavar='DEPTH',
+                        help='the computer (A and H keys) looks DEPTH tetrominos ahead in a worker process')
+    parser.add_argument('--das', type=float, metavar='MS',
+                        help='guideline moves : delay before a held left or right key repeats, {:.0f} ms by default'.format(
+                        Handling().das*TICK_DT*1000))
+    parser.add_argument('--arr', type=float, metavar='MS',
+                        help='guideline moves : delay between the repeated moves, 0 moves to the wall, {:.0f} ms by default'.format(
+                        Handling().arr*TICK_DT*1000))
+    parser.add_argument('--lock', type=float, metavar='MS',
+                        help='guideline moves : delay before a landed tetromino locks, {:.0f} ms by default'.format(
+                        Handling().lockDelay*TICK_DT*1000))
+    parser.add_argument('--srs', action='store_true',
+                        help='the rotations try the wall kicks of the Super Rotation System, with the classic or the guideline moves')
+    args = parser.parse_args()
+    if args.columns<4 or args.rows<4:
+        parser.error('the board needs at least 4 columns and 4 rows')
+    cellSize = args.cell if args.cell else round(CELL_SIZE*args.scale)
+    netClient = None
+    if args.connect:
+        host,_,port = args.connect.partition(':')
+        netClient = NetClient(host,int(port) if port else DEFAULT_PORT)
+    nbPlayers = args.players if args.players else (2 if netClient else 1)
+    if args.skin and args.skin not in SKINS and not args.skin.lower().endswith('.png'):
+        parser.error('unknown skin {}'.format(args.skin))
+    if args.practice and nbPlayers>1:
+        parser.error('the practice mode is a single player game')
+    if args.beam<0:
+        parser.error('the depth of the search is positive')
+    if args.srs and netClient is not None:
+        parser.error('the network games play the classic rotations')
+    handling = None
+    if args.das is not None or args.arr is not None or args.lock is not None:
+        if netClient is not None:
+            parser.error('the network games play the classic moves')
+        ms = [getattr(args,name) for name in ('das','arr','lock')]
+        if any(value is not None and value<0 for value in ms):
+            parser.error('the delays are positive')
+        handling = Handling(*(default if value is None else round(value/1000/TICK_DT)
+                              for value,default in zip(ms,Handling())))
+    fenetre = Fenetre(Layout(args.columns,args.rows,cellSize,args.scale),nbPlayers,netClient,args.practice,
+                      args.skin,args.beam,handling,args.srs)
+    if environ.get('TETRIS_STARTUP_PROBE'):
+        # Report the time of the first on_draw then quit, used by bench.py startup
+        def on_draw():
+            print('first_draw {:.6f}'.format(time.time()), flush=True)
+            clock.schedule_once(lambda dt: pyglet.app.exit(), 0)
+        fenetre.push_handlers(on_draw=on_draw)
+    # Fenetre schedules its own redraws
+    pyglet.app.run(None)
+    fenetre.dumpProfile()
+    for player in fenetre.players:
+        player.autoPlayer.close()
+    if netClient is not None:
+        fenetre.endNetGame()
@@ -0,0 +1,608 @@
+"""  Network versus games : lockstep of the commands over TCP  """
+
+import argparse
+import asyncio
+import json
+import queue
+import random
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from time import perf_counter_ns
+from engine import NB_COLUMNS, NB_ROWS, TICK_DT, MAX_TICKS_PER_STEP, Command, SnapshotRing
+from profiler import Histogram
+from versus import Versus
+
+MAGIC = b'TTNP'
+VERSION = 1
+DEFAULT_PORT = 7777
+# Ticks between the commands of a frame and the tick applying them
+INPUT_DELAY = 3
+# Ticks run ahead of a late player, 0 for a strict lockstep
+MAX_PREDICTION = 8
+# The state hashes are compared every HASH_INTERVAL ticks
+HASH_INTERVAL = 50
+PING_INTERVAL = 0.5
+
+# A message is a type byte followed by a fixed header, the commands follow
+# the INPUTS header : for each tick the number of commands then the commands
+MSG_HELLO = 1   # magic, version
+MSG_START = 2   # seed, player, number of players, input delay, number of columns and rows
+MSG_INPUTS = 3  # player, first tick, number of ticks, length of the commands
+MSG_HASH = 4    # player, tick, crc32 of the state before the tick
+MSG_PING = 5    # sender, sender time in ns
+MSG_PONG = 6    # sender of the ping, time of the ping
+MSG_BYE = 7     # player who left
+
+HELLO = struct.Struct('<B4sB')
+START = struct.Struct('<BQBBBHH')
+INPUTS = struct.Struct('<BBIBH')
+HASH = struct.Struct('<BBII')
+PING = struct.Struct('<BBQ')
+BYE = struct.Struct('<BB')
+
+MESSAGE_SIZES = {
+    MSG_HELLO: HELLO.size,
+    MSG_START: START.size,
+    MSG_HASH: HASH.size,
+    MSG_PING: PING.size,
+    MSG_PONG: PING.size,
+    MSG_BYE: BYE.size,
+}
+
+
+async def readMessage(reader: asyncio.StreamReader)->bytes:
+    '''the next message of the stream, type byte included'''
+    typ = await reader.readexactly(1)
+    if typ[0] == MSG_INPUTS:
+        header = typ + await reader.readexactly(INPUTS.size-1)
+        return header + await reader.readexactly(INPUTS.unpack(header)[4])
+    size = MESSAGE_SIZES.get(typ[0])
+    if size is None:
+        raise ValueError('bad message type {}'.format(typ[0]))
+    return typ + await reader.readexactly(size-1)
+
+
+def encodeInputs(player: int, firstTick: int, ticks: list[tuple])->bytes:
+    data = bytearray()
+    for commands in ticks:
+        data.append(len(commands))
+        data.extend(commands)
+    return INPUTS.pack(MSG_INPUTS,player,firstTick,len(ticks),len(data)) + data
+
+
+def decodeInputs(msg: bytes)->tuple:
+    '''player, first tick and the commands of each tick'''
+    _,player,firstTick,nbTicks,_ = INPUTS.unpack_from(msg)
+    ticks = []
+    i = INPUTS.size
+    for _ in range(nbTicks):
+        n = msg[i]
+        ticks.append(tuple(Command(c) for c in msg[i+1:i+1+n]))
+        i += 1 + n
+    return player,firstTick,ticks
+
+
+def stateHash(versus: Versus)->int:
+    '''crc32 of the boards, tetrominos and scores of the players'''
+    h = 0
+    for engine in versus.engines:
+        tetro = engine.curTetromino
+        h = zlib.crc32(bytes(engine.board),h)
+        h = zlib.crc32(struct.pack('<iiiBII',tetro.x,tetro.y,engine.score,tetro.pieceShape,
+                                   engine.nbPieces,engine.pendingGarbage),h)
+    return h
+
+
+class RelayServer:
+    '''Relays the messages of the players of one game
+
+    The game starts when nbPlayers clients said hello, each one gets the
+    seed and its player number. To test the network code on one machine
+    the relay holds each message latency seconds plus a random jitter,
+    and holds a message reorder percent of the time for latency more so
+    it arrives after the next ones.
+    '''
+
+    def __init__(self, nbPlayers: int = 2, seed: int = None, inputDelay: int = INPUT_DELAY,
+                 nbColumns: int = NB_COLUMNS, nbRows: int = NB_ROWS,
+                 latency: float = 0.0, jitter: float = 0.0, reorder: float = 0.0):
+        self.nbPlayers = nbPlayers
+        self.seed = seed if seed is not None else random.SystemRandom().getrandbits(64)
+        self.inputDelay = inputDelay
+        self.nbColumns = nbColumns
+        self.nbRows = nbRows
+        self.latency = latency
+        self.jitter = jitter
+        self.reorder = reorder
+        self.rng = random.Random(self.seed)
+        self.writers = []
+        self.fStarted = False
+        self.finished = None
+
+    def deliver(self, writer: asyncio.StreamWriter, msg: bytes):
+        delay = self.latency + self.rng.random()*self.jitter
+        if self.rng.random() < self.reorder:
+            delay += self.latency + self.jitter + TICK_DT
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay,self.write,writer,msg)
+        else:
+            self.write(writer,msg)
+
+    def write(self, writer: asyncio.StreamWriter, msg: bytes):
+        if not writer.is_closing():
+            writer.write(msg)
+
+    def broadcast(self, sender: int, msg: bytes):
+        for player,writer in enumerate(self.writers):
+            if player != sender and writer is not None:
+                self.deliver(writer,msg)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        player = -1
+        try:
+            _,magic,version = HELLO.unpack(await readMessage(reader))
+            if magic != MAGIC or version != VERSION or self.fStarted:
+                return
+            # The slot of a player who left before the start is given to the next one
+            if None in self.writers:
+                player = self.writers.index(None)
+                self.writers[player] = writer
+            else:
+                player = len(self.writers)
+                self.writers.append(writer)
+            if sum(w is not None for w in self.writers) == self.nbPlayers:
+                self.fStarted = True
+                for i,w in enumerate(self.writers):
+                    if w is not None:
+                        w.write(START.pack(MSG_START,self.seed,i,self.nbPlayers,self.inputDelay,
+                                           self.nbColumns,self.nbRows))
+            while True:
+                msg = await readMessage(reader)
+                if msg[0] == MSG_PONG:
+                    target = msg[1]
+                    if 0 <= target < len(self.writers) and self.writers[target] is not None:
+                        self.deliver(self.writers[target],msg)
+                elif msg[0] in (MSG_INPUTS,MSG_HASH,MSG_PING):
+                    self.broadcast(player,msg)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            if player >= 0:
+                self.writers[player] = None
+                if self.fStarted:
+                    self.broadcast(player,BYE.pack(MSG_BYE,player))
+                    if all(w is None for w in self.writers):
+                        self.finished.set()
+            writer.close()
+
+    async def serve(self, host: str, port: int, ready = None):
+        '''relay one game until all its players left, ready(port) is called once listening'''
+        self.finished = asyncio.Event()
+        server = await asyncio.start_server(self.handle,host,port)
+        if ready is not None:
+            ready(server.sockets[0].getsockname()[1])
+        async with server:
+            await self.finished.wait()
+
+
+class NetClient:
+    '''Connection to the relay
+
+    The asyncio loop runs in a thread, the game loop never waits on the
+    network : send() hands the message to the loop and poll() returns
+    the messages received since the last call. The pings are answered by
+    the thread, the round trip times do not include the frame time.
+    '''
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.received = queue.SimpleQueue()
+        self.loop = None
+        self.writer = None
+        self.player = -1
+        self.rtt = Histogram()
+        self.nbBytesSent = 0
+        self.nbBytesReceived = 0
+        self.fClosed = False
+        self.error = None
+        self.thread = threading.Thread(target=self.run,name='netplay',daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        try:
+            asyncio.run(self.main())
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            self.error = e
+        finally:
+            self.fClosed = True
+            # End of the messages
+            self.received.put(None)
+
+    async def main(self):
+        reader,self.writer = await asyncio.open_connection(self.host,self.port)
+        self.loop = asyncio.get_running_loop()
+        self.writer.write(HELLO.pack(MSG_HELLO,MAGIC,VERSION))
+        pinger = None
+        try:
+            while True:
+                try:
+                    msg = await readMessage(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                self.nbBytesReceived += len(msg)
+                if msg[0] == MSG_PING:
+                    self.writer.write(PING.pack(MSG_PONG,msg[1],PING.unpack(msg)[2]))
+                elif msg[0] == MSG_PONG:
+                    self.rtt.add(perf_counter_ns()-PING.unpack(msg)[2])
+                else:
+                    if msg[0] == MSG_START:
+                        self.player = msg[9]
+                        pinger = asyncio.create_task(self.ping())
+                    self.received.put(msg)
+        finally:
+            if pinger is not None:
+                pinger.cancel()
+            self.writer.close()
+
+    async def ping(self):
+        while True:
+            self.writer.write(PING.pack(MSG_PING,self.player,perf_counter_ns()))
+            await asyncio.sleep(PING_INTERVAL)
+
+    def send(self, msg: bytes):
+        if self.loop is not None and not self.fClosed:
+            self.nbBytesSent += len(msg)
+            self.loop.call_soon_threadsafe(self.writer.write,msg)
+
+    def poll(self)->list[bytes]:
+        '''the messages received since the last call, None once the connection is closed'''
+        messages = []
+        while True:
+            try:
+                messages.append(self.received.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def close(self):
+        if self.loop is not None and not self.fClosed:
+            self.loop.call_soon_threadsafe(self.writer.close)
+        self.fClosed = True
+
+
+class NetSession:
+    '''Lockstep of a versus game with the other players of the relay
+
+    Only the commands are sent : the commands of a frame are applied
+    inputDelay ticks later on every side, a tick runs once the commands
+    of all the players for it are known. A late player is predicted to
+    send no command for up to maxPrediction ticks, the session stalls
+    beyond, so at most maxPrediction ticks are not confirmed. The state
+    before each of them is kept in a ring, when the commands received
+    differ from the prediction the game is restored to the first wrong
+    tick and the ticks are run again.
+    The hash of the state before every HASH_INTERVAL tick is sent once
+    the tick is confirmed and compared with the hashes of the others.
+    '''
+
+    def __init__(self, client: NetClient, versus: Versus, seed: int, player: int,
+                 inputDelay: int = INPUT_DELAY, maxPrediction: int = MAX_PREDICTION):
+        self.client = client
+        self.versus = versus
+        self.player = player
+        self.inputDelay = inputDelay
+        self.maxPrediction = maxPrediction
+        versus.newGame(seed)
+        nbPlayers = len(versus.engines)
+        # Commands of each player by tick, kept until the tick is confirmed
+        self.inputs = [{} for i in range(nbPlayers)]
+        # Commands the unconfirmed ticks ran with and the state before them
+        self.played = {}
+        self.snapshots = SnapshotRing(max(1,maxPrediction))
+        self.localCommands = []
+        self.localTick = 0
+        # Local commands of the ticks not sent yet
+        self.outgoing = []
+        self.sendFirstTick = 0
+        self.nbTicks = 0
+        self.confirmedTick = 0
+        self.accumulator = 0.0
+        self.localHashes = {}
+        self.remoteHashes = {}
+        self.pendingHashes = {}
+        self.fClosed = False
+        self.nbPredictedTicks = 0
+        self.nbStalls = 0
+        self.nbRollbacks = 0
+        self.rollbackDepths = Histogram()
+        self.nbHashesChecked = 0
+        self.nbDesyncs = 0
+
+    @staticmethod
+    def fromStart(client: NetClient, versus: Versus, msg: bytes, maxPrediction: int = MAX_PREDICTION)->'NetSession':
+        '''session of the START message of the relay, the board size must be the one of versus'''
+        _,seed,player,nbPlayers,inputDelay,nbColumns,nbRows = START.unpack(msg)
+        engine = versus.engines[0]
+        if (nbPlayers,nbColumns,nbRows) != (len(versus.engines),engine.nbColumns,engine.nbRows):
+            raise ValueError('the relay game is {} players on {}x{}'.format(nbPlayers,nbColumns,nbRows))
+        return NetSession(client,versus,seed,player,inputDelay,maxPrediction)
+
+    def commandsAt(self, t: int):
+        '''the commands of all the players for tick t, None if one is missing'''
+        commands = []
+        for inputs in self.inputs:
+            c = inputs.get(t)
+            if c is None:
+                return None
+            commands.append(c)
+        return commands
+
+    def scheduleLocal(self, t: int):
+        '''the local commands are applied inputDelay ticks after the current tick'''
+        while self.localTick <= t + self.inputDelay:
+            commands = tuple(self.localCommands)
+            self.inputs[self.player][self.localTick] = commands
+            self.outgoing.append(commands)
+            self.localCommands.clear()
+            self.localTick += 1
+
+    def flushLocal(self):
+        if len(self.outgoing)>0:
+            self.client.send(encodeInputs(self.player,self.sendFirstTick,self.outgoing))
+            self.sendFirstTick = self.localTick
+            self.outgoing.clear()
+
+    def isInputPending(self)->bool:
+        '''True until the local commands given are applied, a computer player waits for them'''
+        if len(self.localCommands)>0:
+            return True
+        local = self.inputs[self.player]
+        return any(local.get(t) for t in range(self.nbTicks,self.localTick))
+
+    def confirm(self, t: int):
+        '''tick t and the ones before run with the commands of all the players'''
+        self.confirmedTick = t + 1
+        for inputs in self.inputs:
+            inputs.pop(t,None)
+        self.played.pop(t,None)
+        h = self.pendingHashes.pop(t+1,None)
+        if h is not None:
+            self.hashConfirmed(t+1,h)
+
+    def runTick(self):
+        t = self.nbTicks
+        commands = self.commandsAt(t)
+        fConfirmed = commands is not None and t == self.confirmedTick
+        if not fConfirmed:
+            self.snapshots.push(t,self.versus.snapshot())
+            if commands is None:
+                commands = [inputs.get(t,()) for inputs in self.inputs]
+                self.nbPredictedTicks += 1
+            self.played[t] = commands
+        self.versus.tick(commands)
+        self.nbTicks = t + 1
+        if self.nbTicks % HASH_INTERVAL == 0:
+            self.pendingHashes[self.nbTicks] = stateHash(self.versus)
+        if fConfirmed:
+            self.confirm(t)
+
+    def rollback(self, t: int):
+        '''restore the state before tick t and run the ticks again with the commands received'''
+        nbTicks = self.nbTicks
+        self.nbRollbacks += 1
+        self.rollbackDepths.add(nbTicks-t)
+        self.versus.restore(self.snapshots.get(t))
+        # The events of these ticks were reported when they first ran
+        nbEvents = [len(engine.events) for engine in self.versus.engines]
+        self.nbTicks = t
+        while self.nbTicks < nbTicks:
+            self.runTick()
+        for engine,n in zip(self.versus.engines,nbEvents):
+            del engine.events[n:]
+
+    def reconcile(self):
+        '''confirm the predicted ticks, roll back from the first one predicted wrong'''
+        while self.confirmedTick < self.nbTicks:
+            t = self.confirmedTick
+            commands = self.commandsAt(t)
+            if commands is None:
+                return
+            if commands != self.played[t]:
+                self.rollback(t)
+                return
+            self.confirm(t)
+
+    def hashConfirmed(self, t: int, h: int):
+        self.client.send(HASH.pack(MSG_HASH,self.player,t,h))
+        self.localHashes[t] = h
+        for key in [key for key in self.remoteHashes if key[1] == t]:
+            self.checkHash(t,self.remoteHashes.pop(key))
+        # Keep the last hashes for the late players
+        self.localHashes.pop(t - 20*HASH_INTERVAL,None)
+
+    def checkHash(self, t: int, h: int):
+        self.nbHashesChecked += 1
+        if h != self.localHashes[t]:
+            self.nbDesyncs += 1
+            print('Desync at tick {} : {:08x} instead of {:08x}'.format(t,h,self.localHashes[t]))
+
+    def receive(self, msg: bytes):
+        if msg is None:
+            self.fClosed = True
+            return
+        if msg[0] == MSG_INPUTS:
+            player,firstTick,ticks = decodeInputs(msg)
+            inputs = self.inputs[player]
+            for t,commands in enumerate(ticks,firstTick):
+                if t >= self.confirmedTick:
+                    inputs[t] = commands
+        elif msg[0] == MSG_HASH:
+            _,player,t,h = HASH.unpack(msg)
+            if t in self.localHashes:
+                self.checkHash(t,h)
+            elif t > self.confirmedTick:
+                self.remoteHashes[(player,t)] = h
+        elif msg[0] == MSG_BYE:
+            self.fClosed = True
+
+    def advance(self, dt: float, commands = ())->list[list]:
+        '''run the ticks of dt seconds with the local commands, returns the events of each engine'''
+        for engine in self.versus.engines:
+            engine.events.clear()
+        for msg in self.client.poll():
+            self.receive(msg)
+        self.reconcile()
+        self.localCommands.extend(commands)
+        self.accumulator = min(self.accumulator + dt, MAX_TICKS_PER_STEP*TICK_DT)
+        while self.accumulator >= TICK_DT - 1e-9:
+            t = self.nbTicks
+            self.scheduleLocal(t)
+            if t - self.confirmedTick >= self.maxPrediction and (t > self.confirmedTick or self.commandsAt(t) is None):
+                # Wait for the late players, the ring keeps the states of maxPrediction ticks
+                self.nbStalls += 1
+                break
+            self.accumulator -= TICK_DT
+            self.runTick()
+        self.flushLocal()
+        return [engine.events for engine in self.versus.engines]
+
+    def stats(self)->dict:
+        rtt = self.client.rtt.summary()
+        return {
+            'player': self.player,
+            'ticks': self.nbTicks,
+            'confirmed_ticks': self.confirmedTick,
+            'predicted_ticks': self.nbPredictedTicks,
+            'stalled_frames': self.nbStalls,
+            'rollbacks': self.nbRollbacks,
+            'rollback_depth': self.rollbackDepths.summary(),
+            'hashes_checked': self.nbHashesChecked,
+            'desyncs': self.nbDesyncs,
+            'rtt_ms': {k: rtt[k]/1e6 for k in ('mean','max','recent_p50','recent_p90','recent_p99')},
+            'pings': rtt['count'],
+            'bytes_sent': self.client.nbBytesSent,
+            'bytes_received': self.client.nbBytesReceived,
+        }
+
+
+def startRelay(args: list[str])->tuple:
+    '''start a relay process on a free port, returns the process and the port'''
+    process = subprocess.Popen([sys.executable,__file__,'server','--port','0','--print-port'] + args,
+                               stdout=subprocess.PIPE,text=True)
+    line = process.stdout.readline()
+    if not line.startswith('port '):
+        process.kill()
+        raise SystemExit('the relay did not start')
+    return process,int(line.split()[1])
+
+
+def selfTest(args)->dict:
+    '''two computer players of a game through a relay process with the simulated network'''
+    from ai import AutoPlayer
+    process,port = startRelay(['--players','2','--seed',str(args.seed),'--latency',str(args.latency),
+                               '--jitter',str(args.jitter),'--reorder',str(args.reorder)])
+    if args.quitter:
+        # A player joins then leaves before the start, the next players take its slot
+        with socket.create_connection(('127.0.0.1',port)) as quitter:
+            quitter.sendall(HELLO.pack(MSG_HELLO,MAGIC,VERSION))
+            time.sleep(0.2)
+        time.sleep(0.2)
+    clients = [NetClient('127.0.0.1',port) for i in range(2)]
+    for client in clients:
+        client.start()
+    sessions = [None,None]
+    autoPlayers = [AutoPlayer(),AutoPlayer()]
+    # The players lose their way now and then, the games are different
+    rng = random.Random(args.seed)
+    frameDt = 1/60
+    t0 = time.perf_counter()
+    nbFrames = 0
+    while time.perf_counter() - t0 < args.seconds:
+        for i,client in enumerate(clients):
+            if sessions[i] is None:
+                for msg in client.poll():
+                    if msg is not None and msg[0] == MSG_START:
+                        sessions[i] = NetSession.fromStart(client,Versus(2),msg,args.max_prediction)
+                continue
+            session = sessions[i]
+            engine = session.versus.engines[session.player]
+            # The computer player waits for its commands to apply, they are inputDelay ticks late
+            commands = [] if session.isInputPending() else list(autoPlayers[i].commands(engine))
+            if rng.random() < 0.02:
+                commands.append(rng.choice((Command.MoveLeft,Command.MoveRight,Command.Rotate)))
+            session.advance(frameDt,commands)
+        nbFrames += 1
+        # Frames paced by the clock, as the pyglet loop
+        time.sleep(max(0.0,t0 + nbFrames*frameDt - time.perf_counter()))
+        if all(s is not None and (s.versus.fEnded or s.fClosed) for s in sessions):
+            break
+    for client in clients:
+        client.close()
+    process.wait(timeout=10)
+    if None in sessions:
+        raise SystemExit('the game did not start')
+    return {
+        'latency_ms': args.latency*1000,
+        'jitter_ms': args.jitter*1000,
+        'reorder': args.reorder,
+        'frames': nbFrames,
+        'players': [s.stats() for s in sessions],
+        'scores': [e.score for e in sessions[0].versus.engines],
+        'winner': sessions[0].versus.winner,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Relay of network Tetris games')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('server', help='relay the games, python main.py --connect HOST:PORT to play')
+    p.add_argument('--host', default='0.0.0.0')
+    p.add_argument('--port', type=int, default=DEFAULT_PORT)
+    p.add_argument('--players', type=int, default=2, choices=range(2,5))
+    p.add_argument('--columns', type=int, default=NB_COLUMNS)
+    p.add_argument('--rows', type=int, default=NB_ROWS)
+    p.add_argument('--seed', type=int)
+    p.add_argument('--input-delay', type=int, default=INPUT_DELAY, help='ticks of 10ms')
+    p.add_argument('--forever', action='store_true', help='serve the next games, the first one only by default')
+    p.add_argument('--print-port', action='store_true')
+    p.add_argument('--latency', type=float, default=0.0, help='one way delay of the messages in seconds')
+    p.add_argument('--jitter', type=float, default=0.0, help='random delay added in seconds')
+    p.add_argument('--reorder', type=float, default=0.0, help='fraction of the messages delivered late')
+
+    p = sub.add_parser('selftest', help='a game of two computer players through a local relay')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--seconds', type=float, default=20.0)
+    p.add_argument('--latency', type=float, default=0.04)
+    p.add_argument('--jitter', type=float, default=0.02)
+    p.add_argument('--reorder', type=float, default=0.05)
+    p.add_argument('--max-prediction', type=int, default=MAX_PREDICTION)
+    p.add_argument('--quitter', action='store_true', help='a third player leaves before the start')
+
+    args = parser.parse_args()
+    if args.command == 'selftest':
+        print(json.dumps(selfTest(args), indent=2))
+        return
+
+    def ready(port: int):
+        if args.print_port:
+            print('port {}'.format(port), flush=True)
+        else:
+            print('Relay of {} players listening on port {}'.format(args.players,port))
+
+    while True:
+        relay = RelayServer(args.players,args.seed,args.input_delay,args.columns,args.rows,
+                            args.latency,args.jitter,args.reorder)
+        asyncio.run(relay.serve(args.host,args.port,ready=ready))
+        if not args.forever:
+            break
+
+if __name__ == "__main__" :
+    main()
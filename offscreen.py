@@ -0,0 +1,282 @@
+"""  Offscreen rendering of games to PNG files and raw RGBA frame streams  """
+
+import argparse
+import ctypes
+import struct
+import sys
+import zlib
+from time import perf_counter
+import numpy as np
+from ai import AutoPlayer
+from engine import Engine, Tetromino, CELL_SIZE, NB_COLUMNS, NB_ROWS
+from layout import Layout, CLASSIC_LAYOUT, BOARD_COLOR, GHOST_COLOR
+from replay import Replay
+
+# Opacity of the ghost blocks, as BoardView.ghostOpacity
+GHOST_OPACITY = 40
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def pngChunk(kind: bytes, data: bytes)->bytes:
+    return struct.pack('>I',len(data)) + kind + data + struct.pack('>I',zlib.crc32(kind+data))
+
+
+class PngWriter:
+    '''Writes (height, width, 4) RGBA frames as PNG files
+
+    The rows of a PNG are each preceded by a filter byte, they are copied
+    into one buffer allocated for the first frame and reused by the next.
+    '''
+
+    def __init__(self, level: int = 1):
+        self.level = level
+        self.rows = None
+
+    def encode(self, frame: np.ndarray)->bytes:
+        height,width,_ = frame.shape
+        if self.rows is None or self.rows.shape != (height,1+width*4):
+            # Filter 0 : the rows are stored as they are
+            self.rows = np.zeros((height,1+width*4),dtype=np.uint8)
+        self.rows[:,1:] = frame.reshape(height,width*4)
+        header = struct.pack('>IIBBBBB',width,height,8,6,0,0,0)
+        return b''.join((PNG_SIGNATURE,pngChunk(b'IHDR',header),
+                         pngChunk(b'IDAT',zlib.compress(self.rows,self.level)),pngChunk(b'IEND',b'')))
+
+    def write(self, filename: str, frame: np.ndarray):
+        with open(filename,'wb') as f:
+            f.write(self.encode(frame))
+
+
+class SoftwareRenderer:
+    '''Draws the board and the tetrominos of an engine into a NumPy buffer
+
+    Fallback of the GLRenderer without any GL context. The frame is the
+    area of a player of the layout with the flat skin of the game : the
+    cells come from engine.board and Tetromino.colorsTable, the texts are
+    not drawn. The frame buffer and the colours of the cells are allocated
+    once and reused by every frame, the pixels are written as uint32.
+    '''
+
+    def __init__(self, layout: Layout = CLASSIC_LAYOUT):
+        self.layout = layout
+        nbRows = layout.nbRows
+        nbColumns = layout.nbColumns
+        cs = layout.cellSize
+        self.width = layout.width - layout.x0
+        self.height = layout.height
+        self.frame = np.zeros((self.height,self.width,4),dtype=np.uint8)
+        self.frame[...,3] = 255
+        # Rows from the bottom, as the GL coordinates, and the pixels as uint32
+        self.view = self.frame[::-1]
+        self.pixels = self.view.view(np.uint32)[...,0]
+        self.ox = layout.ox - layout.x0
+        self.oy = layout.oy
+        region = self.pixels[self.oy:self.oy+nbRows*cs,self.ox:self.ox+nbColumns*cs]
+        region[...] = self.pixel(BOARD_COLOR)
+        self.background = self.frame.copy()
+        # The blocks of the cells, 1 pixel inside them, the empty ones have the colour of the board
+        self.blocks = region.reshape(nbRows,cs,nbColumns,cs)[:,1:cs-1,:,1:cs-1]
+        self.palette = np.array([self.pixel(BOARD_COLOR)] + [self.pixel(color) for color in Tetromino.colorsTable[1:]],
+                                dtype=np.uint32)
+        self.cellColors = np.zeros((nbRows,nbColumns),dtype=np.uint32)
+        self.ghost = np.zeros((cs-2,cs-2,4),dtype=np.uint16)
+        self.ghostColor = np.array(GHOST_COLOR,dtype=np.uint16)*GHOST_OPACITY
+
+    @staticmethod
+    def pixel(color: tuple)->int:
+        '''the uint32 of an RGBA colour in the frame'''
+        return int(np.array(color,dtype=np.uint8).view(np.uint32)[0])
+
+    def drawBlock(self, x: float, y: float, color: int):
+        '''fill a block of the frame, x,y is its bottom left corner from the bottom of the frame'''
+        size = self.layout.cellSize-2
+        x = round(x)
+        y = round(y)
+        self.pixels[max(0,y):max(0,y+size),max(0,x):max(0,x+size)] = color
+
+    def drawGhostBlock(self, x: float, y: float):
+        '''blend the ghost colour over a block, as the GL blending of a sprite of GHOST_OPACITY'''
+        size = self.layout.cellSize-2
+        x = round(x)
+        y = round(y)
+        block = self.view[max(0,y):max(0,y+size),max(0,x):max(0,x+size),:3]
+        ghost = self.ghost[:block.shape[0],:block.shape[1],:3]
+        np.multiply(block,255-GHOST_OPACITY,out=ghost,dtype=np.uint16)
+        ghost += self.ghostColor[:3]
+        ghost += 127
+        ghost //= 255
+        block[...] = ghost
+
+    def drawTetromino(self, tetro: Tetromino, x: float, y: float):
+        cs = self.layout.cellSize
+        color = self.palette[tetro.pieceShape]
+        for vx,vy in tetro.v:
+            self.drawBlock(x + vx*cs + 1, y + vy*cs + 1, color)
+
+    def renderPlay(self, engine: Engine):
+        '''draw the frozen cells, the current tetromino and its ghost'''
+        layout = self.layout
+        board = engine.board
+        cells = np.frombuffer(board.cells,dtype=np.uint8) if hasattr(board,'cells') else np.array(board,dtype=np.uint8)
+        cells = cells.reshape(layout.nbRows,layout.nbColumns)
+        np.take(self.palette,cells,out=self.cellColors)
+        self.blocks[...] = self.cellColors[:,None,:,None]
+        tetro = engine.curTetromino
+        cs = layout.cellSize
+        unit = layout.unit
+        x = tetro.x*unit + self.ox
+        y = tetro.dropRow(board)*CELL_SIZE*unit + self.oy
+        self.drawTetromino(tetro, x, tetro.y*unit + self.oy)
+        # The ghost sprites are drawn after the blocks of the tetromino
+        for vx,vy in tetro.v:
+            self.drawGhostBlock(x + vx*cs + 1, y + vy*cs + 1)
+
+    def render(self, engine: Engine)->np.ndarray:
+        '''the frame of the engine, top row first, the array is reused by the next frame'''
+        layout = self.layout
+        np.copyto(self.frame,self.background)
+        # The game over screen hides the board, as the play layer of the BoardView
+        if not engine.fEnded:
+            self.renderPlay(engine)
+        self.drawTetromino(engine.nextTetromino, layout.nextX - layout.x0, layout.nextY)
+        return self.frame
+
+
+class GLRenderer:
+    '''Draws the BoardView of an engine in a GL framebuffer and reads it back
+
+    The GL context is the one of a hidden window, pyglet must be imported
+    with the headless option where there is no display. The pixels are
+    read into a buffer allocated once then flipped into the frame, top row
+    first, both are reused by every frame.
+    '''
+
+    def __init__(self, layout: Layout = CLASSIC_LAYOUT, skin: str = None):
+        import pyglet
+        from pyglet import gl
+        from skins import SkinAtlas
+        from boardview import BoardView
+        self.gl = gl
+        self.layout = layout
+        self.width = layout.width - layout.x0
+        self.height = layout.height
+        # Only the context of the window is used
+        self.window = pyglet.window.Window(self.width,self.height,visible=False)
+        self.texture = pyglet.image.Texture.create(self.width,self.height)
+        self.framebuffer = pyglet.image.Framebuffer()
+        self.framebuffer.attach_texture(self.texture)
+        self.batch = pyglet.graphics.Batch()
+        self.atlas = SkinAtlas(layout.cellSize-2,[skin] if skin is not None and skin.lower().endswith('.png') else [])
+        if skin is not None:
+            self.atlas.setSkin(self.atlas.names.index(skin))
+        self.boardView = BoardView(self.batch,Layout(layout.nbColumns,layout.nbRows,layout.cellSize,layout.scale),
+                                   self.atlas)
+        self.pixels = np.zeros((self.height,self.width,4),dtype=np.uint8)
+        self.pointer = self.pixels.ctypes.data_as(ctypes.POINTER(gl.GLubyte))
+        self.frame = np.zeros_like(self.pixels)
+
+    def render(self, engine: Engine)->np.ndarray:
+        '''the frame of the engine, top row first, the array is reused by the next frame'''
+        gl = self.gl
+        self.window.switch_to()
+        self.framebuffer.bind()
+        gl.glViewport(0,0,self.width,self.height)
+        gl.glClearColor(0,0,0,1)
+        gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+        boardView = self.boardView
+        boardView.setPlayVisible(not engine.fEnded)
+        boardView.update(engine.board,engine.curTetromino,engine.nextTetromino)
+        self.batch.draw()
+        gl.glReadPixels(0,0,self.width,self.height,gl.GL_RGBA,gl.GL_UNSIGNED_BYTE,self.pointer)
+        self.framebuffer.unbind()
+        np.copyto(self.frame,self.pixels[::-1])
+        # The blending of the ghost lowers the alpha of the framebuffer
+        self.frame[...,3] = 255
+        return self.frame
+
+    def close(self):
+        self.framebuffer.delete()
+        self.window.close()
+
+
+def createRenderer(name: str, layout: Layout = CLASSIC_LAYOUT, skin: str = None):
+    '''the GLRenderer or the SoftwareRenderer, 'auto' falls back to the software one without GL'''
+    if name == 'software':
+        return SoftwareRenderer(layout)
+    try:
+        import pyglet
+        pyglet.options['headless'] = True
+        return GLRenderer(layout,skin)
+    except Exception as e:
+        if name == 'gl':
+            raise
+        print('GL disabled : {}'.format(e),file=sys.stderr)
+        return SoftwareRenderer(layout)
+
+
+def selfPlayFrames(seed: int, every: int = 1, maxTicks: int = 100000, nbColumns: int = NB_COLUMNS,
+                   nbRows: int = NB_ROWS):
+    '''a game of the AutoPlayer, yields the engine every `every` ticks and at its end'''
+    engine = Engine(seed,nbColumns=nbColumns,nbRows=nbRows)
+    player = AutoPlayer()
+    while not engine.fEnded and engine.nbTicks < maxTicks:
+        engine.pendingCommands.extend(player.commands(engine))
+        engine.tick()
+        if engine.nbTicks % every == 0:
+            yield engine
+    if engine.nbTicks % every != 0:
+        yield engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render Tetris games without a window, to PNG files or raw RGBA frames',
+                                     epilog='ffmpeg example : offscreen.py --replay lastgame.replay --raw - | '
+                                            'ffmpeg -f rawvideo -pix_fmt rgba -s 480x560 -r 25 -i - game.mp4')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--replay', help='replay file of the game')
+    source.add_argument('--selfplay', type=int, metavar='SEED', help='game of the computer player')
+    parser.add_argument('--every', type=int, default=4, help='ticks between two frames, 4 for 25 frames per second')
+    parser.add_argument('--frames', type=int, help='stop after this number of frames')
+    parser.add_argument('--renderer', choices=('auto','gl','software'), default='auto')
+    parser.add_argument('--skin', help='skin of the blocks of the GL renderer')
+    parser.add_argument('--cell', type=int, default=CELL_SIZE, help='size of a cell in pixels')
+    parser.add_argument('--png', metavar='PATTERN', help='PNG file of each frame, as frame%%05d.png')
+    parser.add_argument('--raw', metavar='FILE', help='RGBA frames stream, - for the standard output')
+    args = parser.parse_args()
+    if args.every < 1:
+        parser.error('--every is at least 1')
+    if args.replay:
+        replay = Replay.load(args.replay)
+        layout = Layout(replay.nbColumns,replay.nbRows,args.cell)
+        frames = replay.frames(args.every)
+    else:
+        layout = Layout(cellSize=args.cell)
+        frames = selfPlayFrames(args.selfplay,args.every)
+    renderer = createRenderer(args.renderer,layout,args.skin)
+    pngWriter = PngWriter()
+    out = None
+    if args.raw:
+        out = sys.stdout.buffer if args.raw == '-' else open(args.raw,'wb')
+    nbFrames = 0
+    renderTime = 0.0
+    t0 = perf_counter()
+    for engine in frames:
+        t1 = perf_counter()
+        frame = renderer.render(engine)
+        renderTime += perf_counter() - t1
+        if args.png:
+            pngWriter.write(args.png % nbFrames,frame)
+        if out is not None:
+            out.write(frame.data)
+        nbFrames += 1
+        if args.frames is not None and nbFrames >= args.frames:
+            break
+    duration = perf_counter() - t0
+    if out is not None and out is not sys.stdout.buffer:
+        out.close()
+    print('{} frames {}x{} by the {} : {:.0f} frames/s rendered, {:.0f} frames/s written'.format(
+        nbFrames,renderer.width,renderer.height,type(renderer).__name__,nbFrames/max(renderTime,1e-9),
+        nbFrames/max(duration,1e-9)),file=sys.stderr)
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,148 @@
+"""  Timers of the game phases, off by default  """
+
+import json
+from array import array
+from time import perf_counter_ns
+
+# Samples kept for the recent percentiles, about 10 s of frames
+WINDOW_SIZE = 600
+# Buckets of the whole run histogram : bucket i counts the values below 2**i
+NB_BUCKETS = 48
+
+
+def percentile(sortedValues: list, p: float):
+    '''returns the p percentile of an already sorted list'''
+    if len(sortedValues)==0:
+        return 0
+    i = min(len(sortedValues)-1, int(p*len(sortedValues)))
+    return sortedValues[i]
+
+
+class Histogram:
+    '''Values of a phase : the last samples for the percentiles and
+    power of 2 buckets since the start for the comparison of builds'''
+
+    __slots__ = ('samples','iSample','nbSamples','buckets','total','maxValue')
+
+    def __init__(self, windowSize: int = WINDOW_SIZE):
+        self.samples = array('q',bytes(8*windowSize))
+        self.iSample = 0
+        self.nbSamples = 0
+        self.buckets = [0]*NB_BUCKETS
+        self.total = 0
+        self.maxValue = 0
+
+    def add(self, value: int):
+        self.samples[self.iSample] = value
+        self.iSample += 1
+        if self.iSample == len(self.samples):
+            self.iSample = 0
+        self.nbSamples += 1
+        self.buckets[min(value.bit_length(),NB_BUCKETS-1)] += 1
+        self.total += value
+        if value > self.maxValue:
+            self.maxValue = value
+
+    def recent(self)->list[int]:
+        '''the samples of the window, sorted'''
+        return sorted(self.samples[:min(self.nbSamples,len(self.samples))])
+
+    def last(self)->int:
+        return self.samples[self.iSample-1] if self.nbSamples>0 else 0
+
+    def summary(self)->dict:
+        recent = self.recent()
+        return {
+            'count': self.nbSamples,
+            'mean': self.total/max(1,self.nbSamples),
+            'max': self.maxValue,
+            'recent_p50': percentile(recent,0.50),
+            'recent_p90': percentile(recent,0.90),
+            'recent_p99': percentile(recent,0.99),
+            # Upper bound of the bucket : count
+            'buckets': {str(1<<i): n for i,n in enumerate(self.buckets) if n>0},
+        }
+
+
+class Profiler:
+    '''Times methods of the game objects with perf_counter_ns
+
+    watch() registers the methods, they are only replaced by a timed
+    wrapper while the profiler is enabled, the game runs at full speed
+    otherwise. The wrapper is set on the instance, so the calls made
+    through self (engine.tick calling self.moveDown...) are timed too.
+    Nested phases are not subtracted : fall includes freeze.
+    '''
+
+    def __init__(self, windowSize: int = WINDOW_SIZE):
+        self.windowSize = windowSize
+        self.fEnabled = False
+        # Durations in ns and other values per frame (draw calls...)
+        self.timings = {}
+        self.counts = {}
+        self.watched = []
+
+    def timing(self, name: str)->Histogram:
+        hist = self.timings.get(name)
+        if hist is None:
+            hist = self.timings[name] = Histogram(self.windowSize)
+        return hist
+
+    def count(self, name: str, value: int):
+        hist = self.counts.get(name)
+        if hist is None:
+            hist = self.counts[name] = Histogram(self.windowSize)
+        hist.add(value)
+
+    def watch(self, obj, methodName: str, name: str):
+        '''time obj.methodName as the phase name while enabled'''
+        self.watched.append((obj,methodName,name))
+        if self.fEnabled:
+            self.wrap(obj,methodName,name)
+
+    def wrap(self, obj, methodName: str, name: str):
+        method = getattr(obj,methodName)
+        hist = self.timing(name)
+        def timed(*args, **kwargs):
+            t0 = perf_counter_ns()
+            try:
+                return method(*args,**kwargs)
+            finally:
+                hist.add(perf_counter_ns()-t0)
+        setattr(obj,methodName,timed)
+
+    def setEnabled(self, fEnabled: bool):
+        if fEnabled == self.fEnabled:
+            return
+        self.fEnabled = fEnabled
+        for obj,methodName,name in self.watched:
+            if fEnabled:
+                self.wrap(obj,methodName,name)
+            else:
+                # Back to the method of the class
+                delattr(obj,methodName)
+
+    def watchEngine(self, engine):
+        self.watch(engine,'tick','tick')
+        self.watch(engine,'applyPendingCommands','input')
+        self.watch(engine,'moveHorizontal','hmove')
+        self.watch(engine,'moveDown','fall')
+        self.watch(engine,'spawnTetromino','freeze')
+        self.watch(engine,'eraseFirstCompletedLine','erase')
+
+    def isEmpty(self)->bool:
+        return len(self.timings)==0 and len(self.counts)==0
+
+    def summary(self)->dict:
+        return {
+            'timings_ns': {name: hist.summary() for name,hist in self.timings.items()},
+            'counts': {name: hist.summary() for name,hist in self.counts.items()},
+        }
+
+    def dump(self, filename: str, info: dict = None):
+        '''write the histograms as JSON, info describes the build or machine'''
+        data = self.summary()
+        if info is not None:
+            data['info'] = info
+        with open(filename,'w',encoding="utf-8") as f:
+            json.dump(data,f,indent=2)
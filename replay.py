@@ -0,0 +1,170 @@
+"""  Compact binary replays of a game  """
+
+import argparse
+import struct
+from time import perf_counter
+from engine import Engine, Command, Handling, TICK_DT, NB_COLUMNS, NB_ROWS
+
+# Header : magic, version, seed, number of ticks and final score of the game,
+# then the board size since the version 2, the version 1 replays are classic
+# games, then the handling flag, DAS, ARR and lock delay since the version 3
+# and the SRS kicks flag since the version 4, of the handling games only in
+# the version 4
+MAGIC = b'TTRP'
+VERSION = 5
+HEADER_V1 = struct.Struct('<4sBQII')
+HEADER_V2 = struct.Struct('<4sBQIIHH')
+HEADER_V3 = struct.Struct('<4sBQIIHH?HHH')
+HEADER = struct.Struct('<4sBQIIHH?HHH?')
+
+
+class ReplayRecorder:
+    '''Records the commands applied by an engine
+
+    Each command is stored as the varint delta of its tick with the
+    previous command followed by one byte holding the Command value.
+    '''
+
+    def __init__(self, seed: int, nbColumns: int = NB_COLUMNS, nbRows: int = NB_ROWS, handling: Handling = None,
+                 kicks: bool = False):
+        self.seed = seed
+        self.nbColumns = nbColumns
+        self.nbRows = nbRows
+        self.handling = handling
+        self.kicks = kicks
+        self.lastTick = 0
+        self.data = bytearray()
+
+    def record(self, tick: int, command: Command):
+        delta = tick - self.lastTick
+        self.lastTick = tick
+        # Unsigned LEB128
+        while delta >= 0x80:
+            self.data.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        self.data.append(delta)
+        self.data.append(command)
+
+    def toBytes(self, nbTicks: int, score: int)->bytes:
+        handling = self.handling if self.handling is not None else Handling()
+        return HEADER.pack(MAGIC,VERSION,self.seed,nbTicks,score,self.nbColumns,self.nbRows,
+                           self.handling is not None,*handling,self.kicks) + bytes(self.data)
+
+
+class Replay:
+    '''Decoded replay : the seed, the board size, the handling, the kicks, the (tick, command) pairs and the recorded result'''
+
+    def __init__(self, data: bytes):
+        magic,version,self.seed,self.nbTicks,self.score = HEADER_V1.unpack_from(data)
+        if magic != MAGIC or version not in (1,2,3,4,VERSION):
+            raise ValueError('not a replay file (version {})'.format(VERSION))
+        self.handling = None
+        self.kicks = False
+        if version == 1:
+            self.nbColumns,self.nbRows = NB_COLUMNS,NB_ROWS
+            i = HEADER_V1.size
+        elif version == 2:
+            self.nbColumns,self.nbRows = HEADER_V2.unpack_from(data)[5:]
+            i = HEADER_V2.size
+        elif version == 3:
+            # Rotations without the kicks
+            self.nbColumns,self.nbRows,fHandling,*handling = HEADER_V3.unpack_from(data)[5:]
+            if fHandling:
+                self.handling = Handling(*handling)
+            i = HEADER_V3.size
+        else:
+            self.nbColumns,self.nbRows,fHandling,*handling,kicks = HEADER.unpack_from(data)[5:]
+            if fHandling:
+                self.handling = Handling(*handling)
+            # The version 4 classic games were written with a kicks flag they did not use
+            self.kicks = kicks and (fHandling or version>4)
+            i = HEADER.size
+        self.commands = []
+        tick = 0
+        while i < len(data):
+            delta = 0
+            shift = 0
+            while True:
+                b = data[i]
+                i += 1
+                delta |= (b & 0x7F) << shift
+                shift += 7
+                if b < 0x80:
+                    break
+            tick += delta
+            self.commands.append((tick,Command(data[i])))
+            i += 1
+
+    @staticmethod
+    def load(filename: str)->'Replay':
+        with open(filename,'rb') as f:
+            return Replay(f.read())
+
+    def play(self, engine: Engine = None)->Engine:
+        '''re-simulate the game tick by tick without rendering, as fast as possible'''
+        if engine is None:
+            engine = Engine(self.seed,nbColumns=self.nbColumns,nbRows=self.nbRows,handling=self.handling,
+                            kicks=self.kicks)
+        elif (engine.nbColumns,engine.nbRows,engine.handling,engine.fKicks) != (self.nbColumns,self.nbRows,
+                                                                              self.handling,self.kicks):
+            raise ValueError('the replay board is {}x{} with the handling {} and kicks {}'.format(
+                             self.nbColumns,self.nbRows,self.handling,self.kicks))
+        else:
+            engine.newGame(self.seed)
+        pending = engine.pendingCommands
+        for tick,command in self.commands:
+            while engine.nbTicks < tick and not engine.fEnded:
+                engine.tick()
+            pending.append(command)
+        while engine.nbTicks < self.nbTicks and not engine.fEnded:
+            engine.tick()
+        return engine
+
+    def frames(self, every: int = 1, engine: Engine = None):
+        '''re-simulate the game, yields the engine every `every` ticks and at its end'''
+        if engine is None:
+            engine = Engine(self.seed,nbColumns=self.nbColumns,nbRows=self.nbRows,handling=self.handling,
+                            kicks=self.kicks)
+        else:
+            engine.newGame(self.seed)
+        commands = iter(self.commands)
+        tick,command = next(commands,(None,None))
+        while engine.nbTicks < self.nbTicks and not engine.fEnded:
+            while tick is not None and tick <= engine.nbTicks:
+                engine.pendingCommands.append(command)
+                tick,command = next(commands,(None,None))
+            engine.tick()
+            if engine.nbTicks % every == 0:
+                yield engine
+        if engine.nbTicks % every != 0:
+            yield engine
+
+    def verify(self)->bool:
+        '''True if the re-simulated game reaches the recorded score'''
+        return self.play().score == self.score
+
+
+def saveReplay(filename: str, engine: Engine, recorder: ReplayRecorder):
+    with open(filename,'wb') as f:
+        f.write(recorder.toBytes(engine.nbTicks,engine.score))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-simulate Tetris replays and check their scores')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+    fFailed = False
+    for filename in args.files:
+        replay = Replay.load(filename)
+        t0 = perf_counter()
+        engine = replay.play()
+        duration = perf_counter() - t0
+        fOk = engine.score == replay.score
+        fFailed = fFailed or not fOk
+        print('{} : seed {:016x} board {}x{} ticks {} score {} recorded {} {} ({:.0f} ticks/s, {:.0f}x real time)'.format(
+            filename,replay.seed,replay.nbColumns,replay.nbRows,engine.nbTicks,engine.score,replay.score,'OK' if fOk else 'MISMATCH',
+            engine.nbTicks/max(duration,1e-9),engine.nbTicks*TICK_DT/max(duration,1e-9)))
+    raise SystemExit(1 if fFailed else 0)
+
+if __name__ == "__main__" :
+    main()
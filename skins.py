@@ -0,0 +1,196 @@
+"""  Block skins packed in one texture atlas  """
+
+import pyglet
+from pyglet.gl import (glActiveTexture, glBindTexture, glBlendFunc, glEnable, glDisable, GL_TEXTURE0,
+                       GL_BLEND, GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, GL_NEAREST)
+from pyglet.sprite import Sprite, SpriteGroup, get_default_shader
+from engine import Tetromino
+from layout import BOARD_COLOR, GHOST_COLOR
+
+# Tiles of a skin : the board background, the 8 cell types then the ghost
+BOARD_TILE = 0
+GHOST_TILE = 9
+NB_TILES = 10
+
+
+def mix(color: tuple, target: tuple, f: float)->tuple:
+    '''color moved by f towards target, alpha unchanged'''
+    return tuple(round(c + (t-c)*f) for c,t in zip(color[:3],target)) + (color[3],)
+
+def shade(color: tuple, f: float)->tuple:
+    '''color multiplied by f, clamped'''
+    return tuple(min(255,round(c*f)) for c in color[:3]) + (color[3],)
+
+def paintFlat(color: tuple, size: int, kind: int)->bytes:
+    return bytes(color)*(size*size)
+
+def paintBevel(color: tuple, size: int, kind: int)->bytes:
+    '''lit top and left edges, shaded bottom and right edges'''
+    if kind in (BOARD_TILE,GHOST_TILE):
+        return paintFlat(color,size,kind)
+    b = max(1,size//8)
+    light = bytes(mix(color,(255,255,255),0.45))
+    dark = bytes(shade(color,0.55))
+    base = bytes(color)
+    rows = []
+    # The rows of the image go up from the bottom
+    for y in range(size):
+        row = bytearray()
+        for x in range(size):
+            dLight = min(x,size-1-y)
+            dDark = min(size-1-x,y)
+            if dLight<b and dLight<=dDark:
+                row += light
+            elif dDark<b:
+                row += dark
+            else:
+                row += base
+        rows.append(bytes(row))
+    return b''.join(rows)
+
+def paintGlossy(color: tuple, size: int, kind: int)->bytes:
+    '''vertical gradient with a highlight on the upper third and a dark outline'''
+    if kind == GHOST_TILE:
+        return paintFlat(color,size,kind)
+    if kind == BOARD_TILE:
+        # Darker at the bottom of the board, the tile is stretched over it
+        return b''.join(bytes(mix(color,(0,0,0),0.5 - 0.5*y/max(1,size-1)))*size for y in range(size))
+    outline = bytes(shade(color,0.45))
+    rows = []
+    for y in range(size):
+        f = 0.75 + 0.4*y/max(1,size-1)
+        line = shade(color,f)
+        if y >= size*2//3:
+            line = mix(line,(255,255,255),0.3)
+        if y == 0 or y == size-1:
+            rows.append(outline*size)
+        else:
+            rows.append(outline + bytes(line)*(size-2) + outline if size>2 else outline*size)
+    return b''.join(rows)
+
+# Skins drawn at the size of the cells, flat is the look of the original game
+SKINS = {
+    'flat': paintFlat,
+    'bevel': paintBevel,
+    'glossy': paintGlossy,
+}
+
+def tileColor(kind: int)->tuple:
+    if kind == BOARD_TILE:
+        return BOARD_COLOR
+    if kind == GHOST_TILE:
+        return GHOST_COLOR
+    return Tetromino.colorsTable[kind]
+
+
+class AtlasGroup(pyglet.graphics.Group):
+    '''Binds the atlas texture and the sprite shader once for all the blocks drawn under it'''
+
+    def __init__(self, texture, program, order: int = 0):
+        super().__init__(order=order)
+        self.texture = texture
+        self.program = program
+
+    def set_state(self):
+        self.program.use()
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(self.texture.target,self.texture.id)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA,GL_ONE_MINUS_SRC_ALPHA)
+
+    def unset_state(self):
+        glDisable(GL_BLEND)
+        self.program.stop()
+
+
+class BlockGroup(SpriteGroup):
+    '''Sprite group of a layer, its state is set by the AtlasGroup above it'''
+
+    def set_state(self):
+        pass
+
+    def unset_state(self):
+        pass
+
+
+class BlockSprite(Sprite):
+    '''Sprite of a tile of the atlas drawn under an AtlasGroup, kind is the tile shown'''
+    group_class = BlockGroup
+    kind = 0
+
+    def setTile(self, kind: int, tile):
+        '''show another tile of the atlas, only the texture coordinates are written'''
+        fResized = tile.width != self._texture.width
+        self.kind = kind
+        self._texture = tile
+        self._vertex_list.tex_coords[:] = tile.tex_coords
+        if fResized:
+            self._update_position()
+
+
+class SkinAtlas:
+    '''The tiles of all the skins in one texture
+
+    Each skin is a row of NB_TILES tiles. The built-in skins are painted
+    at the size of the blocks, a PNG skin is a row of NB_TILES square
+    tiles of any size and its sprites are scaled. All the tiles are
+    regions of the same texture : a skin change only sets the texture
+    coordinates and the scale of the sprites, nothing is allocated.
+    '''
+
+    def __init__(self, blockSize: int, files: list[str] = ()):
+        self.blockSize = blockSize
+        self.names = list(SKINS)
+        images = [(blockSize,b''.join(paint(tileColor(kind),blockSize,kind) for kind in range(NB_TILES)),True)
+                  for paint in SKINS.values()]
+        for filename in files:
+            image = pyglet.image.load(filename).get_image_data()
+            size = image.height
+            if image.width < size*NB_TILES:
+                raise ValueError('{} : a skin is a row of {} square tiles'.format(filename,NB_TILES))
+            self.names.append(filename)
+            images.append((size,image,False))
+        width = max(size*NB_TILES for size,_,_ in images)
+        height = sum(size for size,_,_ in images)
+        self.texture = pyglet.image.Texture.create(width,height,min_filter=GL_NEAREST,mag_filter=GL_NEAREST)
+        self.skins = []
+        self.scales = []
+        y = 0
+        for size,data,fPainted in images:
+            if fPainted:
+                # The painted tiles are side by side, copy them row by row of the atlas
+                row = bytearray()
+                tileRow = size*4
+                for iy in range(size):
+                    for kind in range(NB_TILES):
+                        i = (kind*size + iy)*tileRow
+                        row += data[i:i+tileRow]
+                data = pyglet.image.ImageData(size*NB_TILES,size,'RGBA',bytes(row))
+            self.texture.blit_into(data,0,y,0)
+            self.skins.append([self.texture.get_region(kind*size,y,size,size) for kind in range(NB_TILES)])
+            self.scales.append(blockSize/size)
+            y += size
+        self.group = AtlasGroup(self.texture,get_default_shader())
+        self.iSkin = 0
+        self.tiles = self.skins[0]
+        self.scale = self.scales[0]
+
+    def setSkin(self, iSkin: int):
+        self.iSkin = iSkin % len(self.skins)
+        self.tiles = self.skins[self.iSkin]
+        self.scale = self.scales[self.iSkin]
+
+    def nextSkin(self):
+        self.setSkin(self.iSkin+1)
+
+    @property
+    def name(self)->str:
+        return self.names[self.iSkin]
+
+    def sprite(self, kind: int, x: float, y: float, batch: pyglet.graphics.Batch,
+               layer: pyglet.graphics.Group)->BlockSprite:
+        '''sprite of a tile drawn in a layer, the layers are children of self.group'''
+        sprite = BlockSprite(self.tiles[kind],x,y,batch=batch,group=layer)
+        sprite.kind = kind
+        sprite.scale = self.scale
+        return sprite
@@ -0,0 +1,6 @@
+"""  The modules of the game are at the root of the repository  """
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,13 @@
+"""  Steady state allocations of the engine  """
+
+import pytest
+from bench import retained_allocations, MAX_TRANSIENT_BYTES
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_no_memory_retained_per_frame(seed):
+    results = retained_allocations(seed, 5000)
+    assert results['retained_blocks'] == 0, results['top']
+    assert results['retained_bytes'] == 0, results['top']
+    # The temporary int objects of a frame, a tetromino allocated per spawn does not fit
+    assert results['max_transient_bytes_per_frame'] <= MAX_TRANSIENT_BYTES
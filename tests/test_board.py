@@ -0,0 +1,108 @@
+"""  Incremental index of the BitBoard against a recount of its cells  """
+
+import random
+import pytest
+from board import BitBoard
+
+
+def checkIndex(board: BitBoard):
+    nbColumns,nbRows = board.nbColumns,board.nbRows
+    filled = [[board[x+y*nbColumns] != 0 for x in range(nbColumns)] for y in range(nbRows)]
+    heights = [max((y+1 for y in range(nbRows) if filled[y][x]),default=0) for x in range(nbColumns)]
+    assert board.rows == [sum(1<<x for x in range(nbColumns) if filled[y][x]) for y in range(nbRows)]
+    assert board.rowCounts == [sum(row) for row in filled]
+    assert board.heights == heights
+    assert board.nbFullRows == sum(all(row) for row in filled)
+    assert board.nbBlocks == sum(map(sum,filled))
+    assert board.nbHoles == sum(heights) - board.nbBlocks
+
+
+class RowsBoard:
+    '''Reference board as a list of rows, the erased rows leave empty rows on top'''
+
+    def __init__(self, nbColumns: int, nbRows: int):
+        self.nbColumns = nbColumns
+        self.rows = [[0]*nbColumns for y in range(nbRows)]
+
+    def cells(self)->list:
+        return [typ for row in self.rows for typ in row]
+
+    def set(self, i: int, typ: int):
+        y,x = divmod(i,self.nbColumns)
+        self.rows[y][x] = typ
+
+    def eraseLines(self, nbMax: int)->int:
+        full = [y for y,row in enumerate(self.rows) if all(row)][:nbMax]
+        for y in reversed(full):
+            del self.rows[y]
+            self.rows.append([0]*self.nbColumns)
+        return len(full)
+
+    def insertGarbage(self, nbLines: int, hole: int, typ: int)->int:
+        nbRows = len(self.rows)
+        nbLost = sum(cell != 0 for row in self.rows[nbRows-nbLines:] for cell in row)
+        garbage = [[typ if x != hole else 0 for x in range(self.nbColumns)] for y in range(nbLines)]
+        self.rows = (garbage + self.rows)[:nbRows]
+        return nbLost
+
+
+@pytest.mark.parametrize('nbColumns,nbRows', [(10, 20), (4, 6), (70, 12)])
+def test_index_follows_the_changes(nbColumns, nbRows):
+    rng = random.Random(nbColumns*nbRows)
+    board = BitBoard(nbColumns,nbRows)
+    reference = RowsBoard(nbColumns,nbRows)
+    for step in range(600):
+        action = rng.random()
+        if action < 0.7:
+            i = rng.randrange(len(board))
+            typ = rng.choice((0,0,1,2,7))
+            board[i] = typ
+            reference.set(i,typ)
+        elif action < 0.8:
+            # A full row
+            y = rng.randrange(nbRows)
+            for x in range(nbColumns):
+                board[x+y*nbColumns] = 3
+                reference.set(x+y*nbColumns,3)
+        elif action < 0.85:
+            board.eraseFirstCompletedLine()
+            reference.eraseLines(1)
+        elif action < 0.9:
+            assert board.eraseCompletedLines() == reference.eraseLines(nbRows)
+        elif action < 0.97:
+            nbLines,hole = rng.randint(1,3),rng.randrange(nbColumns)
+            assert board.insertGarbage(nbLines,hole,8) == reference.insertGarbage(nbLines,hole,8)
+        else:
+            board.reset()
+            reference = RowsBoard(nbColumns,nbRows)
+        assert list(board) == reference.cells()
+        checkIndex(board)
+
+
+def test_snapshot_restore_lower_and_higher_tops():
+    rng = random.Random(5)
+    board = BitBoard(10,20)
+    for i in range(60):
+        board[rng.randrange(80)] = rng.randint(1,7)
+    state = board.snapshot()
+    cells = list(board)
+    # A higher stack then a lower one, the rows above the snapshot top are cleared
+    for i in range(150):
+        board[rng.randrange(200)] = rng.randint(1,7)
+    board.restore(state)
+    assert list(board) == cells
+    checkIndex(board)
+    board.reset()
+    board.restore(state)
+    assert list(board) == cells
+    checkIndex(board)
+
+
+def test_row_versions_mark_the_changed_rows():
+    board = BitBoard(10,20)
+    version = board.version
+    board[3+2*10] = 1
+    assert [y for y in range(20) if board.rowVersions[y] > version] == [2]
+    version = board.version
+    board.insertGarbage(1,0,8)
+    assert [y for y in range(20) if board.rowVersions[y] > version] == [0,1,2,3]
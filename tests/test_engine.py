@@ -0,0 +1,189 @@
+"""  SRS kicks, snapshots and random games of the engine  """
+
+import random
+import pytest
+from board import BitBoard, ListBoard
+from engine import (Engine, Command, Handling, SnapshotRing, Tetromino, GridTetromino, TetrominoShape, CELL_SIZE,
+                    fits, kicksTable, rotationsTable)
+from replay import ReplayRecorder, Replay
+
+COMMANDS = (Command.MoveLeft,Command.MoveRight,Command.StopMove,Command.Rotate,Command.Rotate,Command.Drop,
+            Command.HardDrop)
+MODES = {
+    'classic': {},
+    'kicks': {'kicks': True},
+    'handling': {'handling': Handling()},
+    'handling_kicks': {'handling': Handling(), 'kicks': True},
+}
+
+
+def playRandom(engine: Engine, rng: random.Random, nbTicks: int, check = None):
+    '''random key presses, check(engine) after each tick'''
+    while engine.nbTicks < nbTicks and not engine.fEnded:
+        if rng.random() < 0.1:
+            engine.pendingCommands.append(rng.choice(COMMANDS))
+        engine.tick()
+        if check is not None:
+            check(engine)
+
+
+def checkInvariants(engine: Engine):
+    board = engine.board
+    heights = [max((y+1 for y in range(board.nbRows) if board[x+y*board.nbColumns]),default=0)
+               for x in range(board.nbColumns)]
+    assert board.heights == heights
+    assert board.nbBlocks == sum(1 for typ in board if typ != 0)
+    tetro = engine.curTetromino
+    if engine.fGameOver or engine.nbCompletedLines>0 or engine.handling is None or tetro.y == engine.spawnY:
+        return
+    # The guideline moves keep the tetromino on the cells
+    assert tetro.x % CELL_SIZE == 0
+    # The kicks never turn it into the stack or the floor, the classic rotation only checks the stack
+    assert not engine.fKicks or fits(board,tetro.pieceShape,tetro.rot,tetro.x//CELL_SIZE,-(-tetro.y//CELL_SIZE))
+
+
+def test_kicks_of_the_srs_tables():
+    # SRS state 0 to L, y up
+    assert kicksTable[TetrominoShape.TShape][0] == ((0,0),(1,0),(1,1),(0,-2),(1,-2))
+    assert kicksTable[TetrominoShape.LineShape][0] == ((0,0),(-1,0),(2,0),(-1,2),(2,-1))
+    assert all(kicks == ((0,0),) for kicks in kicksTable[TetrominoShape.SquareShape])
+    for shape in (TetrominoShape.ZShape,TetrominoShape.SShape,TetrominoShape.LShape,TetrominoShape.MirroredLShape):
+        assert kicksTable[shape] == kicksTable[TetrominoShape.TShape]
+    # SRS state L to 2
+    assert kicksTable[TetrominoShape.TShape][1] == ((0,0),(-1,0),(-1,-1),(0,2),(-1,2))
+
+
+def placeTetromino(engine: Engine, shape: int, rot: int, ix: int, iy: int):
+    tetro = engine.curTetromino
+    tetro.setShape(shape)
+    tetro.setRotation(rot)
+    tetro.x,tetro.y = ix*CELL_SIZE,iy*CELL_SIZE
+
+
+def test_kick_off_the_wall():
+    engine = Engine(1,kicks=True)
+    # Vertical I against the left wall, the horizontal one does not fit in place
+    rot = next(r for r in range(4) if rotationsTable[TetrominoShape.LineShape][r].minX == 0
+               and rotationsTable[TetrominoShape.LineShape][r].maxX == 0)
+    placeTetromino(engine,TetrominoShape.LineShape,rot,0,5)
+    nextRot = (rot+1) & 3
+    assert not fits(engine.board,TetrominoShape.LineShape,nextRot,0,5)
+    assert engine.kickTetromino()
+    tetro = engine.curTetromino
+    assert tetro.rot == nextRot
+    assert fits(engine.board,tetro.pieceShape,tetro.rot,tetro.x//CELL_SIZE,tetro.y//CELL_SIZE)
+
+
+def test_square_turns_in_place():
+    engine = Engine(1,kicks=True)
+    placeTetromino(engine,TetrominoShape.SquareShape,0,4,10)
+    assert engine.kickTetromino()
+    assert (engine.curTetromino.x,engine.curTetromino.y) == (4*CELL_SIZE,10*CELL_SIZE)
+
+
+def test_kicked_rotations_fit_on_random_stacks():
+    rng = random.Random(3)
+    engine = Engine(3,kicks=True)
+    board = engine.board
+    nbKicked = 0
+    for _ in range(2000):
+        board.reset()
+        for x in range(board.nbColumns):
+            for y in range(rng.randint(0,8)):
+                if rng.random() < 0.85:
+                    board[x+y*board.nbColumns] = 1
+        shape,rot = rng.randint(1,7),rng.randint(0,3)
+        ix,iy = rng.randrange(board.nbColumns),rng.randint(0,10)
+        if not fits(board,shape,rot,ix,iy):
+            continue
+        placeTetromino(engine,shape,rot,ix,iy)
+        tetro = engine.curTetromino
+        if engine.kickTetromino():
+            assert tetro.rot == (rot+1) & 3
+            dx,dy = tetro.x//CELL_SIZE-ix,tetro.y//CELL_SIZE-iy
+            assert (dx,dy) in kicksTable[shape][rot]
+            assert fits(board,shape,tetro.rot,ix+dx,iy+dy)
+            nbKicked += (dx,dy) != (0,0)
+        else:
+            assert (tetro.rot,tetro.x,tetro.y) == (rot,ix*CELL_SIZE,iy*CELL_SIZE)
+    assert nbKicked > 0
+
+
+@pytest.mark.parametrize('mode', sorted(MODES))
+def test_random_games_keep_the_invariants_and_replay(mode):
+    for seed in range(4):
+        engine = Engine(seed,**MODES[mode])
+        recorder = ReplayRecorder(seed,engine.nbColumns,engine.nbRows,engine.handling,engine.fKicks)
+        engine.recorder = recorder
+        playRandom(engine,random.Random(seed),20000,checkInvariants)
+        replay = Replay(recorder.toBytes(engine.nbTicks,engine.score))
+        replayed = replay.play()
+        assert (replayed.score,replayed.nbPieces,list(replayed.board)) == (engine.score,engine.nbPieces,list(engine.board))
+
+
+@pytest.mark.parametrize('boardClass,tetrominoClass', [(ListBoard, Tetromino), (BitBoard, GridTetromino)])
+def test_hard_drop_lands_where_the_tetromino_falls(boardClass, tetrominoClass):
+    nbChecked = 0
+    for seed in range(10):
+        engine,probe = (Engine(seed,boardClass=boardClass,fAnimateErase=False,tetrominoClass=tetrominoClass)
+                        for _ in range(2))
+        rng = random.Random(seed)
+        while engine.nbTicks < 3000 and not engine.fEnded:
+            if rng.random() < 0.1:
+                engine.pendingCommands.append(rng.choice(COMMANDS))
+            engine.tick()
+            # A held key keeps the tetromino sliding on the floor
+            if engine.curTetromino.x % CELL_SIZE != 0 or engine.nbCompletedLines>0 or rng.random() >= 0.05:
+                continue
+            state = engine.snapshot()
+            probe.restore(state)
+            probe.pendingCommands.extend((Command.StopMove,Command.HardDrop))
+            probe.tick()
+            dropped = list(probe.board)
+            # The same tetromino falls pixel by pixel once the key is released
+            probe.restore(state)
+            probe.pendingCommands.append(Command.StopMove)
+            while probe.nbPieces == engine.nbPieces and not probe.fGameOver:
+                probe.tick()
+            # Unless the fall also locked the next tetromino at the top in the same tick
+            if not probe.fGameOver:
+                assert list(probe.board) == dropped
+                nbChecked += 1
+    assert nbChecked > 100
+
+
+@pytest.mark.parametrize('mode', sorted(MODES))
+def test_restore_runs_the_same_ticks(mode):
+    engine = Engine(11,**MODES[mode])
+    rng = random.Random(11)
+    playRandom(engine,rng,1500)
+    state = engine.snapshot()
+    commands = []
+    while engine.nbTicks < 3000 and not engine.fEnded:
+        if rng.random() < 0.1:
+            command = rng.choice(COMMANDS)
+            commands.append((engine.nbTicks,command))
+            engine.pendingCommands.append(command)
+        engine.tick()
+    end = (engine.nbTicks,engine.score,engine.nbPieces,bytes(engine.board),engine.curTetromino.snapshot())
+    engine.restore(state)
+    for tick,command in commands:
+        while engine.nbTicks < tick:
+            engine.tick()
+        engine.pendingCommands.append(command)
+    while engine.nbTicks < end[0]:
+        engine.tick()
+    assert (engine.nbTicks,engine.score,engine.nbPieces,bytes(engine.board),engine.curTetromino.snapshot()) == end
+
+
+def test_snapshot_ring():
+    ring = SnapshotRing(4)
+    for tick in range(6):
+        ring.push(tick,'state{}'.format(tick))
+    assert (len(ring),ring.oldestTick(),ring.get(1),ring.get(3)) == (4,2,None,'state3')
+    assert ring.rewind(3) == 'state3'
+    assert (len(ring),ring.get(5)) == (2,None)
+    # The slots before and after the wrap are released
+    ring.clear()
+    assert (len(ring),ring.oldestTick()) == (0,-1)
+    assert ring.states == [None]*4
@@ -0,0 +1,71 @@
+"""  High scores file : parser, legacy format and saves  """
+
+from highscores import HighScoreStore, HighScoreTable, CLASSIC_BOARD, HEADER
+
+
+def writeFile(path, text: str):
+    path.write_text(text,encoding='utf-8')
+    return str(path)
+
+
+def entries(table: HighScoreTable)->list:
+    return [(hs.name,hs.score) for hs in table.entries]
+
+
+def test_parse_boards(tmp_path):
+    filename = writeFile(tmp_path / 'hs.txt',HEADER + 'classic;300;Ann\n'
+                         'classic;900;Bob;the;builder\n'
+                         '\n'
+                         '# comment\n'
+                         'versus;50;Cyd\n'
+                         'classic;many;Bad\n'
+                         'bad line\n'
+                         'classic;600;Dee\n')
+    store = HighScoreStore(filename)
+    store.load()
+    assert entries(store.board()) == [('Bob;the;builder',900),('Dee',600),('Ann',300)]
+    assert entries(store.board('versus')) == [('Cyd',50)]
+    assert len(store.board('empty')) == 0
+
+
+def test_legacy_file_is_the_classic_board(tmp_path):
+    filename = writeFile(tmp_path / 'hs.txt','Ann;300\nB;o;b;900\n')
+    store = HighScoreStore(filename)
+    store.load()
+    assert entries(store.board(CLASSIC_BOARD)) == [('B;o;b',900),('Ann',300)]
+
+
+def test_capacity_and_ties(tmp_path):
+    filename = writeFile(tmp_path / 'hs.txt',HEADER + ''.join('classic;{};P{}\n'.format(s,s) for s in range(1,16)))
+    store = HighScoreStore(filename,capacity=10)
+    store.load()
+    table = store.board()
+    assert [hs.score for hs in table.entries] == list(range(15,5,-1))
+    assert not table.isHighScore(6)
+    # A new score goes after the equal ones
+    assert table.insert('New',10) == 6
+    assert table[5].name == 'P10'
+    assert table.insert('Zero',0) == -1
+
+
+def test_save_round_trip_keeps_the_unused_boards(tmp_path):
+    filename = writeFile(tmp_path / 'hs.txt',HEADER + 'classic;300;Ann\nother;40;Eve\n')
+    store = HighScoreStore(filename)
+    store.load()
+    i = store.board().insert('Line\nbreak',500)
+    store.board().setName(i,'Max')
+    store.save()
+    assert not (tmp_path / 'hs.txt.tmp').exists()
+    store = HighScoreStore(filename)
+    store.load()
+    assert entries(store.board()) == [('Max',500),('Ann',300)]
+    assert entries(store.board('other')) == [('Eve',40)]
+
+
+def test_missing_file(tmp_path):
+    store = HighScoreStore(str(tmp_path / 'none.txt'))
+    store.load()
+    assert len(store.board()) == 0
+    # Nothing changed, nothing is written
+    store.save()
+    assert not (tmp_path / 'none.txt').exists()
@@ -0,0 +1,91 @@
+"""  Rollback of the network sessions, without sockets  """
+
+import random
+from engine import Command, TICK_DT
+from netplay import NetSession, encodeInputs, decodeInputs, stateHash, MSG_INPUTS, HASH_INTERVAL
+from versus import Versus
+
+COMMANDS = (Command.MoveLeft,Command.MoveRight,Command.StopMove,Command.Rotate,Command.Drop)
+
+
+class LoopbackClient:
+    '''NetClient stand-in : the messages sent reach the other clients delay polls later'''
+
+    def __init__(self, network: list, delay: int = 0):
+        self.network = network
+        self.delay = delay
+        self.sent = []
+        # [polls left, message]
+        self.inbox = []
+        network.append(self)
+
+    def send(self, msg: bytes):
+        self.sent.append(msg)
+        for client in self.network:
+            if client is not self:
+                client.inbox.append([client.delay,msg])
+
+    def poll(self)->list[bytes]:
+        messages = [msg for polls,msg in self.inbox if polls <= 0]
+        self.inbox = [[polls-1,msg] for polls,msg in self.inbox if polls > 0]
+        return messages
+
+
+def sentCommands(client: LoopbackClient)->list[tuple]:
+    '''the local commands of each tick sent by a session'''
+    ticks = []
+    for msg in client.sent:
+        if msg[0] == MSG_INPUTS:
+            _,firstTick,commands = decodeInputs(msg)
+            assert firstTick == len(ticks)
+            ticks.extend(commands)
+    return ticks
+
+
+def test_rollback_reaches_the_state_of_the_right_commands():
+    client = LoopbackClient([])
+    session = NetSession(client,Versus(2),seed=5,player=0,inputDelay=2,maxPrediction=8)
+    for frame in range(6):
+        session.advance(TICK_DT,[Command.Rotate] if frame == 1 else [])
+    assert session.nbTicks == 6 and session.confirmedTick == 0
+    # The other player moved at tick 2, the prediction of no command was wrong
+    remote = [(),(),(Command.MoveLeft,),(),(Command.Rotate,),(),(),()]
+    client.inbox.append([0,encodeInputs(1,0,remote)])
+    session.advance(TICK_DT)
+    assert session.nbRollbacks == 1
+    local = sentCommands(client)
+    reference = Versus(2)
+    reference.newGame(5)
+    for t in range(session.nbTicks):
+        reference.tick([local[t],remote[t] if t < len(remote) else ()])
+    assert stateHash(reference) == stateHash(session.versus)
+    assert [e.curTetromino.snapshot() for e in reference.engines] == \
+           [e.curTetromino.snapshot() for e in session.versus.engines]
+    # The ticks run are all confirmed
+    assert session.confirmedTick == session.nbTicks
+
+
+def test_sessions_agree_through_a_slow_network():
+    network = []
+    clients = [LoopbackClient(network,delay=5),LoopbackClient(network,delay=7)]
+    sessions = [NetSession(client,Versus(2),seed=9,player=i,inputDelay=1,maxPrediction=12)
+                for i,client in enumerate(clients)]
+    rng = random.Random(9)
+    for frame in range(1500):
+        for session in sessions:
+            commands = [rng.choice(COMMANDS)] if rng.random() < 0.1 else []
+            session.advance(1/60,commands)
+    for session in sessions:
+        assert session.nbRollbacks > 0
+        assert session.nbTicks > 10*HASH_INTERVAL
+        assert session.nbHashesChecked > 0
+        assert session.nbDesyncs == 0
+    # The last state hashed by both sides is the one of a game run straight with the commands sent
+    hashed = max(set(sessions[0].localHashes) & set(sessions[1].localHashes))
+    ticks = [sentCommands(client) for client in clients]
+    assert ticks[0][:hashed] != ticks[1][:hashed]
+    reference = Versus(2)
+    reference.newGame(9)
+    for t in range(hashed):
+        reference.tick([ticks[0][t],ticks[1][t]])
+    assert sessions[0].localHashes[hashed] == sessions[1].localHashes[hashed] == stateHash(reference)
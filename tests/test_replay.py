@@ -0,0 +1,70 @@
+"""  Encoding of the replays and the files of the older versions  """
+
+import random
+import pytest
+from engine import Engine, Command, Handling
+from replay import (ReplayRecorder, Replay, saveReplay, HEADER, HEADER_V1, HEADER_V2, HEADER_V3, MAGIC,
+                    VERSION)
+
+
+def test_commands_round_trip():
+    recorder = ReplayRecorder(0x1234567890abcdef,12,24,Handling(10,2,30),True)
+    rng = random.Random(1)
+    tick = 0
+    commands = []
+    for _ in range(500):
+        # Deltas of one to three varint bytes
+        tick += rng.choice((0,1,127,128,300,20000))
+        command = rng.choice(list(Command))
+        recorder.record(tick,command)
+        commands.append((tick,command))
+    replay = Replay(recorder.toBytes(tick+5,4200))
+    assert replay.commands == commands
+    assert (replay.seed,replay.nbTicks,replay.score) == (0x1234567890abcdef,tick+5,4200)
+    assert (replay.nbColumns,replay.nbRows,replay.handling,replay.kicks) == (12,24,Handling(10,2,30),True)
+
+
+def test_saved_game_verifies(tmp_path):
+    engine = Engine(42,fAnimateErase=False)
+    recorder = ReplayRecorder(engine.seed)
+    engine.recorder = recorder
+    rng = random.Random(42)
+    while not engine.fEnded:
+        if rng.random() < 0.05:
+            engine.pendingCommands.append(rng.choice((Command.MoveLeft,Command.MoveRight,Command.Rotate,
+                                                      Command.StopMove,Command.HardDrop)))
+        engine.tick()
+    filename = str(tmp_path / 'game.replay')
+    saveReplay(filename,engine,recorder)
+    replay = Replay.load(filename)
+    assert replay.verify()
+    assert replay.play().nbPieces == engine.nbPieces
+    # The frames end on the last tick of the game
+    assert list(replay.frames(1000))[-1].nbTicks == engine.nbTicks
+
+
+def test_play_refuses_another_board():
+    replay = Replay(ReplayRecorder(3,nbColumns=8).toBytes(10,0))
+    with pytest.raises(ValueError):
+        replay.play(Engine(3))
+    with pytest.raises(ValueError):
+        replay.play(Engine(3,nbColumns=8,kicks=True))
+    assert replay.play(Engine(5,nbColumns=8)).seed == 3
+
+
+def test_older_versions_load():
+    body = bytes((3,Command.Rotate,0x80,0x01,Command.Drop))
+    commands = [(3,Command.Rotate),(131,Command.Drop)]
+    v1 = Replay(HEADER_V1.pack(MAGIC,1,7,200,0) + body)
+    assert (v1.nbColumns,v1.nbRows,v1.handling,v1.kicks,v1.commands) == (10,20,None,False,commands)
+    v2 = Replay(HEADER_V2.pack(MAGIC,2,7,200,0,12,22) + body)
+    assert (v2.nbColumns,v2.nbRows,v2.commands) == (12,22,commands)
+    v3 = Replay(HEADER_V3.pack(MAGIC,3,7,200,0,10,20,True,17,2,50) + body)
+    assert (v3.handling,v3.kicks,v3.commands) == (Handling(17,2,50),False,commands)
+    # The version 4 classic games wrote the kicks flag of the default handling
+    v4 = Replay(HEADER.pack(MAGIC,4,7,200,0,10,20,False,17,2,50,True) + body)
+    assert (v4.handling,v4.kicks) == (None,False)
+    v4 = Replay(HEADER.pack(MAGIC,4,7,200,0,10,20,True,17,2,50,True) + body)
+    assert (v4.handling,v4.kicks) == (Handling(17,2,50),True)
+    with pytest.raises(ValueError):
+        Replay(HEADER.pack(MAGIC,VERSION+1,7,200,0,10,20,False,0,0,0,False))
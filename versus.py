@@ -0,0 +1,89 @@
+"""  Local versus game of 2 to 4 players  """
+
+import random
+from board import BitBoard
+from engine import NB_COLUMNS, NB_ROWS, Engine, Command, Event, GridTetromino, Handling
+
+class Versus:
+    '''Engines of the players stepped together by one clock
+
+    The engines start with the same seed, the players get the same
+    tetrominos. After each step the garbage lines sent by a player go to
+    the next player still playing, they rise on the board of the target
+    when it freezes its next tetromino without completing a line.
+    The last player playing wins, winner is -1 for a draw. With a single
+    player it is a classic game, the garbage lines are dropped.
+    '''
+
+    def __init__(self, nbPlayers: int = 2, seed: int = None, boardClass = BitBoard, fAnimateErase: bool = True,
+                 tetrominoClass = GridTetromino, nbColumns: int = NB_COLUMNS, nbRows: int = NB_ROWS,
+                 handling: Handling = None, kicks: bool = False):
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        self.engines = [Engine(seed,boardClass,fAnimateErase,tetrominoClass,nbColumns,nbRows,handling,kicks)
+                        for i in range(nbPlayers)]
+        self.seed = seed
+        self.winner = None
+        self.fEnded = False
+
+    def newGame(self, seed: int = None):
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        self.seed = seed
+        for engine in self.engines:
+            engine.newGame(seed)
+        self.winner = None
+        self.fEnded = False
+
+    def target(self, i: int)->int:
+        '''the player receiving the garbage lines of player i, -1 if none'''
+        nbPlayers = len(self.engines)
+        for j in range(1,nbPlayers):
+            k = (i+j) % nbPlayers
+            if not self.engines[k].fGameOver:
+                return k
+        return -1
+
+    def sendGarbage(self):
+        for i,engine in enumerate(self.engines):
+            if engine.garbageOut>0:
+                k = self.target(i)
+                if k>=0:
+                    self.engines[k].pendingCommands.extend(Command.Garbage for _ in range(engine.garbageOut))
+                engine.garbageOut = 0
+
+    def checkWinner(self):
+        if len(self.engines)>1 and self.winner is None:
+            alive = [i for i,engine in enumerate(self.engines) if not engine.fGameOver]
+            if len(alive)<=1:
+                self.winner = alive[0] if alive else -1
+        if self.winner is not None and not self.fEnded:
+            # Let the game over of the losers end
+            self.fEnded = all(engine.fEnded for i,engine in enumerate(self.engines) if i != self.winner)
+
+    def step(self, dt: float, inputs: list) -> list[list[Event]]:
+        '''step each engine with its inputs, returns the events of each engine'''
+        events = [engine.step(dt,engineInputs) for engine,engineInputs in zip(self.engines,inputs)]
+        self.sendGarbage()
+        self.checkWinner()
+        return events
+
+    def tick(self, inputs: list):
+        '''one tick of each engine with its commands, the events are added to engine.events
+
+        Unlike step() the garbage lines are sent after each tick whatever
+        the frame rate, the network games run the same ticks on each side.
+        '''
+        for engine,commands in zip(self.engines,inputs):
+            engine.pendingCommands.extend(commands)
+            engine.tick()
+        self.sendGarbage()
+        self.checkWinner()
+
+    def snapshot(self)->tuple:
+        return (tuple(engine.snapshot() for engine in self.engines),self.winner,self.fEnded)
+
+    def restore(self, state: tuple):
+        engines,self.winner,self.fEnded = state
+        for engine,engineState in zip(self.engines,engines):
+            engine.restore(engineState)